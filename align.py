@@ -0,0 +1,153 @@
+"""
+Align Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Joins monthly series from several sources (e.g. GDP releases ending in different months, or
+# other StatCan tables such as employment or CPI in the same CSV layout) into one Panel on a
+# shared month axis. Month ordinals are consecutive integers, so the months of every source
+# are merged in one linear pass over an array covering the whole range of months, and each
+# value is placed by the offset of its month, without sorting or per-row dictionary lookups.
+#
+# Gap modes, for the months that some sources do not have:
+#   'nan'    the missing values are NaN
+#   'ffill'  every missing value is the last value of its series before it (NaN if none)
+#   'drop'   only the months that every source has are kept
+
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+from data import CACHE_DIR, Panel, cached_panel, load_panel, load_sector_panel
+
+GAP_MODES = ['nan', 'ffill', 'drop']
+
+
+def merge_months(month_arrays: list[np.ndarray], gaps: str = 'nan') \
+        -> tuple[np.ndarray, list[np.ndarray]]:
+    """Return the months of the aligned axis of the sources whose months are in month_arrays
+    (every month of any source, or with gaps='drop' the months of every source), and the
+    column of each month of each source on that axis (-1 for months that are dropped).
+
+    Preconditions:
+        - len(month_arrays) != 0
+        - all(len(months) != 0 for months in month_arrays)
+        - all months arrays are strictly increasing
+        - gaps in GAP_MODES
+
+    >>> axis, columns = merge_months([np.array([3, 4, 6]), np.array([4, 5, 6, 7])])
+    >>> axis.tolist(), [c.tolist() for c in columns]
+    ([3, 4, 5, 6, 7], [[0, 1, 3], [1, 2, 3, 4]])
+    >>> axis, columns = merge_months([np.array([3, 4, 6]), np.array([4, 5, 6, 7])], 'drop')
+    >>> axis.tolist(), [c.tolist() for c in columns]
+    ([4, 6], [[-1, 0, 1], [0, -1, 1, -1]])
+    """
+    first = min(int(months[0]) for months in month_arrays)
+    last = max(int(months[-1]) for months in month_arrays)
+
+    # ACCUMULATOR counts: the number of sources having each month of the range, so far
+    counts = np.zeros(last - first + 1, dtype=np.int64)
+    for months in month_arrays:
+        counts[months - first] += 1
+
+    kept = counts == len(month_arrays) if gaps == 'drop' else counts > 0
+    column_of = np.where(kept, np.cumsum(kept) - 1, -1)
+    axis = np.flatnonzero(kept) + first
+    return axis, [column_of[months - first] for months in month_arrays]
+
+
+def align_panels(panels: dict[str, Panel], gaps: str = 'nan') -> Panel:
+    """Return one panel holding every series of every panel in panels (a dictionary mapping
+    the name of each source to its panel) on the months merged by merge_months. The series are
+    named '<source>: <series>', and the groups of the returned panel are the sources.
+
+    The values are int64 if none of them are missing, and float64 with NaN for missing values
+    otherwise. Such a panel can be passed to computation.run_computations (through
+    Panel.to_dict) once it has no missing values, e.g. with gaps='drop'.
+
+    Preconditions:
+        - len(panels) != 0
+        - gaps in GAP_MODES
+
+    >>> a = Panel(['GDP'], np.array([24240, 24241, 24242]), np.array([[5, 6, 7]]))
+    >>> b = Panel(['CPI'], np.array([24241, 24242, 24243]), np.array([[1, 2, 3]]))
+    >>> align_panels({'a': a, 'b': b}).values.tolist()
+    [[5.0, 6.0, 7.0, nan], [nan, 1.0, 2.0, 3.0]]
+    >>> align_panels({'a': a, 'b': b}, 'ffill').values.tolist()
+    [[5.0, 6.0, 7.0, 7.0], [nan, 1.0, 2.0, 3.0]]
+    >>> aligned = align_panels({'a': a, 'b': b}, 'drop')
+    >>> aligned.industries, aligned.dates, aligned.values.tolist()
+    (['a: GDP', 'b: CPI'], [(2020, 2), (2020, 3)], [[6, 7], [1, 2]])
+    """
+    axis, columns = merge_months([panel.months for panel in panels.values()], gaps)
+    num_rows = sum(len(panel.industries) for panel in panels.values())
+    values = np.full((num_rows, len(axis)), np.nan)
+
+    # ACCUMULATORS: the names of the rows and the rows of each source so far
+    industries = []
+    groups = {}
+    for (source, panel), source_columns in zip(panels.items(), columns):
+        start = len(industries)
+        industries.extend(f'{source}: {industry}' for industry in panel.industries)
+        present = source_columns >= 0
+        values[start:len(industries), source_columns[present]] = panel.values[:, present]
+        groups[source] = slice(start, len(industries))
+
+    if gaps == 'ffill':
+        values = forward_fill(values)
+    if not np.isnan(values).any():
+        values = np.round(values).astype(np.int64)
+    return Panel(industries=industries, months=axis, values=values, groups=groups)
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """Return values with every NaN replaced by the last value before it in its row, or left
+    NaN if there is none.
+
+    >>> forward_fill(np.array([[np.nan, 1.0, np.nan, np.nan, 4.0]])).tolist()
+    [[nan, 1.0, 1.0, 1.0, 4.0]]
+    """
+    columns = np.arange(values.shape[1])
+    last_present = np.maximum.accumulate(np.where(np.isnan(values), 0, columns), axis=1)
+    return values[np.arange(len(values))[:, np.newaxis], last_present]
+
+
+def open_and_align(filenames: list[str], gaps: str = 'nan', sectors: bool = False,
+                   cache_dir: str | None = CACHE_DIR) -> Panel:
+    """Return the panel of every series in the tables in filenames (in the CSV layout of
+    samp1.csv, e.g. GDP, employment or CPI), aligned by align_panels. Each source is named
+    after its file, without the directory and extension. Only the economic sectors of each
+    table are kept if sectors is True (see data.load_sector_panel).
+
+    The tables are loaded from cache_dir if they were parsed before (see data.cached_panel).
+
+    Preconditions:
+        - len(filenames) != 0
+        - gaps in GAP_MODES
+
+    >>> panel = open_and_align(['samp1.csv', 'samp2.csv'], 'drop', sectors=True, cache_dir=None)
+    >>> panel.dates[0], panel.dates[-1], list(panel.groups)
+    ((2014, 1), (2021, 8), ['samp1', 'samp2'])
+    """
+    stage = 'sectors' if sectors else 'industries'
+    load = load_sector_panel if sectors else load_panel
+    panels = {os.path.splitext(os.path.basename(filename))[0]:
+              cached_panel(filename, stage, lambda name=filename: load(name), cache_dir)
+              for filename in filenames}
+    return align_panels(panels, gaps)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['os', 'numpy', 'data'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
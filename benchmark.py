@@ -0,0 +1,183 @@
+"""
+Benchmark Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Times and memory-profiles each stage of the program on synthetic datasets of several sizes,
+# and appends the results (with the current git commit) to a JSON file, so that the cost of
+# each stage can be compared from one commit to the next.
+#
+# Usage: python benchmark.py [--sizes 50x120 500x240 ...] [--output benchmark_results.json]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from data import aggregate_4_sectors, categorize_4_sectors, file_to_list, list_to_dict, \
+    load_panel, load_sector_panel
+from computation import bootstrap_intervals, run_computations
+from synthetic import write_synthetic_csv
+
+# (industries, months) of the datasets benchmarked by default
+DEFAULT_SIZES = [(50, 120), (500, 240), (2000, 480)]
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+
+def measure(function: Callable[[], Any], repeat: int = 3) -> tuple[Any, float, int]:
+    """Call function repeat times and return its result, its fastest wall time in seconds and
+    the peak memory (in bytes) it allocated, measured with tracemalloc in one extra call.
+
+    Preconditions:
+        - repeat >= 1
+    """
+    # ACCUMULATOR fastest: the fastest time of the calls so far
+    fastest = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        fastest = min(fastest, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, fastest, peak
+
+
+def benchmark_size(num_industries: int, num_months: int, directory: str,
+                   repeat: int = 3) -> list[dict]:
+    """Write a synthetic dataset of num_industries industries and num_months months (ending in
+    August 2021) to directory, and return the time and peak memory of each stage on it.
+
+    Preconditions:
+        - num_industries >= 1
+        - num_months >= 80  # the dataset must include March to May 2020
+    """
+    filename = os.path.join(directory, f'synthetic_{num_industries}x{num_months}.csv')
+    write_synthetic_csv(filename, num_industries, num_months)
+
+    rows, *_ = measure(lambda: file_to_list(filename), repeat)
+    data, *_ = measure(lambda: list_to_dict(rows), repeat)
+    categories, *_ = measure(lambda: categorize_4_sectors(data), repeat)
+    sectors, *_ = measure(lambda: aggregate_4_sectors(categories), repeat)
+
+    stages = {'file_to_list': lambda: file_to_list(filename),
+              'list_to_dict': lambda: list_to_dict(rows),
+              'categorize_4_sectors': lambda: categorize_4_sectors(data),
+              'aggregate_4_sectors': lambda: aggregate_4_sectors(categories),
+              'load_panel': lambda: load_panel(filename),
+              'load_sector_panel': lambda: load_sector_panel(filename),
+              'run_computations': lambda: run_computations(sectors),
+              'bootstrap_intervals': lambda: bootstrap_intervals(sectors, replicates=1000)}
+    stages.update(_graph_stages(sectors))
+
+    # ACCUMULATOR results: the measurements of the stages so far
+    results = []
+    for stage, function in stages.items():
+        _, seconds, peak = measure(function, repeat)
+        results.append({'stage': stage, 'industries': num_industries, 'months': num_months,
+                        'seconds': seconds, 'peak_bytes': peak})
+
+    return results
+
+
+def _graph_stages(sectors: dict) -> dict[str, Callable[[], Any]]:
+    """Return the stages that build the data of the graphs of the sectors in sectors."""
+    from display import Sector, sectors_frame, window_frame
+
+    data_points = run_computations(sectors)
+    sector_objects = [Sector(name, points[0], points[1]) for name, points in data_points.items()]
+    return {'sectors_frame': lambda: sectors_frame(sector_objects),
+            'window_frame': lambda: window_frame(sector_objects)}
+
+
+def run_benchmarks(sizes: list[tuple[int, int]], output: str = DEFAULT_OUTPUT,
+                   repeat: int = 3) -> dict:
+    """Benchmark every stage on a synthetic dataset of each (industries, months) size in sizes,
+    append the run to the JSON list in output and return it.
+
+    Preconditions:
+        - len(sizes) != 0
+        - output != ''
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        results = [result for num_industries, num_months in sizes
+                   for result in benchmark_size(num_industries, num_months, directory, repeat)]
+
+    run = {'commit': current_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'python': platform.python_version(), 'results': results}
+
+    runs = []
+    if os.path.exists(output):
+        with open(output) as f:
+            runs = json.load(f)
+    runs.append(run)
+    with open(output, 'w') as f:
+        json.dump(runs, f, indent=2)
+
+    return run
+
+
+def current_commit() -> str:
+    """Return the hash of the git commit checked out in the current directory, or '' if it is
+    not a git repository."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return result.stdout.strip()
+
+
+def format_run(run: dict) -> str:
+    """Return the results of a benchmark run as a plain text table.
+
+    >>> print(format_run({'results': [{'stage': 'load_panel', 'industries': 50, 'months': 120, \
+'seconds': 0.0012, 'peak_bytes': 204800}]}))
+    load_panel                  50 x 120       1.20 ms      200.0 KiB
+    """
+    return '\n'.join(f"{result['stage']:<22} {result['industries']:>7} x {result['months']:<6}"
+                     f"{result['seconds'] * 1000:>8.2f} ms {result['peak_bytes'] / 1024:>10.1f} KiB"
+                     for result in run['results'])
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    """Return the (industries, months) size written as INDUSTRIESxMONTHS in text.
+
+    >>> parse_size('500x240')
+    (500, 240)
+    """
+    industries, months = text.lower().split('x')
+    return int(industries), int(months)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['argparse', 'json', 'os', 'platform', 'subprocess', 'tempfile',
+    #                       'time', 'tracemalloc', 'typing', 'data', 'computation', 'synthetic',
+    #                       'display'],
+    #     'allowed-io': ['run_benchmarks'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the program.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=DEFAULT_SIZES,
+                        metavar='INDUSTRIESxMONTHS')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(format_run(run_benchmarks(args.sizes, args.output, args.repeat)))
@@ -0,0 +1,106 @@
+"""
+Breaks Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Scans every month of every series as a possible structural break (like March 2020): the
+# series' trend before the month is compared with its values in the months that follow.
+# Prefix sums give the line of best fit before every candidate month at once, so the whole
+# scan costs O(months) per series instead of one regression per candidate month.
+
+import numpy as np
+
+from data import Panel, ordinal_to_month
+
+
+def scan_breaks(values: np.ndarray, horizon: int = 3, min_pre: int = 12) -> np.ndarray:
+    """Return the break score of every candidate month of every series (row) in values.
+
+    The score of month k is the mean deviation of the horizon values starting at k from
+    the line of best fit through the values before k, divided by the standard deviation of
+    the residuals of that line. Large negative scores mark sudden drops. Months with fewer
+    than min_pre values before them, or fewer than horizon values from them on, are NaN.
+
+    Preconditions:
+        - horizon >= 1
+        - min_pre >= 3
+
+    >>> series = np.array([[10, 11, 13, 13, 14, 16, 16, 17, 5, 6, 7, 7]])
+    >>> scores = scan_breaks(series, horizon=2, min_pre=4)
+    >>> int(np.nanargmin(scores[0]))
+    8
+    """
+    values = np.asarray(values, dtype=np.float64)
+    # Shifting every series by its first value leaves the fits unchanged and keeps the
+    # prefix sums of squares small
+    values = values - values[..., :1]
+    num_months = values.shape[-1]
+
+    x_coords = np.arange(num_months, dtype=np.float64)
+    zeros = np.zeros(values.shape[:-1] + (1,))
+    sum_y = np.concatenate([zeros, np.cumsum(values, axis=-1)], axis=-1)
+    sum_xy = np.concatenate([zeros, np.cumsum(values * x_coords, axis=-1)], axis=-1)
+    sum_yy = np.concatenate([zeros, np.cumsum(values * values, axis=-1)], axis=-1)
+
+    # Statistics of the values before every candidate month k = 0, 1, ..., num_months - 1
+    n = np.arange(num_months, dtype=np.float64)
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    pre_y = sum_y[..., :-1]
+    pre_xy = sum_xy[..., :-1]
+    pre_yy = sum_yy[..., :-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centred_xx = sum_xx - sum_x ** 2 / n
+        centred_xy = pre_xy - sum_x * pre_y / n
+        centred_yy = pre_yy - pre_y ** 2 / n
+        slopes = centred_xy / centred_xx
+        intercepts = (pre_y - slopes * sum_x) / n
+        residual_sd = np.sqrt(np.maximum(centred_yy - slopes * centred_xy, 0) / (n - 2))
+
+        # Sum of the horizon values from every candidate month on, and of their projections
+        end = np.minimum(np.arange(num_months) + horizon, num_months)
+        actual = sum_y[..., end] - pre_y
+        projected = slopes * (horizon * n + horizon * (horizon - 1) / 2) + horizon * intercepts
+
+        scores = (actual - projected) / (horizon * residual_sd)
+
+    valid = (n >= min_pre) & (n + horizon <= num_months)
+    return np.where(valid, scores, np.nan)
+
+
+def rank_breaks(panel: Panel, horizon: int = 3, min_pre: int = 12, top: int = 10) \
+        -> list[tuple[str, tuple[int, int], float]]:
+    """Return the top most negative break scores over every series and month of panel, as
+    (series name, year-month, score) tuples, most negative first.
+
+    Preconditions:
+        - top >= 0
+
+    >>> from data import load_panel
+    >>> name, date, _ = rank_breaks(load_panel('samp1.csv'), top=1)[0]
+    >>> date
+    (2020, 3)
+    """
+    scores = scan_breaks(panel.values, horizon, min_pre)
+    flat = np.where(np.isnan(scores), np.inf, scores).ravel()
+    count = min(top, int(np.isfinite(flat).sum()))
+    best = np.argsort(flat, kind='stable')[:count]
+
+    rows, columns = np.unravel_index(best, scores.shape)
+    return [(panel.industries[row], ordinal_to_month(panel.months[column]),
+             float(scores[row, column])) for row, column in zip(rows.tolist(), columns.tolist())]
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['numpy', 'data'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
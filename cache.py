@@ -0,0 +1,181 @@
+"""
+Cache Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Keeps parsed datasets on disk so that unchanged files are not parsed again. Each entry is a
+# .npy file of GDP values (loaded as a memory map), a .flags.npy file of the status flags of the
+# values if any is flagged (also loaded as a memory map) and a small .json file describing it.
+# The running sums of the trends of each table (see computation.refreshed_trends) are kept
+# next to the entries, in one .npz file per table and event.
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import BinaryIO, Callable
+
+import numpy as np
+
+# The most entries kept in one cache directory; the least recently used are evicted first
+MAX_ENTRIES = 32
+
+
+def file_digest(filename: str) -> str:
+    """Return the SHA-256 hex digest of the contents of filename, read in 1 MiB blocks.
+
+    Preconditions:
+        - filename != ''
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def entry_key(digest: str, stage: str, version: int) -> str:
+    """Return the name of the cache entry for the output of stage on a file with the given
+    content digest, produced by version of the parser.
+
+    >>> entry_key('0123456789abcdef0123456789', 'sectors', 2)
+    'sectors-0123456789abcdef01234567-v2'
+    """
+    return f'{stage}-{digest[:24]}-v{version}'
+
+
+def load_entry(cache_dir: str, key: str) -> tuple[np.ndarray, dict, np.ndarray | None] | None:
+    """Return the values and the status flags (memory-mapped, read-only; None if the entry has
+    no flags) and the metadata of the cache entry key in cache_dir, or None if there is no such
+    entry.
+
+    Preconditions:
+        - cache_dir != ''
+
+    >>> import tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> store_entry(cache_dir, 'sectors-0-v1', 'samp1.csv', np.array([[1.0, np.nan]]), {}, \
+np.array([[0, 2]], dtype=np.int8))
+    >>> values, data, flags = load_entry(cache_dir, 'sectors-0-v1')
+    >>> type(flags).__name__, flags.tolist()
+    ('memmap', [[0, 2]])
+    """
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(path + '.json') as f:
+            metadata = json.load(f)
+        values = np.load(path + '.npy', mmap_mode='r')
+        flags = np.load(path + '.flags.npy', mmap_mode='r') if metadata['flags'] else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+    os.utime(path + '.json')  # mark as recently used
+    return values, metadata['data'], flags
+
+
+def store_entry(cache_dir: str, key: str, source: str, values: np.ndarray, data: dict,
+                flags: np.ndarray | None = None) -> None:
+    """Store values, their status flags (if any) and data (JSON-serializable) as the cache
+    entry key in cache_dir, then evict the entries made stale by it.
+
+    Each file is written under a temporary name and then renamed, so that other processes
+    never load a partially written entry. The .json file is written last.
+
+    Preconditions:
+        - cache_dir != ''
+        - source != ''
+        - flags is None or flags.shape == values.shape
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    stage = key.split('-')[0]
+
+    write_atomically(path + '.npy', lambda f: np.save(f, np.ascontiguousarray(values)))
+    if flags is not None:
+        write_atomically(path + '.flags.npy', lambda f: np.save(f, np.ascontiguousarray(flags)))
+    metadata = {'source': os.path.abspath(source), 'stage': stage, 'flags': flags is not None,
+                'data': data}
+    write_atomically(path + '.json', lambda f: f.write(json.dumps(metadata).encode()))
+
+    evict_stale(cache_dir, key, metadata['source'], stage)
+
+
+def trends_file(cache_dir: str, source: str, name: str) -> str:
+    """Return the path of the file in cache_dir holding the running sums of the trends called
+    name (e.g. of the sectors before an event) of the series in source. Unlike the entries,
+    it is named after the path of source rather than its contents, so that the sums are
+    updated rather than computed again when a new release of the table replaces source.
+
+    >>> path = trends_file('.gdp_cache', 'samp1.csv', 'sectors-2020-03')
+    >>> os.path.dirname(path), os.path.basename(path)[24:]
+    ('.gdp_cache', '-sectors-2020-03.trends.npz')
+    """
+    digest = hashlib.sha256(os.path.abspath(source).encode()).hexdigest()
+    return os.path.join(cache_dir, f'{digest[:24]}-{name}.trends.npz')
+
+
+def evict_stale(cache_dir: str, key: str, source: str, stage: str) -> None:
+    """Remove every entry in cache_dir other than key that holds the output of stage for the
+    same source file (its contents or the parser have changed since), then remove the least
+    recently used entries until at most MAX_ENTRIES remain.
+
+    Preconditions:
+        - cache_dir != ''
+    """
+    # ACCUMULATOR entries: (last use, path without extension) of each entry kept so far
+    entries = []
+    for metadata_file in glob.glob(os.path.join(cache_dir, '*.json')):
+        path = metadata_file[:-len('.json')]
+        try:
+            with open(metadata_file) as f:
+                metadata = json.load(f)
+            last_used = os.path.getmtime(metadata_file)
+        except (OSError, ValueError):
+            continue
+
+        if os.path.basename(path) != key and (metadata['source'], metadata['stage']) \
+                == (source, stage):
+            remove_entry(path)
+        else:
+            entries.append((last_used, path))
+
+    entries.sort(reverse=True)
+    for _, path in entries[MAX_ENTRIES:]:
+        remove_entry(path)
+
+
+def remove_entry(path: str) -> None:
+    """Remove the files of the cache entry at path (without extension), if they exist."""
+    for extension in ('.json', '.npy', '.flags.npy'):
+        try:
+            os.remove(path + extension)
+        except FileNotFoundError:
+            pass
+
+
+def write_atomically(path: str, write: Callable[[BinaryIO], object]) -> None:
+    """Call write on a temporary binary file next to path, then rename it to path, so that
+    other processes never read a partially written file."""
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['glob', 'hashlib', 'json', 'os', 'tempfile', 'typing', 'numpy'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
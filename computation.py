@@ -3,58 +3,142 @@ Computation Module for the final project (CSC110 at the University of Toronto)
 This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
 """
 
-# from sklearn.linear_model import LinearRegression
-from sklearn import linear_model
+from __future__ import annotations
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
 import numpy as np
 
+import cache
+from data import DateIndex, ValidationError, is_valid_data, is_valid_series, is_validated, \
+    missing_value_errors
+from instrumentation import Instrumentation, measure_stage
+
 
 ##########################################
 # 1. Main function taking input from Data Module and returning output for Display Module
 ##########################################
 
 
-def run_computations(data: dict[str, list[tuple[tuple[int, int], int]]]) \
+@dataclass(frozen=True)
+class EventWindow:
+    """Dataclass describing the months following an economic shock, over which the actual GDP
+    values are compared with the trend of the values before the shock.
+    Instance Attributes:
+      - start: the year and month in which the shock starts
+      - length: the number of months in the window, starting with start
+      - label: a name for the event
+    Representation Invariants:
+      - 1 <= self.start[1] <= 12
+      - self.length >= 1
+    """
+    start: tuple[int, int]
+    length: int = 3
+    label: str = ''
+
+    def dates(self) -> list[tuple[int, int]]:
+        """Return the year-month tuples of the months in the window.
+
+        >>> EventWindow((2019, 11), 3).dates()
+        [(2019, 11), (2019, 12), (2020, 1)]
+        """
+        first = self.start[0] * 12 + self.start[1] - 1
+        return [((first + i) // 12, (first + i) % 12 + 1) for i in range(self.length)]
+
+
+COVID_WINDOW = EventWindow(start=(2020, 3), length=3, label='COVID-19')
+
+
+def run_computations(data: dict[str, list[tuple[tuple[int, int], int]]],
+                     window: EventWindow = COVID_WINDOW, index: DateIndex | None = None,
+                     instrumentation: Instrumentation | None = None, model: str = 'linear',
+                     max_workers: int | None = None, trends: str | None = None) \
         -> dict[str, tuple[list[tuple[tuple[int, int], int]], list[tuple[tuple[int, int], int]],
                            list[tuple[tuple[int, int], int]]]]:
     """ Given data, return a dictionary of sector mapped to a list of dates and actual values; a
     list of dates and expected values (rounded to the nearest integer); and a list of dates and
     deviations between the actual and expected values (rounded to the nearest integer).
 
+    The line of best fit is computed from the values before window (March 2020 by default) and
+    compared with the values in window. index is the DateIndex of the dates in data; it is
+    built from data if not given. Fitting and projecting are measured by instrumentation, if
+    it is given.
+
+    model is the name of the baseline in BASELINE_MODELS fitted to the values before window
+    instead of the line of best fit (e.g. 'seasonal'); every series in data (sectors, or
+    industries) is fitted in the same run. Models that cannot be fitted in one batch are
+    spread over max_workers processes (see fit_baselines).
+
+    If trends is the name of a file, the line of best fit comes from the running sums saved in
+    it, updated with only the months appended or revised since (see refreshed_trends).
+
     Preconditions:
         - len(data) != 0  # input dict is non-empty
         - all(len(sector_name) != 0 for sector_name in data.keys())  # sector names are non-empty
-        - all(len(data[sector_name]) != 0 for sector_name in data.keys())  # Each sector's
-        list of coordinates is non-empty; Note: non-empty lists of coordinates may not be strict
-        enough
-        - all(1 <= data[sector_name][i][0][1] <= 12 for i in range(len(data['Primary Sector'])) for
-        sector_name in data.keys())  # Months are between 1 and 12
-        - all(data[sector_name][i][1] >= 0 for i in range(len(data['Primary Sector'])) for
-        sector_name in data.keys())  # GDP values are non-negative
+        - is_validated(data) or is_valid_data(data)  # checked once at load (see data.py)
     """
-    index_of_covid = determine_index_of_covid(data['Primary Sector'])
+    sectors = list(data)
+    if index is None:
+        index = DateIndex.from_dates(dict_to_x_y_coords(data, sectors[0])[0])
+    window_start = event_start_index(window, index, BASELINE_MODELS[model].min_months)
 
     # ACCUMULATOR: dict_so_far: the running dictionary of computed data for each sector
     dict_so_far = {}
 
-    sectors = ['Primary Sector', 'Secondary Sector', 'Tertiary Sector', 'Quaternary Sector']
-    for sector in sectors:
-        x_y_coords = dict_to_x_y_coords(data, sector)
-        # x_y_coords: all coordinates in samp1.csv (i.e. from Jan 2014 to Aug 2021)
-        # x_y_coords[0]: dates
-        # x_y_coords[1]: actual GDP values
-
-        x_y_coords_for_prediction = (x_y_coords[0][:index_of_covid], x_y_coords[1][:index_of_covid])
-        # Note: slicing does not include end index (index_of_covid or (2020, 3))
+    with measure_stage(instrumentation, 'fit', rows=window_start, series=len(sectors)):
+        # One row of actual GDP values per sector, up to the end of window
+        used_values = np.array([dict_to_x_y_coords(data, sector)[1][:window_start + window.length]
+                                for sector in sectors])
+        check_present(sectors, index.months, used_values)
+        pre_event_values = used_values[:, :window_start]
+        if model == 'linear' and trends is not None:
+            slopes, intercepts = refreshed_trends(trends, sectors, pre_event_values).coefficients()
+        elif model == 'linear':
+            slopes, intercepts = fit_trends(pre_event_values)
+        else:
+            projections = fit_baselines(pre_event_values, index.months[:window_start],
+                                        window.length, model, max_workers)
+
+    if model != 'linear':
+        with measure_stage(instrumentation, 'project', rows=len(index), series=len(sectors)):
+            for sector, projected in zip(sectors, projections.tolist()):
+                dict_so_far[sector] = project_baseline(data[sector], projected, window, index)
+        return dict_so_far
+
+    with measure_stage(instrumentation, 'project', rows=len(index), series=len(sectors)):
+        for sector, slope, intercept in zip(sectors, slopes.tolist(), intercepts.tolist()):
+            lst_w_actual_values = actual_gdp_values(data[sector], window, index)
+            lst_w_predicted_values = predict_gdp_values(data[sector], slope, intercept, window,
+                                                        index)
+            deviations = calculate_dev(data[sector], slope, intercept, window, index)
+
+            dict_so_far[sector] = (lst_w_actual_values, lst_w_predicted_values, deviations)
 
-        slope, intercept = regress(x_y_coords_for_prediction)
+    return dict_so_far
 
-        lst_w_actual_values = actual_gdp_values(data[sector])
-        lst_w_predicted_values = predict_gdp_values(data[sector], slope, intercept)
-        deviations = calculate_dev(data[sector], slope, intercept)
 
-        dict_so_far[sector] = (lst_w_actual_values, lst_w_predicted_values, deviations)
+def run_events(data: dict[str, list[tuple[tuple[int, int], int]]],
+               windows: list[EventWindow], model: str = 'linear') -> dict[EventWindow, dict]:
+    """Return the output of run_computations (with the baseline called model) for every event
+    window in windows, all sharing a single DateIndex of data.
 
-    return dict_so_far
+    Preconditions:
+        - len(data) != 0
+        - len(windows) != 0
+
+    >>> from data import open_convert_and_aggregate
+    >>> data = open_convert_and_aggregate('samp1.csv', cache_dir=None)
+    >>> windows = [COVID_WINDOW, EventWindow((2015, 11), 4, 'Oil')]
+    >>> results = run_events(data, windows)
+    >>> results[windows[1]]['Primary Sector'][1][-3:]
+    [((2015, 12), 175504), ((2016, 1), 175413), ((2016, 2), 175321)]
+    """
+    index = DateIndex.from_dates(dict_to_x_y_coords(data, next(iter(data)))[0])
+    return {window: run_computations(data, window, index, model=model) for window in windows}
 
 
 ##########################################
@@ -71,13 +155,7 @@ def dict_to_x_y_coords(data: dict[str, list[tuple[tuple[int, int], int]]], secto
     Preconditions:
         - len(data) != 0  # input dict is non-empty
         - all(len(sector_name) != 0 for sector_name in data.keys())  # sector names are non-empty
-        - all(len(data[sector_name]) != 0 for sector_name in data.keys())  # Each sector's
-        list of coordinates is non-empty; Note: non-empty lists of coordinates may not be strict
-        enough
-        - all(1 <= data[sector_name][i][0][1] <= 12 for i in range(len(data[sector_name])) for
-        sector_name in data.keys())  # Months are between 1 and 12
-        - all(data[sector_name][i][1] >= 0 for i in range(len(data[sector_name])) for
-        sector_name in data.keys())  # GDP values are non-negative
+        - is_validated(data) or is_valid_data(data)  # checked once at load (see data.py)
         - len(sector) != 0
     """
     x_coords = [data[sector][index][0] for index in range(len(data[sector]))]
@@ -104,14 +182,386 @@ def regress(x_y_coords: tuple[list[tuple[int, int]], list[int]]) -> tuple[float,
     >>> round(coefficients[1])
     0
     """
-    model = linear_model.LinearRegression()
-    x_coords = np.arange(len(x_y_coords[0])).reshape(-1, 1)
-    y_coords = np.array(x_y_coords[1])
+    slope, intercept = fit_trends(np.array(x_y_coords[1]))
 
-    # Train model
-    model.fit(x_coords, y_coords)
+    return float(slope), float(intercept)
 
-    return model.coef_[0], model.intercept_
+
+def fit_trends(y_coords: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the slopes and intercepts of the lines of best fit through every row (last
+    axis) of y_coords, where the x-coordinate of each value is its column index. All rows
+    are fitted at once with the closed-form least squares solution.
+
+    Preconditions:
+        - y_coords.ndim >= 1
+        - y_coords.shape[-1] != 0
+
+    >>> slopes, intercepts = fit_trends(np.array([[0, 2, 4], [5, 4, 3]]))
+    >>> slopes.tolist(), intercepts.tolist()
+    ([2.0, -1.0], [0.0, 5.0])
+    """
+    n = y_coords.shape[-1]
+    x_centred = np.arange(n) - (n - 1) / 2
+    sum_of_squares = float(x_centred @ x_centred)
+    y_means = y_coords.mean(axis=-1)
+
+    if sum_of_squares == 0:
+        slopes = np.zeros_like(y_means)
+    else:
+        slopes = (y_coords @ x_centred) / sum_of_squares
+
+    return slopes, y_means - slopes * (n - 1) / 2
+
+
+@dataclass
+class TrendStats:
+    """Dataclass containing the running sums needed to fit the line of best fit through each
+    of several series, so that the lines can be updated in constant time per series when a
+    month is appended or revised, without the series' earlier values.
+    The x-coordinate of each value is its index in its series.
+    Instance Attributes:
+      - n: the number of values in each series
+      - sum_x: the sum of the x-coordinates of each series
+      - sum_y: the sum of the values of each series
+      - sum_xy: the sum of the products of each value and its x-coordinate
+      - sum_xx: the sum of the squares of the x-coordinates of each series
+    Representation Invariants:
+      - self.n.shape == self.sum_x.shape == self.sum_y.shape == self.sum_xy.shape \
+        == self.sum_xx.shape
+      - all(self.n >= 0)
+    """
+    n: np.ndarray
+    sum_x: np.ndarray
+    sum_y: np.ndarray
+    sum_xy: np.ndarray
+    sum_xx: np.ndarray
+
+    @staticmethod
+    def from_series(y_coords: np.ndarray) -> TrendStats:
+        """Return the running sums of every row (last axis) of y_coords.
+
+        >>> stats = TrendStats.from_series(np.array([[0, 2], [5, 4]]))
+        >>> stats.append(np.array([4, 3]))
+        >>> [coefficients.tolist() for coefficients in stats.coefficients()]
+        [[2.0, -1.0], [0.0, 5.0]]
+        """
+        length = y_coords.shape[-1]
+        x_coords = np.arange(length)
+        shape = y_coords.shape[:-1]
+
+        return TrendStats(n=np.full(shape, length, dtype=np.int64),
+                          sum_x=np.full(shape, x_coords.sum(), dtype=np.float64),
+                          sum_y=y_coords.sum(axis=-1).astype(np.float64),
+                          sum_xy=(y_coords @ x_coords).astype(np.float64),
+                          sum_xx=np.full(shape, x_coords @ x_coords, dtype=np.float64))
+
+    @staticmethod
+    def load(filename: str) -> tuple[TrendStats, dict[str, np.ndarray]]:
+        """Return the running sums saved in filename by TrendStats.save, and the other arrays
+        saved with them, by name.
+
+        Preconditions:
+            - filename != ''
+        """
+        with np.load(filename) as arrays:
+            stats = TrendStats(**{name: arrays[name] for name in TREND_SUMS})
+            return stats, {name: arrays[name] for name in arrays.files
+                           if name not in TREND_SUMS}
+
+    def save(self, filename: str, **arrays: np.ndarray) -> None:
+        """Save the running sums and arrays (e.g. the values the sums were computed from) to
+        filename, in NumPy's .npz format.
+
+        Preconditions:
+            - filename != ''
+            - not any(name in TREND_SUMS for name in arrays)
+        """
+        cache.write_atomically(filename, lambda f: np.savez(
+            f, n=self.n, sum_x=self.sum_x, sum_y=self.sum_y, sum_xy=self.sum_xy,
+            sum_xx=self.sum_xx, **arrays))
+
+    def append(self, y_values: np.ndarray) -> None:
+        """Add the next value of every series (one value per series) to the running sums."""
+        x_values = self.n.astype(np.float64)
+        self.n = self.n + 1
+        self.sum_x = self.sum_x + x_values
+        self.sum_y = self.sum_y + y_values
+        self.sum_xy = self.sum_xy + x_values * y_values
+        self.sum_xx = self.sum_xx + x_values * x_values
+
+    def revise(self, index: int, old_values: np.ndarray, new_values: np.ndarray) -> None:
+        """Replace the value at index of every series, which was old_values, with new_values.
+
+        Preconditions:
+            - all(0 <= index < self.n)
+        """
+        change = np.asarray(new_values, dtype=np.float64) - old_values
+        self.sum_y = self.sum_y + change
+        self.sum_xy = self.sum_xy + index * change
+
+    def coefficients(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the slope and intercept of the line of best fit through every series.
+        A series with a single value has a slope of 0."""
+        denominator = self.n * self.sum_xx - self.sum_x ** 2
+        numerator = self.n * self.sum_xy - self.sum_x * self.sum_y
+        slopes = np.divide(numerator, denominator, out=np.zeros_like(numerator),
+                           where=denominator != 0)
+        intercepts = (self.sum_y - slopes * self.sum_x) / np.maximum(self.n, 1)
+        return slopes, intercepts
+
+    def deviations(self, y_values: np.ndarray, index: int) -> np.ndarray:
+        """Return the difference between y_values, the values of every series at index, and
+        the values that the series' lines of best fit predict at index."""
+        slopes, intercepts = self.coefficients()
+        return y_values - (slopes * index + intercepts)
+
+
+# The names of the running sums of TrendStats, as saved by TrendStats.save
+TREND_SUMS = ['n', 'sum_x', 'sum_y', 'sum_xy', 'sum_xx']
+
+
+def refresh_trends(stats: TrendStats, old_values: np.ndarray, new_values: np.ndarray) -> int:
+    """Update stats, the running sums of the rows of old_values, to the running sums of the
+    rows of new_values: every month whose value was revised is replaced and every month after
+    the end of old_values is appended, in constant time per month and series. Return the
+    number of months updated.
+
+    Preconditions:
+        - old_values.shape[0] == new_values.shape[0]
+        - old_values.shape[1] <= new_values.shape[1]
+
+    >>> old = np.array([[0, 2, 4], [5, 4, 3]])
+    >>> new = np.array([[0, 3, 4, 7, 8], [5, 4, 3, 1, 0]])
+    >>> stats = TrendStats.from_series(old)
+    >>> refresh_trends(stats, old, new)
+    3
+    >>> all(np.allclose(updated, refitted) for updated, refitted \
+in zip(stats.coefficients(), fit_trends(new)))
+    True
+    """
+    length = old_values.shape[1]
+    revised = np.flatnonzero(np.any(old_values != new_values[:, :length], axis=0))
+    for index in revised.tolist():
+        stats.revise(index, old_values[:, index], new_values[:, index])
+    for index in range(length, new_values.shape[1]):
+        stats.append(new_values[:, index])
+    return len(revised) + new_values.shape[1] - length
+
+
+def refreshed_trends(filename: str, series: list[str], values: np.ndarray) -> TrendStats:
+    """Return the running sums of the rows of values (the values of each series in series),
+    updated from the running sums saved in filename with only the months appended or revised
+    since they were saved (see refresh_trends), and save them there if they changed.
+
+    The sums are computed from every value if filename does not hold the sums of the same
+    series over at most as many months.
+
+    Preconditions:
+        - filename != ''
+        - len(series) == len(values)
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'trends.npz')
+    >>> stats = refreshed_trends(filename, ['A'], np.array([[0, 2, 4]]))
+    >>> stats = refreshed_trends(filename, ['A'], np.array([[0, 2, 4, 6]]))
+    >>> int(stats.n[0]), [float(coefficients[0]) for coefficients in stats.coefficients()]
+    (4, [2.0, 0.0])
+    """
+    try:
+        stats, saved = TrendStats.load(filename)
+        old_values = saved['values']
+        reusable = saved['series'].tolist() == series and old_values.shape[0] == len(series) \
+            and old_values.shape[1] <= values.shape[1]
+    except (OSError, ValueError, KeyError):
+        reusable = False
+
+    if reusable and refresh_trends(stats, old_values, values) == 0:
+        return stats
+    if not reusable:
+        stats = TrendStats.from_series(values)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    stats.save(filename, series=np.array(series), values=values)
+    return stats
+
+
+##########################################
+# 3b. Baseline models (alternatives to the line of best fit)
+##########################################
+
+
+@dataclass(frozen=True)
+class BaselineModel:
+    """Dataclass describing a model of the values of a series before an event, which is
+    projected over the months of the event window.
+    Instance Attributes:
+      - name: the name of the model, e.g. 'seasonal'
+      - fit: the function returning the projections of the model over the horizon months
+        following the values; its arguments are (values, months, horizon), where months are
+        the month ordinals of the values (the last axis of values)
+      - batched: whether fit takes every series at once (a 2D array, one series per row)
+        rather than one series (a 1D array) at a time
+      - min_months: the fewest values of a series that the model can be fitted to
+    Representation Invariants:
+      - self.name != ''
+      - self.min_months >= 2
+    """
+    name: str
+    fit: Callable[[np.ndarray, np.ndarray, int], np.ndarray]
+    batched: bool = True
+    min_months: int = 2
+
+
+# The fewest series worth sending to a process pool; smaller batches are fitted in this process
+PARALLEL_MIN_SERIES = 64
+
+
+def fit_baselines(values: np.ndarray, months: np.ndarray, horizon: int, model: str,
+                  max_workers: int | None = None) -> np.ndarray:
+    """Return the projections of the baseline called model, fitted to every row of values,
+    over the horizon months following months (the month ordinals of the columns of values).
+
+    Batched models fit every row at once. The others fit one row at a time, in a pool of
+    max_workers processes (one per CPU by default) if there are at least PARALLEL_MIN_SERIES
+    rows; the results do not depend on the number of processes.
+
+    Preconditions:
+        - values.ndim == 2
+        - values.shape[1] == len(months) != 0
+        - horizon >= 1
+        - model in BASELINE_MODELS
+
+    >>> values = np.array([[1, 2, 3, 4, 5, 6], [3, 5, 7, 9, 11, 13]])
+    >>> fit_baselines(values, np.arange(6), 2, 'polynomial').round(6).tolist()
+    [[7.0, 8.0], [15.0, 17.0]]
+    """
+    baseline = BASELINE_MODELS[model]
+    values = np.asarray(values, dtype=np.float64)
+    if baseline.batched:
+        return baseline.fit(values, months, horizon)
+    if len(values) < PARALLEL_MIN_SERIES or max_workers == 1:
+        return np.array([baseline.fit(row, months, horizon) for row in values])
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return np.array(list(executor.map(baseline.fit, values, itertools.repeat(months),
+                                          itertools.repeat(horizon), chunksize=16)))
+
+
+def fit_linear(values: np.ndarray, months: np.ndarray, horizon: int) -> np.ndarray:
+    """Return the projections of the line of best fit through every row of values over the
+    horizon months following them. Same as fit_trends, as a baseline model.
+
+    Preconditions:
+        - values.shape[-1] == len(months) != 0
+    """
+    slopes, intercepts = fit_trends(values)
+    positions = np.arange(len(months), len(months) + horizon)
+    return slopes[..., np.newaxis] * positions + intercepts[..., np.newaxis]
+
+
+def fit_polynomial(values: np.ndarray, months: np.ndarray, horizon: int,
+                   degree: int = 2) -> np.ndarray:
+    """Return the projections of the least squares polynomial of the given degree through
+    every row of values over the horizon months following them. Every row is fitted at once.
+
+    Preconditions:
+        - values.shape[-1] == len(months) != 0
+        - degree >= 0
+    """
+    n = len(months)
+    # Scaling the positions to [-1, 1] keeps the design matrix well conditioned
+    scale = max(n - 1, 1) / 2
+    design = _powers((np.arange(n) - scale) / scale, degree)
+    future = _powers((np.arange(n, n + horizon) - scale) / scale, degree)
+    return _project_least_squares(values, design, future)
+
+
+def fit_seasonal(values: np.ndarray, months: np.ndarray, horizon: int) -> np.ndarray:
+    """Return the projections of a linear trend plus one constant per calendar month (seasonal
+    dummies), fitted by least squares to every row of values at once, over the horizon months
+    following them.
+
+    Preconditions:
+        - values.shape[-1] == len(months) != 0
+    """
+    n = len(months)
+    future_months = months[-1] + np.arange(1, horizon + 1)
+    design = np.hstack([_powers(np.arange(n) / n, 1), _month_dummies(months)])
+    future = np.hstack([_powers(np.arange(n, n + horizon) / n, 1), _month_dummies(future_months)])
+    return _project_least_squares(values, design, future)
+
+
+# The smoothing parameters tried for each series by fit_holt_winters
+HOLT_WINTERS_GRID = (0.1, 0.3, 0.5, 0.7, 0.9)
+
+
+def fit_holt_winters(values: np.ndarray, months: np.ndarray, horizon: int) -> np.ndarray:
+    """Return the projections of additive Holt-Winters exponential smoothing (level, trend
+    and a 12-month season) of the series values over the horizon months following it.
+
+    The smoothing parameters are the combination in HOLT_WINTERS_GRID with the smallest sum of
+    squared one-step-ahead errors; every combination is run at once. Series shorter than two
+    years fall back to the line of best fit.
+
+    Preconditions:
+        - values.ndim == 1
+        - len(values) == len(months) != 0
+    """
+    period = 12
+    if len(values) < 2 * period:
+        return fit_linear(values, months, horizon)
+
+    alpha, beta, gamma = (grid.ravel() for grid in
+                          np.meshgrid(HOLT_WINTERS_GRID, HOLT_WINTERS_GRID, HOLT_WINTERS_GRID))
+    level = np.full(alpha.shape, values[:period].mean())
+    trend = np.full(alpha.shape, (values[period:2 * period].mean() - level[0]) / period)
+    season = np.tile(values[:period] - level[0], (len(alpha), 1))
+    errors = np.zeros(alpha.shape)
+
+    for t in range(period, len(values)):
+        s = t % period
+        errors += (values[t] - (level + trend + season[:, s])) ** 2
+        previous_level = level
+        level = alpha * (values[t] - season[:, s]) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        season[:, s] = gamma * (values[t] - level) + (1 - gamma) * season[:, s]
+
+    best = int(np.argmin(errors))
+    steps = np.arange(1, horizon + 1)
+    return level[best] + steps * trend[best] + season[best, (len(values) - 1 + steps) % period]
+
+
+def _powers(x_coords: np.ndarray, degree: int) -> np.ndarray:
+    """Return the matrix whose columns are x_coords to the powers 0, 1, ..., degree."""
+    return x_coords[:, np.newaxis] ** np.arange(degree + 1)
+
+
+def _month_dummies(months: np.ndarray) -> np.ndarray:
+    """Return one column per calendar month from February to December, which is 1 in the
+    rows of months (month ordinals) falling in that calendar month."""
+    return (months[:, np.newaxis] % 12 == np.arange(1, 12)).astype(np.float64)
+
+
+def _project_least_squares(values: np.ndarray, design: np.ndarray,
+                           future: np.ndarray) -> np.ndarray:
+    """Return future @ coefficients, where coefficients solve the least squares problem
+    design @ coefficients = values for every row of values at once."""
+    coefficients = np.linalg.lstsq(design, np.asarray(values, dtype=np.float64).T, rcond=None)[0]
+    return (future @ coefficients).T
+
+
+# The baseline models that run_computations can fit, by name
+BASELINE_MODELS = {model.name: model for model in
+                   [BaselineModel('linear', fit_linear),
+                    BaselineModel('polynomial', fit_polynomial, min_months=3),
+                    BaselineModel('seasonal', fit_seasonal, min_months=13),
+                    BaselineModel('holt-winters', fit_holt_winters, batched=False)]}
+
+
+def register_model(model: BaselineModel) -> None:
+    """Make model available to run_computations under its name, replacing any model with the
+    same name. For a model that is not batched to run in a process pool, model.fit must be a
+    function defined at the top level of a module."""
+    BASELINE_MODELS[model.name] = model
 
 
 ##########################################
@@ -120,105 +570,201 @@ def regress(x_y_coords: tuple[list[tuple[int, int]], list[int]]) -> tuple[float,
 ##########################################
 
 
-def actual_gdp_values(data: list[tuple[tuple[int, int], int]]) -> list[tuple[tuple[int, int], int]]:
-    """Returns list containing actual GDP values with dates going up to May 2020
+def actual_gdp_values(data: list[tuple[tuple[int, int], int]],
+                      window: EventWindow = COVID_WINDOW, index: DateIndex | None = None) \
+        -> list[tuple[tuple[int, int], int]]:
+    """Returns list containing actual GDP values with dates going up to the end of window
+    (May 2020 by default)
 
     Preconditions:
-        - all(len(data) != 0
-        - all(1 <= data[i][0][1] <= 12 for i in range(len(data))
-        # Months are between 1 and 12
-        - all(data[i][1] >= 0 for i in range(len(data)) # GDP values are non-negative
-        - any((data[i][0] == (2020, 3)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 4)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 5)) for i in range(0, len(data)))
+        - len(data) != 0
+        - is_validated(data) or is_valid_series(data)  # checked once at load (see data.py)
+        - the whole window is in data
     """
-    covid_start_index = determine_index_of_covid(data)
+    window_start = determine_window_start(data, window, index)
 
     lst_so_far = []
-    for i in range(0, covid_start_index + 3):
+    for i in range(0, window_start + window.length):
         lst_so_far.append(data[i])
     return lst_so_far
 
 
 def predict_gdp_values(data: list[tuple[tuple[int, int], int]], slope: float,
-                       intercept: float) -> list[tuple[tuple[int, int], int]]:
+                       intercept: float, window: EventWindow = COVID_WINDOW,
+                       index: DateIndex | None = None) -> list[tuple[tuple[int, int], int]]:
     """Similar use pf predict_gpd_values, expect this function takes a list as input and returns a
-    list
+    list. The values in window (March to May 2020 by default) are replaced by the values
+    predicted by the line of best fit.
 
     Preconditions:
-        - all(len(data) != 0
-        - all(1 <= data[i][0][1] <= 12 for i in range(len(data))
-        # Months are between 1 and 12
-        - all(data[i][1] >= 0 for i in range(len(data)) # GDP values are non-negative
-        - any((data[i][0] == (2020, 3)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 4)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 5)) for i in range(0, len(data)))
+        - len(data) != 0
+        - is_validated(data) or is_valid_series(data)  # checked once at load (see data.py)
+        - the whole window is in data
     """
-    pred_data = filter_data(data)
+    if index is None:
+        index = DateIndex.from_dates([point[0] for point in data])
+    pred_data = filter_data(data, window, index)
 
-    # determine index of March 2020 in list
-    covid_start_index = determine_index_of_covid(data)  # index of March 2020
+    # determine index of the start of window in list
+    window_start = determine_window_start(data, window, index)
 
-    for i in range(covid_start_index, covid_start_index + 3):
+    for i in range(window_start, window_start + window.length):
         predicted_gdp = int((i * round(slope, 3)) + round(intercept, 3))
-        pred_data.append(((2020, 3 + (i - covid_start_index)), predicted_gdp))
+        pred_data.append((index.date(i), predicted_gdp))
 
     return pred_data
 
 
-def filter_data(data: list[tuple[tuple[int, int], int]]) -> list[tuple[tuple[int, int], int]]:
+def filter_data(data: list[tuple[tuple[int, int], int]], window: EventWindow = COVID_WINDOW,
+                index: DateIndex | None = None) -> list[tuple[tuple[int, int], int]]:
     """ Helper Function for predict_gdp_values_to_list
-    Return dict containing values and dates associated to dates prior to start of covid (March 2020)
+    Return dict containing values and dates associated to dates prior to the start of window
+    (March 2020 by default)
 
     Preconditions:
-        - all(len(data) != 0
-        - any((data[i][0] == (2020, 3)) for i in range(0, len(data)))
+        - len(data) != 0
+        - window.start is in data
     """
-    # determine index of March 2020 in list
-    covid_start_index = determine_index_of_covid(data)  # index of March 2020
+    # determine index of the start of window in list
+    window_start = determine_window_start(data, window, index)
 
     lst_so_far = []
-    for i in range(0, covid_start_index):
+    for i in range(0, window_start):
         lst_so_far.append(data[i])
 
     return lst_so_far
 
 
+def determine_window_start(data: list[tuple[tuple[int, int], int]], window: EventWindow,
+                           index: DateIndex | None = None) -> int:
+    """Helper Function
+    Return the index of the start of window in data, using index (the DateIndex of data)
+    if it is given.
+
+    Preconditions:
+        - len(data) != 0
+        - window.start is in data
+    """
+    if index is None:
+        index = DateIndex.from_dates([point[0] for point in data])
+    return event_start_index(window, index)
+
+
+def check_present(names: list[str], months: np.ndarray, values: np.ndarray) -> None:
+    """Helper Function
+    Raise ValidationError if any value of values is missing (NaN, e.g. withheld), where the
+    rows of values are the series called names and its columns are the first months of months.
+    A baseline cannot be fitted to, or compared with, missing values.
+
+    >>> check_present(['A'], np.array([24240, 24241]), np.array([[1.0, np.nan]]))
+    Traceback (most recent call last):
+    ...
+    data.ValidationError: A has no value for (2020, 2) (e.g. it is withheld)
+    """
+    if values.dtype.kind == 'f':
+        errors = missing_value_errors(names, months, values)
+        if errors:
+            raise ValidationError('; '.join(errors))
+
+
+def event_start_index(window: EventWindow, index: DateIndex, min_months: int = 2) -> int:
+    """Helper Function
+    Return the position of the start of window in index, in constant time.
+
+    Raise ValueError if the start of window is not in index, if index ends before the end of
+    window, or if index has fewer than min_months months before window (the fewest months the
+    baseline can be fitted to, see BaselineModel.min_months).
+
+    Preconditions:
+        - min_months >= 1
+
+    >>> index = DateIndex.from_dates([(2019, 11), (2019, 12), (2020, 1), (2020, 2)])
+    >>> event_start_index(EventWindow((2020, 1), 2), index)
+    2
+    >>> event_start_index(EventWindow((2019, 12), 2, 'Oil'), index)
+    Traceback (most recent call last):
+    ...
+    ValueError: the event Oil has 1 month before it in the data; the baseline needs at least 2
+    """
+    name = window.label or f'{window.start[0]}-{window.start[1]:02}'
+    if window.start not in index:
+        raise ValueError(f'the start of the event {name} is not in the data')
+    start = index.position(window.start)
+    if start + window.length > len(index):
+        raise ValueError(f'the data ends before the end of the event {name}')
+    if start < min_months:
+        raise ValueError(f'the event {name} has {start} month{"" if start == 1 else "s"} before '
+                         f'it in the data; the baseline needs at least {min_months}')
+    return start
+
+
 def determine_index_of_covid(data: list[tuple[tuple[int, int], int]]) -> int:
     """Helper Function
     Determine index of March 2020 in list
     Preconditions:
-        - all(len(data) != 0
-        - all(1 <= data[i][0][1] <= 12 for i in range(len(data))
-        # Months are between 1 and 12
-        - all(data[i][1] >= 0 for i in range(len(data)) # GDP values are non-negative
+        - len(data) != 0
+        - is_validated(data) or is_valid_series(data)  # checked once at load (see data.py)
         - any((data[i][0] == (2020, 3)) for i in range(0, len(data)))
     """
-    for i in range(0, len(data)):
-        if data[i][0] == (2020, 3):
-            return i
-    return 0
+    return DateIndex.from_dates([point[0] for point in data]).position(COVID_WINDOW.start)
+
+
+def deviation_matrix(values: np.ndarray, slopes: np.ndarray, intercepts: np.ndarray,
+                     start: int, length: int) -> np.ndarray:
+    """Return the deviations between the actual values of every series (the last axis of
+    values) and its line of best fit, rounded to the nearest integer, for the length months
+    starting at index start. Same as calculate_dev, for all series at once.
+
+    Preconditions:
+        - values.shape[:-1] == slopes.shape == intercepts.shape
+        - 0 <= start and start + length <= values.shape[-1]
+
+    >>> deviation_matrix(np.array([[1, 2, 6, 9]]), np.array([1.0]), np.array([1.0]), 2, 2)
+    array([[3, 5]])
+    """
+    positions = np.arange(start, start + length)
+    projected = slopes[..., np.newaxis] * positions + intercepts[..., np.newaxis]
+    return values[..., start:start + length] - np.round(projected).astype(np.int64)
+
+
+def project_baseline(data: list[tuple[tuple[int, int], int]], projected: list[float],
+                     window: EventWindow = COVID_WINDOW, index: DateIndex | None = None) \
+        -> tuple[list[tuple[tuple[int, int], int]], list[tuple[tuple[int, int], int]],
+                 list[tuple[tuple[int, int], int]]]:
+    """Return the actual values, the expected values and the deviations of data (in the
+    format of run_computations) when the expected values in window are projected (e.g. by a
+    baseline model), rounded to the nearest integer.
+
+    Preconditions:
+        - len(projected) == window.length
+        - the whole window is in data
+    """
+    window_start = determine_window_start(data, window, index)
+    in_window = data[window_start:window_start + window.length]
+
+    expected = [(date, round(value)) for (date, _), value in zip(in_window, projected)]
+    deviations = [(date, actual - round(value)) for (date, actual), value in
+                  zip(in_window, projected)]
+    return data[:window_start + window.length], data[:window_start] + expected, deviations
 
 
 def calculate_dev(data: list[tuple[tuple[int, int], int]], slope: float,
-                  intercept: float) -> list[tuple[tuple[int, int], int]]:
+                  intercept: float, window: EventWindow = COVID_WINDOW,
+                  index: DateIndex | None = None) -> list[tuple[tuple[int, int], int]]:
     """ Return a dictionary of
     sector mapped to a list of dates and deviations between the actual
-    and expected values (rounded to the nearest integer)
+    and expected values (rounded to the nearest integer) in window (March to May 2020 by
+    default)
 
     Preconditions:
-        - all(len(data) != 0
-        - all(1 <= data[i][0][1] <= 12 for i in range(len(data))
-        # Months are between 1 and 12
-        - all(data[i][1] >= 0 for i in range(len(data)) # GDP values are non-negative
-        - any((data[i][0] == (2020, 3)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 4)) for i in range(0, len(data)))
-        - any((data[i][0] == (2020, 5)) for i in range(0, len(data)))
+        - len(data) != 0
+        - is_validated(data) or is_valid_series(data)  # checked once at load (see data.py)
+        - the whole window is in data
     """
     lst_so_far = []
-    covid_start_index = determine_index_of_covid(data)
+    window_start = determine_window_start(data, window, index)
 
-    for i in range(covid_start_index, covid_start_index + 3):
+    for i in range(window_start, window_start + window.length):
         projected_value = slope * i + intercept
         actual_value = data[i][1]
         dev = actual_value - round(projected_value)
@@ -227,11 +773,178 @@ def calculate_dev(data: list[tuple[tuple[int, int], int]], slope: float,
     return lst_so_far
 
 
+##########################################
+# 5. Bootstrap confidence intervals of the expected values and deviations
+##########################################
+
+
+@dataclass
+class BootstrapBands:
+    """Dataclass containing residual-bootstrap confidence intervals of the line of best fit of
+    several series over the months of an event window, and of the deviations from it.
+    Row i of each array belongs to series i, and column j to month j of the window.
+    Instance Attributes:
+      - level: the confidence level of the intervals, e.g. 0.95
+      - replicates: the number of bootstrap replicates the intervals are computed from
+      - expected_lower: the lower bounds of the projections of the lines of best fit
+      - expected_upper: the upper bounds of the projections of the lines of best fit
+      - deviation_lower: the lower bounds of the deviations (actual minus expected values),
+        including the month-to-month noise of the series around its line
+      - deviation_upper: the upper bounds of the deviations
+    Representation Invariants:
+      - 0 < self.level < 1
+      - self.expected_lower.shape == self.expected_upper.shape == self.deviation_lower.shape \
+        == self.deviation_upper.shape
+    """
+    level: float
+    replicates: int
+    expected_lower: np.ndarray
+    expected_upper: np.ndarray
+    deviation_lower: np.ndarray
+    deviation_upper: np.ndarray
+
+
+# The number of replicates resampled at once (and sent to a worker process as one shard)
+BOOTSTRAP_SHARD_SIZE = 500
+
+
+def bootstrap_intervals(data: dict[str, list[tuple[tuple[int, int], int]]],
+                        window: EventWindow = COVID_WINDOW, replicates: int = 1000,
+                        level: float = 0.95, seed: int = 0, max_workers: int | None = 1,
+                        index: DateIndex | None = None) \
+        -> dict[str, tuple[list[tuple[tuple[int, int], int, int]],
+                           list[tuple[tuple[int, int], int, int]]]]:
+    """Return a dictionary mapping every series in data to the confidence intervals of its
+    expected values and of its deviations in window (see run_computations), as lists of
+    (date, lower bound, upper bound) rounded to the nearest integer.
+
+    The intervals come from replicates residual-bootstrap replicates of the line of best fit
+    of every series, drawn with the random seed seed (see bootstrap_trends).
+
+    Preconditions:
+        - len(data) != 0
+        - replicates >= 1
+        - 0 < level < 1
+        - the whole window is in data
+
+    >>> from data import open_convert_and_aggregate
+    >>> data = open_convert_and_aggregate('samp1.csv', cache_dir=None)
+    >>> intervals = bootstrap_intervals(data, replicates=2000)
+    >>> deviation_band = intervals['Primary Sector'][1]
+    >>> deviation_band[1]  # the April 2020 shortfall is beyond the usual noise
+    ((2020, 4), -32250, -8608)
+    """
+    series = list(data)
+    if index is None:
+        index = DateIndex.from_dates(dict_to_x_y_coords(data, series[0])[0])
+    window_start = event_start_index(window, index)
+
+    values = np.array([dict_to_x_y_coords(data, name)[1] for name in series], dtype=np.float64)
+    bands = bootstrap_trends(values[:, :window_start],
+                             values[:, window_start:window_start + window.length],
+                             replicates, level, seed, max_workers)
+
+    dates = [index.date(position) for position in
+             range(window_start, window_start + window.length)]
+    return {name: ([(date, round(lower), round(upper)) for date, lower, upper in
+                    zip(dates, bands.expected_lower[i].tolist(), bands.expected_upper[i].tolist())],
+                   [(date, round(lower), round(upper)) for date, lower, upper in
+                    zip(dates, bands.deviation_lower[i].tolist(),
+                        bands.deviation_upper[i].tolist())])
+            for i, name in enumerate(series)}
+
+
+def bootstrap_trends(pre_values: np.ndarray, actual: np.ndarray, replicates: int = 1000,
+                     level: float = 0.95, seed: int = 0,
+                     max_workers: int | None = 1) -> BootstrapBands:
+    """Return the residual-bootstrap confidence intervals of the projections of the lines of
+    best fit through every row of pre_values over the following actual.shape[1] months, and
+    of the deviations of actual (the values of those months) from them.
+
+    Each replicate adds resampled residuals of every line to the line, and refits it in
+    closed form; all the series of a shard of BOOTSTRAP_SHARD_SIZE replicates are resampled
+    and refitted in a few array operations. The shards are computed in this process if
+    max_workers is 1, and in a pool of max_workers processes (one per CPU if None) otherwise.
+    Each shard draws from its own stream of the random seed seed, so the intervals do not
+    depend on max_workers.
+
+    Preconditions:
+        - pre_values.ndim == 2 and pre_values.shape[1] >= 2
+        - actual.ndim == 2 and actual.shape[0] == pre_values.shape[0]
+        - replicates >= 1
+        - 0 < level < 1
+
+    >>> pre_values = np.array([[0.0, 2.0, 4.0, 6.0, 8.0, 10.0]])
+    >>> bands = bootstrap_trends(pre_values, np.array([[12.0, 0.0]]), replicates=200)
+    >>> bands.expected_lower.tolist(), bands.deviation_upper.tolist()
+    ([[12.0, 14.0]], [[0.0, -14.0]])
+    """
+    pre_values = np.asarray(pre_values, dtype=np.float64)
+    slopes, intercepts = fit_trends(pre_values)
+    n = pre_values.shape[1]
+    residuals = pre_values - (slopes[:, np.newaxis] * np.arange(n) + intercepts[:, np.newaxis])
+
+    sizes = [min(BOOTSTRAP_SHARD_SIZE, replicates - start)
+             for start in range(0, replicates, BOOTSTRAP_SHARD_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    horizon = actual.shape[1]
+    arguments = (itertools.repeat(slopes), itertools.repeat(intercepts),
+                 itertools.repeat(residuals), itertools.repeat(horizon), sizes, seeds)
+
+    if max_workers == 1 or len(sizes) == 1:
+        shards = list(map(bootstrap_shard, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            shards = list(executor.map(bootstrap_shard, *arguments))
+
+    projections = np.concatenate([shard[0] for shard in shards])
+    noise = np.concatenate([shard[1] for shard in shards])
+    deviations = actual - (projections + noise)
+
+    tails = [(1 - level) / 2, (1 + level) / 2]
+    expected_lower, expected_upper = np.quantile(projections, tails, axis=0)
+    deviation_lower, deviation_upper = np.quantile(deviations, tails, axis=0)
+    return BootstrapBands(level=level, replicates=replicates, expected_lower=expected_lower,
+                          expected_upper=expected_upper, deviation_lower=deviation_lower,
+                          deviation_upper=deviation_upper)
+
+
+def bootstrap_shard(slopes: np.ndarray, intercepts: np.ndarray, residuals: np.ndarray,
+                    horizon: int, size: int, seed: np.random.SeedSequence) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """Return the projections over the horizon months after the residuals of size bootstrap
+    replicates of the lines (slopes, intercepts) of every series, and size draws of the
+    residuals of every series in each of those months, both with shape
+    (size, number of series, horizon).
+
+    Since the least squares line is linear in the values, refitting a replicate only needs
+    the fit of its resampled residuals, which is added to the original line.
+
+    Preconditions:
+        - residuals.shape[0] == len(slopes) == len(intercepts)
+        - residuals.shape[1] >= 2
+        - size >= 1
+    """
+    rng = np.random.default_rng(seed)
+    num_series, n = residuals.shape
+    rows = np.arange(num_series)[:, np.newaxis]
+
+    resampled = residuals[rows, rng.integers(0, n, size=(size, num_series, n))]
+    slope_changes, intercept_changes = fit_trends(resampled)
+    positions = np.arange(n, n + horizon)
+    projections = ((slopes + slope_changes)[..., np.newaxis] * positions
+                   + (intercepts + intercept_changes)[..., np.newaxis])
+
+    noise = residuals[rows, rng.integers(0, n, size=(size, num_series, horizon))]
+    return projections, noise
+
+
 if __name__ == '__main__':
     # import python_ta
     #
     # python_ta.check_all(config={
-    #     'extra-imports': ['python_ta.contracts', 'numpy', 'sklearn', 'math', 'datetime'],
+    #     'extra-imports': ['python_ta.contracts', 'numpy', 'math', 'datetime', 'dataclasses',
+    #                       'os', 'cache', 'data', 'instrumentation'],
     #     'max-line-length': 100,
     #     'disable': ['R1705', 'C0200']}
     # )
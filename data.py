@@ -3,9 +3,27 @@ Data Module for the final project (CSC110 at the University of Toronto)
 This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
 """
 
-#  No external libraries necessary for this module (csv is built-in)
+# csv is built-in; numpy holds the parsed GDP values
+
+from __future__ import annotations
 
 import csv
+import functools
+import re
+import warnings
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+import cache
+from instrumentation import Instrumentation, measure_stage
+
+# Directory of the on-disk cache of parsed datasets (see cache.py)
+CACHE_DIR = '.gdp_cache'
+
+# Version of the parser; bump it whenever a change to parsing would change the stored panels
+PARSER_VERSION = 3
 
 
 ##########################################
@@ -13,33 +31,481 @@ import csv
 ##########################################
 
 
-def open_and_convert(filename: str) -> dict[str, list[tuple[tuple[int, int], int]]]:
+def open_and_convert(filename: str, cache_dir: str | None = CACHE_DIR) \
+        -> dict[str, list[tuple[tuple[int, int], int]]]:
     """
     Opens and converts the dataset file into a dictionary mapping each industry name
-    to year-month tuples and their respective GDP values.
+    to year-month tuples and their respective GDP values. The file is streamed row by
+    row rather than read into memory first.
+
+    The parsed values are cached in cache_dir (pass None to disable the cache). They are
+    validated once (see validate_panel) and returned as ValidatedData.
 
     Preconditions:
         - filename != ''
 
-    >>> open_and_convert('samp1.csv')
+    >>> open_and_convert('samp1.csv', cache_dir=None)['Utilities  [22]'][0]
+    ((2014, 1), 40047)
     """
-
-    return list_to_dict(file_to_list(filename))
+    panel = cached_panel(filename, 'industries', lambda: load_panel(filename), cache_dir)
+    return mark_validated(validate_panel(panel).to_dict())
 
 
-def open_convert_and_aggregate(filename: str) -> dict[str, list[tuple[tuple[int, int], int]]]:
+def open_convert_and_aggregate(filename: str, cache_dir: str | None = CACHE_DIR,
+                               instrumentation: Instrumentation | None = None,
+                               required: Iterable[tuple[int, int]] = ()) \
+        -> dict[str, list[tuple[tuple[int, int], int]]]:
     """
     Opens and converts the dataset file into a dictionary mapping each industry name to
     year-month tuples and their respective GDP value, then sorts each industry into an
     economic sector (Primary/Secondary/Tertiary/Quaternary). The GDP values across all
     industries per sector are then aggregated into one value.
 
+    The aggregated values are cached in cache_dir (pass None to disable the cache). Each
+    stage is measured by instrumentation, if it is given. The aggregated values are validated
+    once, including that every year-month in required is in the data (see validate_panel),
+    and returned as ValidatedData.
+
     Preconditions:
         - filename != ''
 
-    >>> open_convert_and_aggregate('samp1.csv')
+    >>> open_convert_and_aggregate('samp1.csv', cache_dir=None)['Primary Sector'][0]
+    ((2014, 1), 172184)
     """
-    return aggregate_4_sectors(categorize_4_sectors(open_and_convert(filename)))
+    with measure_stage(instrumentation, 'load_sectors') as record:
+        panel = cached_panel(filename, 'sectors',
+                             lambda: load_sector_panel(filename, instrumentation), cache_dir)
+        record.series = len(panel.industries)
+
+    with measure_stage(instrumentation, 'validate', rows=len(panel.months),
+                       series=len(panel.industries)):
+        validate_panel(panel, required)
+
+    with measure_stage(instrumentation, 'to_dict', series=len(panel.industries)):
+        return mark_validated(panel.to_dict())
+
+
+##########################################
+# Panel: columnar storage of the GDP values
+##########################################
+
+
+def month_ordinal(date: tuple[int, int]) -> int:
+    """Return the number of months between January of year 0 and date, so that
+    consecutive months have consecutive ordinals.
+
+    Preconditions:
+        - 1 <= date[1] <= 12
+
+    >>> month_ordinal((2020, 3))
+    24242
+    >>> month_ordinal((2020, 1)) - month_ordinal((2019, 12))
+    1
+    """
+    return date[0] * 12 + date[1] - 1
+
+
+def ordinal_to_month(ordinal: int) -> tuple[int, int]:
+    """Return the (year, month) tuple of a month ordinal. Inverse of month_ordinal.
+
+    Preconditions:
+        - ordinal >= 0
+
+    >>> ordinal_to_month(24242)
+    (2020, 3)
+    """
+    return (int(ordinal) // 12, int(ordinal) % 12 + 1)
+
+
+@dataclass
+class DateIndex:
+    """Dataclass mapping the dates of a dataset to their positions in its series, built once
+    per dataset so that every lookup takes constant time.
+    Instance Attributes:
+      - months: the month ordinal (see month_ordinal) at each position
+      - positions: maps each month ordinal in months to its position
+    Representation Invariants:
+      - all(self.months[i] < self.months[i + 1] for i in range(len(self.months) - 1))
+      - all(self.positions[self.months[i]] == i for i in range(len(self.months)))
+
+    >>> index = DateIndex.from_dates([(2019, 11), (2019, 12), (2020, 1)])
+    >>> index.position((2020, 1))
+    2
+    >>> index.date(1)
+    (2019, 12)
+    """
+    months: np.ndarray
+    positions: dict[int, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.positions = {ordinal: i for i, ordinal in enumerate(self.months.tolist())}
+
+    @staticmethod
+    def from_dates(dates: list[tuple[int, int]]) -> DateIndex:
+        """Return the index of the year-month tuples in dates.
+
+        Preconditions:
+            - all(1 <= date[1] <= 12 for date in dates)
+        """
+        return DateIndex(np.array([month_ordinal(date) for date in dates], dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.months)
+
+    def __contains__(self, date: tuple[int, int]) -> bool:
+        return month_ordinal(date) in self.positions
+
+    def position(self, date: tuple[int, int]) -> int:
+        """Return the position of date.
+
+        Preconditions:
+            - date in self
+        """
+        return self.positions[month_ordinal(date)]
+
+    def date(self, position: int) -> tuple[int, int]:
+        """Return the year-month tuple at position.
+
+        Preconditions:
+            - 0 <= position < len(self)
+        """
+        return ordinal_to_month(self.months[position])
+
+
+@dataclass
+class Panel:
+    """Dataclass holding every GDP series of a dataset in a single matrix: int64, or float64
+    with NaN for the values StatCan withholds (see decode_cells).
+    Rows of a group (e.g. an economic sector) are stored next to each other, so the
+    rows of a group, or of one industry, are views into the matrix and not copies.
+    Instance Attributes:
+      - industries: the name of the series in each row of values
+      - months: the month ordinal (see month_ordinal) of each column of values
+      - values: GDP values, with shape (len(industries), len(months))
+      - groups: maps the name of each group to the slice of rows it spans
+      - flags: the status code (see STATUS_CODES) of every value, or None if every value is
+        present
+      - industry_index: maps each name in industries to its row
+    Representation Invariants:
+      - self.values.shape == (len(self.industries), len(self.months))
+      - all(self.months[i] < self.months[i + 1] for i in range(len(self.months) - 1))
+      - all(0 <= s.start <= s.stop <= len(self.industries) for s in self.groups.values())
+      - self.flags is None or self.flags.shape == self.values.shape
+    """
+    industries: list[str]
+    months: np.ndarray
+    values: np.ndarray
+    groups: dict[str, slice] = field(default_factory=dict)
+    flags: np.ndarray | None = None
+    industry_index: dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.industry_index = {name: i for i, name in enumerate(self.industries)}
+
+    @functools.cached_property
+    def date_index(self) -> DateIndex:
+        """Return the index of the panel's months, built on first use."""
+        return DateIndex(self.months)
+
+    @property
+    def dates(self) -> list[tuple[int, int]]:
+        """Return the (year, month) tuple of every column."""
+        return [ordinal_to_month(ordinal) for ordinal in self.months]
+
+    def row(self, industry: str) -> np.ndarray:
+        """Return a view of the GDP values of industry.
+
+        Preconditions:
+            - industry in self.industry_index
+        """
+        return self.values[self.industry_index[industry]]
+
+    def group(self, name: str) -> np.ndarray:
+        """Return a view of the GDP values of every industry in the group called name.
+
+        Preconditions:
+            - name in self.groups
+        """
+        return self.values[self.groups[name]]
+
+    def group_industries(self, name: str) -> list[str]:
+        """Return the names of the industries in the group called name.
+
+        Preconditions:
+            - name in self.groups
+        """
+        return self.industries[self.groups[name]]
+
+    def to_dict(self) -> dict[str, list[tuple[tuple[int, int], int]]]:
+        """Return the panel in the dictionary format used by the rest of the program,
+        mapping each industry to a list of year-month tuples and GDP values."""
+        dates = self.dates
+        return {industry: list(zip(dates, row))
+                for industry, row in zip(self.industries, self.values.tolist())}
+
+
+def load_panel(filename: str) -> Panel:
+    """
+    Opens the dataset file and stores its GDP values in a Panel (one row per industry,
+    one column per month) without building any per-month tuples. The cells of the whole
+    table are decoded at once (see decode_cells).
+
+    Preconditions:
+        - filename != ''
+
+    >>> panel = load_panel('samp1.csv')
+    >>> panel.values.shape
+    (36, 92)
+    >>> panel.row('Utilities  [22]')[0:2]
+    array([40047, 40175])
+    """
+    rows = iter_rows(filename)
+    month_tuples = read_header(rows)
+
+    # ACCUMULATORS industries, cells: the names and raw GDP cells read so far
+    industries = []
+    cells = []
+    for industry, row_cells in iter_cells(rows, len(month_tuples)):
+        industries.append(industry)
+        cells.extend(row_cells)
+
+    months = np.array([month_ordinal(date) for date in month_tuples], dtype=np.int64)
+    values, flags = decode_cells(cells)
+    shape = (len(industries), len(months))
+    return Panel(industries=industries, months=months, values=values.reshape(shape),
+                 flags=flags.reshape(shape) if flags.any() else None)
+
+
+def load_sector_panel(filename: str, instrumentation: Instrumentation | None = None) -> Panel:
+    """
+    Opens the dataset file and returns a Panel with one row per economic sector, holding the
+    sum of the GDP values of the sector's industries. Parsing, classifying and aggregating
+    are measured by instrumentation, if it is given.
+
+    Preconditions:
+        - filename != ''
+    """
+    with measure_stage(instrumentation, 'parse') as record:
+        panel = load_panel(filename)
+        record.rows = len(panel.industries)
+
+    with measure_stage(instrumentation, 'classify', rows=len(panel.industries)) as record:
+        panel = categorize_panel(panel)
+        record.series = len(panel.industries)
+
+    with measure_stage(instrumentation, 'aggregate', rows=len(panel.industries)) as record:
+        panel = aggregate_panel(panel)
+        record.series = len(panel.industries)
+
+    return panel
+
+
+def cached_panel(filename: str, stage: str, build: Callable[[], Panel],
+                 cache_dir: str | None) -> Panel:
+    """
+    Return the panel that build produces from filename at the given stage of the program,
+    loading it from cache_dir if this version of the parser already produced it for a file
+    with the same contents, and storing it there otherwise. The cache is not used if
+    cache_dir is None.
+
+    Preconditions:
+        - filename != ''
+        - stage != '' and '-' not in stage
+    """
+    if cache_dir is None:
+        return build()
+
+    key = cache.entry_key(cache.file_digest(filename), stage, PARSER_VERSION)
+    entry = cache.load_entry(cache_dir, key)
+    if entry is not None:
+        values, data, flags = entry
+        return Panel(industries=data['industries'],
+                     months=np.array(data['months'], dtype=np.int64), values=values,
+                     groups={name: slice(*bounds) for name, bounds in data['groups'].items()},
+                     flags=flags)
+
+    panel = build()
+    data = {'industries': panel.industries, 'months': panel.months.tolist(),
+            'groups': {name: [s.start, s.stop] for name, s in panel.groups.items()}}
+    cache.store_entry(cache_dir, key, filename, panel.values, data, panel.flags)
+    return panel
+
+
+##########################################
+# Validation: checked once when a dataset is loaded
+##########################################
+
+
+# Whether data marked as validated is checked again by every contract (see set_full_checks)
+FULL_CHECKS = False
+
+
+class ValidationError(ValueError):
+    """Raised when a dataset fails validation, with every check it failed."""
+
+
+class ValidatedData(dict):
+    """A dictionary of GDP series (in the format of open_convert_and_aggregate) that passed
+    validate_data or validate_panel when it was loaded. Its series are ValidatedSeries.
+    The preconditions of the functions taking such data skip their checks for it, unless
+    full checks are enabled (see set_full_checks)."""
+
+
+class ValidatedSeries(list):
+    """A list of (year-month, GDP value) tuples belonging to a ValidatedData."""
+
+
+def set_full_checks(enabled: bool) -> None:
+    """Make the contracts check validated data again on every call if enabled is True (for
+    debugging), or trust the validation done when the data was loaded otherwise."""
+    global FULL_CHECKS
+    FULL_CHECKS = enabled
+
+
+def is_validated(data: object) -> bool:
+    """Return whether data (a dictionary of series, or one series) was validated when it was
+    loaded, so that contracts need not check it again.
+
+    >>> is_validated(mark_validated({'Primary Sector': [((2020, 1), 5)]})['Primary Sector'])
+    True
+    >>> is_validated({'Primary Sector': [((2020, 1), 5)]})
+    False
+    """
+    return not FULL_CHECKS and isinstance(data, (ValidatedData, ValidatedSeries))
+
+
+def mark_validated(data: dict[str, list[tuple[tuple[int, int], int]]]) -> ValidatedData:
+    """Return data marked as validated, without checking it."""
+    return ValidatedData({name: ValidatedSeries(points) for name, points in data.items()})
+
+
+def panel_errors(panel: Panel, required: Iterable[tuple[int, int]] = ()) -> list[str]:
+    """Return a description of every check that panel fails, using a few operations on its
+    arrays: one row of values per series and one column per month, months in increasing
+    order, no negative GDP values, every year-month in required among the months, and no
+    missing values up to the last year-month in required (the months a baseline is fitted to
+    and compared with).
+
+    >>> panel = Panel(['A'], np.array([24240, 24241]), np.array([[5, -1]]))
+    >>> panel_errors(panel, [(2020, 3)])
+    ['some GDP values are negative', 'the data has no value for (2020, 3)']
+    """
+    # ACCUMULATOR errors: the checks failed so far
+    errors = []
+    if panel.values.shape != (len(panel.industries), len(panel.months)):
+        errors.append('the values do not have one row per series and one column per month')
+    if len(panel.industries) == 0:
+        errors.append('the data has no series')
+    if len(panel.months) == 0:
+        errors.append('the data has no months')
+    if np.any(np.diff(panel.months) <= 0):
+        errors.append('the months are not in increasing order')
+    if np.any(np.asarray(panel.values) < 0):  # NaN (withheld values) compares as False
+        errors.append('some GDP values are negative')
+
+    required = list(required)
+    present = np.isin([month_ordinal(date) for date in required], panel.months)
+    errors.extend(f'the data has no value for {date}'
+                  for date, found in zip(required, present.tolist()) if not found)
+
+    if required and panel.values.dtype.kind == 'f':
+        # Every value up to the last required month is used to fit or compare with a baseline
+        last = max(month_ordinal(date) for date in required)
+        errors.extend(missing_value_errors(panel.industries, panel.months,
+                                           panel.values[:, panel.months <= last]))
+    return errors
+
+
+def missing_value_errors(names: list[str], months: np.ndarray, values: np.ndarray) -> list[str]:
+    """Return a description of the first missing (NaN, e.g. withheld) value of each row of
+    values that has one, where the rows are the series called names and the columns are the
+    first months of months.
+
+    >>> missing_value_errors(['A', 'B'], np.array([24240, 24241]), np.array([[1, np.nan], \
+[2, 3]]))
+    ['A has no value for (2020, 2) (e.g. it is withheld)']
+    """
+    missing = np.isnan(values)
+    rows = np.flatnonzero(missing.any(axis=1))
+    columns = missing.argmax(axis=1)[rows]
+    return [f'{names[row]} has no value for {ordinal_to_month(int(months[column]))} '
+            f'(e.g. it is withheld)' for row, column in zip(rows.tolist(), columns.tolist())]
+
+
+def data_errors(data: dict[str, list[tuple[tuple[int, int], int]]],
+                required: Iterable[tuple[int, int]] = ()) -> list[str]:
+    """Return a description of every check that data (in the format of
+    open_convert_and_aggregate) fails: the checks of panel_errors, plus every series having
+    the same dates, with months between 1 and 12. The series are converted to one array and
+    checked with a few operations on it.
+
+    >>> data_errors({'A': [((2020, 13), 5)], 'B': [((2020, 1), 5)]})
+    ['some months are not between 1 and 12', 'the series do not all have the same dates']
+    """
+    if len(data) == 0:
+        return ['the data has no series']
+    lengths = {len(points) for points in data.values()}
+    if len(lengths) != 1:
+        return ['the series do not all have the same number of values']
+
+    points = np.array([[(date[0], date[1], value) for date, value in series]
+                       for series in data.values()], dtype=np.float64).reshape(len(data), -1, 3)
+
+    # ACCUMULATOR errors: the checks failed so far
+    errors = []
+    if np.any((points[..., 1] < 1) | (points[..., 1] > 12)):
+        errors.append('some months are not between 1 and 12')
+    ordinals = points[..., 0] * 12 + points[..., 1] - 1
+    if np.any(ordinals != ordinals[0]):
+        errors.append('the series do not all have the same dates')
+
+    panel = Panel(industries=list(data), months=ordinals[0].astype(np.int64),
+                  values=points[..., 2])
+    return errors + panel_errors(panel, required)
+
+
+def is_valid_data(data: dict[str, list[tuple[tuple[int, int], int]]]) -> bool:
+    """Return whether data passes every check of data_errors."""
+    return data_errors(data) == []
+
+
+def is_valid_series(points: list[tuple[tuple[int, int], int]]) -> bool:
+    """Return whether the series points passes every check of data_errors.
+
+    >>> is_valid_series([((2020, 1), 5), ((2020, 2), 6)]), is_valid_series([((2020, 2), 5), \
+((2020, 1), 6)])
+    (True, False)
+    """
+    return data_errors({'series': points}) == []
+
+
+def validate_panel(panel: Panel, required: Iterable[tuple[int, int]] = ()) -> Panel:
+    """Return panel if it passes every check of panel_errors.
+
+    Raise ValidationError otherwise.
+    """
+    errors = panel_errors(panel, required)
+    if errors:
+        raise ValidationError('; '.join(errors))
+    return panel
+
+
+def validate_data(data: dict[str, list[tuple[tuple[int, int], int]]],
+                  required: Iterable[tuple[int, int]] = ()) -> ValidatedData:
+    """Return data marked as validated if it passes every check of data_errors.
+
+    Raise ValidationError otherwise.
+
+    >>> try:
+    ...     validate_data({'A': [((2020, 1), 5)]}, required=[(2020, 3)])
+    ... except ValidationError as error:
+    ...     print(error)
+    the data has no value for (2020, 3)
+    """
+    errors = data_errors(data, required)
+    if errors:
+        raise ValidationError('; '.join(errors))
+    return mark_validated(data)
 
 
 ##########################################
@@ -47,6 +513,32 @@ def open_convert_and_aggregate(filename: str) -> dict[str, list[tuple[tuple[int,
 ##########################################
 
 
+MONTHS = {'January': 1,
+          'February': 2,
+          'March': 3,
+          'April': 4,
+          'May': 5,
+          'June': 6,
+          'July': 7,
+          'August': 8,
+          'September': 9,
+          'October': 10,
+          'November': 11,
+          'December': 12
+          }
+
+# First cells of the rows that open the notes block under the data table
+FOOTER_MARKERS = ('Footnotes:', 'Symbol legend:', 'How to cite:')
+
+# Status code of every value: present, or withheld for the reason given by StatCan's marker
+STATUS_PRESENT = 0
+STATUS_CODES = {'..': 1,   # not available for the reference period
+                '...': 2,  # not applicable
+                'x': 3,    # suppressed to meet the confidentiality requirements
+                'F': 4,    # too unreliable to be published
+                '': 1}
+
+
 def month_to_num(monthyear: str) -> tuple[int, int]:
     """
     Helper Function 1:
@@ -60,21 +552,7 @@ def month_to_num(monthyear: str) -> tuple[int, int]:
     >>> month_to_num('January 2014')
     (2014, 1)
     """
-    months = {'January': 1,
-              'February': 2,
-              'March': 3,
-              'April': 4,
-              'May': 5,
-              'June': 6,
-              'July': 7,
-              'August': 8,
-              'September': 9,
-              'October': 10,
-              'November': 11,
-              'December': 12
-              }
-
-    return (int(monthyear[-4:len(monthyear)]), (months[monthyear[0:-5]]))
+    return (int(monthyear[-4:len(monthyear)]), (MONTHS[monthyear[0:-5]]))
 
 
 def file_to_list(filename: str) -> list[list[str]]:
@@ -87,16 +565,208 @@ def file_to_list(filename: str) -> list[list[str]]:
     Preconditions:
         - filename != ''
 
-    >>> file_to_list('samp1.csv')
+    >>> len(file_to_list('samp1.csv'))
+    60
     """
-    list_so_far = []
+    return list(iter_rows(filename))
 
-    with open(filename) as f:
-        reader = csv.reader(f, delimiter=',')
-        for row in reader:
-            list_so_far = list_so_far + [row]
 
-    return list_so_far
+def iter_rows(filename: str) -> Iterator[list[str]]:
+    """
+    Helper Function 2a:
+
+    Lazily yield each row of the csv file, so that the file is never held in memory
+    as a whole.
+
+    Preconditions:
+        - filename != ''
+
+    >>> next(iter_rows('samp1.csv'))[0]
+    'Gross domestic product (GDP) at basic prices, by industry, monthly (x 1,000,000) 1 2'
+    """
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        yield from csv.reader(f, delimiter=',')
+
+
+def is_date_header(row: list[str]) -> bool:
+    """
+    Helper Function 2b:
+
+    Return whether row is the header row of the table, i.e. every cell after the first
+    is a date written as 'Month Year'.
+
+    >>> is_date_header(['NAICS', 'January 2014', 'February 2014'])
+    True
+    >>> is_date_header(['', 'Dollars', ''])
+    False
+    """
+    return len(row) > 1 and all(cell[0:-5] in MONTHS and cell[-4:].isdigit()
+                                for cell in row[1:] if cell != '')
+
+
+def is_footer(row: list[str]) -> bool:
+    """
+    Helper Function 2c:
+
+    Return whether row marks the end of the data table (a blank row or the start of
+    the footnotes).
+
+    >>> is_footer([])
+    True
+    >>> is_footer(['Footnotes:'])
+    True
+    >>> is_footer(['Utilities  [22]', '40,047'])
+    False
+    """
+    return all(cell == '' for cell in row) or row[0] in FOOTER_MARKERS
+
+
+def read_metadata(filename: str) -> dict[str, str]:
+    """
+    Helper Function 2f:
+
+    Return the 'Key: value' lines of the preamble above the table in filename (e.g. the
+    release date), reading no further than the date header.
+
+    Preconditions:
+        - filename != ''
+
+    >>> read_metadata('samp1.csv')['Release date']
+    '2021-10-29'
+    """
+    # ACCUMULATOR metadata: the preamble lines read so far
+    metadata = {}
+    for row in iter_rows(filename):
+        if is_date_header(row):
+            break
+        if len(row) == 1 and ': ' in row[0]:
+            key, value = row[0].split(': ', 1)
+            metadata[key] = value
+
+    return metadata
+
+
+def stream_table(rows: Iterable[list[str]]) \
+        -> tuple[list[tuple[int, int]], Iterator[tuple[str, list[int]]]]:
+    """
+    Helper Function 2d:
+
+    Return the year-month tuples of the table in rows and a generator of
+    (industry, GDP values) records. The date header and the end of the table are
+    found by their content, and rows are only read once.
+
+    Preconditions:
+        - any(is_date_header(row) for row in rows)
+
+    >>> dates, records = stream_table(iter_rows('samp1.csv'))
+    >>> dates[0], dates[-1]
+    ((2014, 1), (2021, 8))
+    >>> next(records)[1][0:2]
+    [1773250, 1782226]
+    """
+    rows = iter(rows)
+    month_tuples = read_header(rows)
+
+    return month_tuples, iter_records(rows, len(month_tuples))
+
+
+def read_header(rows: Iterator[list[str]]) -> list[tuple[int, int]]:
+    """
+    Helper Function 2g:
+
+    Consume rows up to and including the date header of the table, and return its
+    year-month tuples.
+
+    Preconditions:
+        - any(is_date_header(row) for row in rows)
+    """
+    header = next(row for row in rows if is_date_header(row))
+    return [month_to_num(date) for date in header[1:] if date != '']
+
+
+def iter_records(rows: Iterator[list[str]], num_months: int) -> Iterator[tuple[str, list[int]]]:
+    """
+    Helper Function 2e:
+
+    Yield an (industry, GDP values) record for every industry row left in rows,
+    stopping at the end of the table. Rows without an industry name (e.g. the units
+    row below the header) are skipped. Withheld values are NaN.
+
+    Preconditions:
+        - num_months > 0
+
+    >>> rows = iter([['', 'Dollars'], ['Utilities  [22]', '40,047', '40,175'], [], ['x']])
+    >>> list(iter_records(rows, 2))
+    [('Utilities  [22]', [40047, 40175])]
+    """
+    for industry, cells in iter_cells(rows, num_months):
+        yield industry, decode_cells(cells)[0].tolist()
+
+
+def iter_cells(rows: Iterator[list[str]], num_months: int) -> Iterator[tuple[str, list[str]]]:
+    """
+    Helper Function 2h:
+
+    Like iter_records, but yield the raw GDP cells of every industry row, undecoded.
+
+    Preconditions:
+        - num_months > 0
+    """
+    for row in rows:
+        if is_footer(row):
+            return
+        if row[0] != '':
+            yield row[0], row[1:num_months + 1]
+
+
+def decode_cells(cells: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Helper Function 2i:
+
+    Return the numbers written in cells (with or without thousands separators) as an
+    array, and the status code (see STATUS_CODES) of every cell as an int8 array.
+
+    The cells are joined into one string and parsed by numpy in a single call. The
+    values are int64 if every cell holds a whole number; if any cell holds a decimal
+    number or a StatCan marker ('..', 'x', 'F', ...) they are float64, and withheld
+    values are NaN.
+
+    Raise ValueError if a cell is neither a number nor a known marker.
+
+    >>> decode_cells(['40,047', '1,782,226'])
+    (array([  40047, 1782226]), array([0, 0], dtype=int8))
+    >>> values, flags = decode_cells(['40,047', 'x', '..', '12.5'])
+    >>> values.tolist(), flags.tolist()
+    ([40047.0, nan, nan, 12.5], [0, 3, 1, 0])
+    """
+    text = ' '.join(cells).replace(',', '')
+    values = _parse_numbers(text, np.float64 if '.' in text else np.int64)
+    if values is not None and len(values) == len(cells):
+        return values, np.zeros(len(cells), dtype=np.int8)
+
+    # Some cells are markers (or empty): decode the others, and leave the markers as NaN
+    flags = np.array([STATUS_CODES.get(cell.strip(), STATUS_PRESENT) for cell in cells],
+                     dtype=np.int8)
+    present = [cell for cell, flag in zip(cells, flags.tolist()) if flag == STATUS_PRESENT]
+    numbers = _parse_numbers(' '.join(present).replace(',', ''), np.float64)
+    if numbers is None or len(numbers) != len(present):
+        raise ValueError(f'unreadable GDP value among {present!r}')
+
+    values = np.full(len(cells), np.nan)
+    values[flags == STATUS_PRESENT] = numbers
+    return values, flags
+
+
+def _parse_numbers(text: str, dtype: type) -> np.ndarray | None:
+    """Return the whitespace-separated numbers in text as an array of type dtype, or None if
+    some token is not a number of that type."""
+    with warnings.catch_warnings():
+        # Older versions of numpy only warn when they stop before the end of text
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=dtype, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
 
 
 def list_to_dict(list_so_far: list) -> dict[str, list[tuple[tuple[int, int], int]]]:
@@ -110,20 +780,9 @@ def list_to_dict(list_so_far: list) -> dict[str, list[tuple[tuple[int, int], int
     Preconditions:
         - len(list_so_far) > 0
     """
-    output_dict = {}
-    dates = list_so_far[11]
-
-    month_tuples = [month_to_num(date) for date in dates[1:len(dates)]]
-    industry_list = [x[0] for x in list_so_far[13:len(list_so_far) - 11]]
+    month_tuples, records = stream_table(list_so_far)
 
-    date_gdp = [[(month_tuples[i - 1], int(list_so_far[x][i].replace(',', '')))
-                 for i in range(1, len(list_so_far[x]) - 11)]
-                for x in range(13, len(list_so_far) - 11)]
-
-    for j in range(0, len(industry_list)):
-        output_dict[industry_list[j]] = date_gdp[j]
-
-    return output_dict
+    return {industry: list(zip(month_tuples, values)) for industry, values in records}
 
 
 ##########################################
@@ -131,49 +790,118 @@ def list_to_dict(list_so_far: list) -> dict[str, list[tuple[tuple[int, int], int
 ##########################################
 
 
+SECTORS = ['Primary', 'Secondary', 'Tertiary', 'Quaternary']
+
+#  Industry Identification Codes (NAICS sectors, ranges included):
+
+SECTOR_CODES = {'Primary': ['11', '21'],
+                'Secondary': ['22', '23', '31-33'],
+                'Tertiary': ['41', '44-45', '48-49', '52', '53', '54', '55', '56',
+                             '61', '62', '71', '72', '81', '91'],
+                'Quaternary': ['51']
+                }
+
+# The code in the last pair of square brackets of an industry's name, e.g. '31-33'
+NAICS_CODE_PATTERN = re.compile(r'\[([0-9]+(?:-[0-9]+)?)\][^\[]*$')
+
+
+def expand_code(code: str) -> list[str]:
+    """Return every NAICS code covered by code, which is either a single code or a
+    range of codes with the same number of digits.
+
+    Preconditions:
+        - code != ''
+
+    >>> expand_code('44-45')
+    ['44', '45']
+    >>> expand_code('3361')
+    ['3361']
+    """
+    first, _, last = code.partition('-')
+    if last == '':
+        return [first]
+    return [str(number) for number in range(int(first), int(last) + 1)]
+
+
+def compile_sector_index(sector_codes: dict[str, list[str]]) -> dict[str, str]:
+    """Return a dictionary mapping each NAICS code (ranges expanded) in sector_codes
+    to the name of its sector.
+
+    Preconditions:
+        - all(code != '' for codes in sector_codes.values() for code in codes)
+
+    >>> index = compile_sector_index({'Secondary': ['22', '31-33']})
+    >>> index == {'22': 'Secondary', '31': 'Secondary', '32': 'Secondary', '33': 'Secondary'}
+    True
+    """
+    return {number: sector for sector, codes in sector_codes.items()
+            for code in codes for number in expand_code(code)}
+
+
+SECTOR_INDEX = compile_sector_index(SECTOR_CODES)
+
+
+def parse_naics_code(industry: str) -> str | None:
+    """Return the NAICS code in square brackets in the industry's name, or None if the
+    name has no numeric code (e.g. the aggregates '[T001]').
+
+    >>> parse_naics_code('Manufacturing  [31-33]')
+    '31-33'
+    >>> parse_naics_code('All industries  [T001] 4') is None
+    True
+    """
+    match = NAICS_CODE_PATTERN.search(industry)
+    return None if match is None else match.group(1)
+
+
+@functools.lru_cache(maxsize=None)
+def classify_industry(industry: str) -> str | None:
+    """Return the economic sector of the industry, or None if it belongs to none of the
+    four sectors. The most specific code in SECTOR_INDEX that prefixes the industry's
+    NAICS code decides, so detailed codes (e.g. '[3361]') fall under their 2-digit
+    sector. Results are memoized per name.
+
+    >>> classify_industry('Information and cultural industries  [51]')
+    'Quaternary'
+    >>> classify_industry('Motor vehicle manufacturing  [3361]')
+    'Secondary'
+    >>> classify_industry('Durable manufacturing industries  [T012] 4') is None
+    True
+    """
+    code = parse_naics_code(industry)
+    if code is None:
+        return None
+
+    first = code.partition('-')[0]
+    for length in range(len(first), 1, -1):
+        if first[:length] in SECTOR_INDEX:
+            return SECTOR_INDEX[first[:length]]
+    return None
+
+
 def categorize_4_sectors(dct: dict) -> dict[str, dict]:
     """
     Helper Function 4:
 
     Return a dictionary mapping each economic sector's name
-    (Primary/Secondary/Tertiary/Secondary) to the industries in them
-    without aggregation
+    (Primary/Secondary/Tertiary/Quaternary) to the industries in them
+    without aggregation. Every industry is put in at most one sector.
 
     Preconditions:
         len(dct) != 0
 
-    >>> categorize_4_sectors(open_and_convert('samp1.csv'))
+    >>> list(categorize_4_sectors(open_and_convert('samp1.csv'))['Quaternary'])
+    ['Information and cultural industries  [51]']
     """
-    industry_list = list(dct.keys())
-
-    #  Industry Identification Codes:
+    # ACCUMULATOR categories: the industries sorted into each sector so far
+    categories = {sector: {} for sector in SECTORS}
 
-    primary_codes = ['[11]', '[21]']
-    secondary_codes = ['[22]', '[23]', '[31-33]']
-    tertiary_codes = ['[41]', '[44-45]', '[48-49]', '[52]', '[53]', '[54]', '[55]', '[56]',
-                      '[61]', '[62]', '[71]', '[72]', '[81]', '[91]']
-    quaternary_codes = ['51']
-    primary_dict = {}
-    secondary_dict = {}
-    tertiary_dict = {}
-    quaternary_dict = {}
+    for industry in dct:
+        sector = classify_industry(industry)
+        if sector is not None:
+            categories[sector][industry] = dct[industry]
 
-    for industry in industry_list:
-        for p in primary_codes:
-            if p in industry:
-                primary_dict[industry] = dct[industry]
-        for s in secondary_codes:
-            if s in industry:
-                secondary_dict[industry] = dct[industry]
-        for t in tertiary_codes:
-            if t in industry:
-                tertiary_dict[industry] = dct[industry]
-        for q in quaternary_codes:
-            if q in industry:
-                quaternary_dict[industry] = dct[industry]
-
-    return {'Primary': primary_dict, 'Secondary': secondary_dict,
-            'Tertiary': tertiary_dict, 'Quaternary': quaternary_dict}
+    return categories
 
 
 def aggregate_4_sectors(combined_dict: dict) -> dict[str, list[tuple[tuple[int, int], int]]]:
@@ -188,48 +916,86 @@ def aggregate_4_sectors(combined_dict: dict) -> dict[str, list[tuple[tuple[int,
     Preconditions:
         - len(combined_dict) != 0
     """
-    primary_keys = list(combined_dict['Primary'].keys())
-    secondary_keys = list(combined_dict['Secondary'].keys())
-    tertiary_keys = list(combined_dict['Tertiary'].keys())
-    quaternary_keys = list(combined_dict['Quaternary'].keys())
+    # ACCUMULATORS: the names, GDP values and row ranges of each sector's industries
+    industries = []
+    rows = []
+    groups = {}
+    for sector in SECTORS:
+        start = len(industries)
+        for industry, points in combined_dict[sector].items():
+            industries.append(industry)
+            rows.append([point[1] for point in points])
+        groups[sector] = slice(start, len(industries))
+
+    # Every industry has the same dates (see align.align_panels to join series that do not)
+    first_industry = next(points for sector in SECTORS for points in combined_dict[sector].values())
+    months = np.array([month_ordinal(point[0]) for point in first_industry], dtype=np.int64)
+    values = np.array(rows, dtype=np.int64).reshape(len(rows), len(months))
+
+    return aggregate_panel(Panel(industries, months, values, groups)).to_dict()
+
+
+def categorize_panel(panel: Panel) -> Panel:
+    """
+    Helper Function 6:
+
+    Return a copy of panel whose rows are reordered so that the industries of each
+    economic sector (Primary/Secondary/Tertiary/Quaternary) are next to each other,
+    with the groups of the copy set to the four sectors. Industries outside the four
+    sectors (e.g. totals) are left out.
 
-    year_month_tuples = [combined_dict['Primary'][primary_keys[0]][j][0] for j in range(0, len(
-        combined_dict['Primary'][primary_keys[0]]))]
+    >>> panel = categorize_panel(load_panel('samp1.csv'))
+    >>> panel.group_industries('Primary')
+    ['Agriculture, forestry, fishing and hunting  [11]', \
+'Mining, quarrying, and oil and gas extraction  [21]']
+    """
+    categories = categorize_4_sectors(dict.fromkeys(panel.industries))
 
-    primary_sums = []
-    secondary_sums = []
-    tertiary_sums = []
-    quaternary_sums = []
+    # ACCUMULATORS: the new order of the rows and the row range of each sector
+    order = []
+    groups = {}
+    for sector in SECTORS:
+        start = len(order)
+        order.extend(panel.industry_index[industry] for industry in categories[sector])
+        groups[sector] = slice(start, len(order))
 
-    ag_primary_data = []
-    ag_secondary_data = []
-    ag_tertiary_data = []
-    ag_quaternary_data = []
+    return Panel(industries=[panel.industries[i] for i in order], months=panel.months,
+                 values=panel.values[order], groups=groups,
+                 flags=None if panel.flags is None else panel.flags[order])
 
-    for i in range(0, len(combined_dict['Primary'][primary_keys[0]])):
-        primary_sums = primary_sums + \
-            [sum((combined_dict['Primary'][y][i][1]) for y in primary_keys)]
-        secondary_sums = secondary_sums + \
-            [sum((combined_dict['Secondary'][y][i][1]) for y in secondary_keys)]
-        tertiary_sums = tertiary_sums + \
-            [sum((combined_dict['Tertiary'][y][i][1]) for y in tertiary_keys)]
-        quaternary_sums = quaternary_sums + \
-            [sum((combined_dict['Quaternary'][y][i][1]) for y in quaternary_keys)]
 
-        ag_primary_data = ag_primary_data + [(year_month_tuples[i], primary_sums[i])]
-        ag_secondary_data = ag_secondary_data + [(year_month_tuples[i], secondary_sums[i])]
-        ag_tertiary_data = ag_tertiary_data + [(year_month_tuples[i], tertiary_sums[i])]
-        ag_quaternary_data = ag_quaternary_data + [(year_month_tuples[i], quaternary_sums[i])]
+def aggregate_panel(panel: Panel) -> Panel:
+    """
+    Helper Function 7:
+
+    Return a panel with one row per group of panel (named '<group> Sector'), holding
+    the sum of the GDP values of the group's industries in every month. Each group's rows are
+    next to each other, so each sum is a reduction over a view of the matrix; a withheld
+    (NaN) value only makes the sum of its own group NaN in its month.
+
+    >>> panel = aggregate_panel(categorize_panel(load_panel('samp1.csv')))
+    >>> panel.industries
+    ['Primary Sector', 'Secondary Sector', 'Tertiary Sector', 'Quaternary Sector']
+    >>> int(panel.row('Quaternary Sector')[0])
+    55255
+    >>> withheld = Panel(['A', 'B', 'C'], np.array([24240]), np.array([[1.0], [np.nan], [2.0]]),
+    ...                  {'X': slice(0, 1), 'Y': slice(1, 3)})
+    >>> aggregate_panel(withheld).values.tolist()
+    [[1.0], [nan]]
+    """
+    values = np.array([panel.values[rows].sum(axis=0) for rows in panel.groups.values()],
+                      dtype=panel.values.dtype).reshape(len(panel.groups), len(panel.months))
 
-    return {'Primary Sector': ag_primary_data, 'Secondary Sector': ag_secondary_data,
-            'Tertiary Sector': ag_tertiary_data, 'Quaternary Sector': ag_quaternary_data}
+    return Panel(industries=[name + ' Sector' for name in panel.groups],
+                 months=panel.months, values=values)
 
 
 if __name__ == '__main__':
     import python_ta
 
     # python_ta.check_all(config={
-        # 'extra-imports': ['csv'],
+        # 'extra-imports': ['csv', 'functools', 're', 'typing', 'dataclasses', 'numpy', 'cache',
+        #                   'instrumentation'],
         # 'allowed-io': ['file_to_list'],
         # 'max-line-length': 100,
         # 'disable': ['R1705', 'C0200']
@@ -6,136 +6,429 @@ This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Kl
 # NOTE TO RUN, INSTALL PANDAS TO INTERPRETER
 # File > Settings > Python Interpreter > press the + button > search 'pandas' > install
 
-from dataclasses import dataclass
+from __future__ import annotations
+
+from collections.abc import Sequence
+import numpy as np
 import pandas
 import plotly.express as px
+import plotly.graph_objects as go
+
+from metrics import RecoveryMetrics
 
 
-@dataclass
 class Sector:
-    """Dataclass containing data about an economic sector. Contains 2 lists of tuples,
-    one for each actual and expected GDP values in a certain year and month
-    as well as the name of the sector.
+    """Data about an economic sector: its actual GDP values and the expected GDP values
+    calculated from the line of best fit, each stored as an array of month ordinals
+    (year * 12 + month - 1) and an array of values. The lists of (date, value) tuples they were
+    built from stay available as actual and expected, which are built on access.
+
+    Sector is left out of python_ta's contract checking: python_ta sets an attribute of its own
+    on every instance it checks, which a slotted class has no room for. __init__ checks the
+    representation invariants on the dates instead.
+
     Instance Attributes:
       - name: name of sector
-      - actual: the GDP values from the dataset and date
-      - expected: GDP values calculated from line of best fit based off pre-pandemic values and date
+      - months: the month ordinal of each actual value, in increasing order
+      - actual_values: the GDP values from the dataset
+      - expected_months: the month ordinal of each expected value, in increasing order
+      - expected_values: GDP values calculated from line of best fit based off pre-pandemic
+        values
+      - window_length: the number of months at the end of expected that are predicted values
+      - expected_band: the confidence interval (date, lower bound, upper bound) of each
+        predicted value, or [] if there is none (see computation.bootstrap_intervals)
+      - deviation_band: the confidence interval of the deviation (actual minus expected
+        value) of each predicted month, or [] if there is none
     Representation Invariants:
       - self.name != ''
-      - all(1 <= point[0][1] <= 12 for point in self.actual)
-      - all(1 <= point[0][1] <= 12 for point in self.expected)
-      - all(point[1] >= 0 for point in self.actual)
-      - all(point[1] >= 0 for point in self.expected)
-      - all(point[0] in [p[0] for p in ac] for point in ex)
+      - self.months.shape == self.actual_values.shape
+      - self.expected_months.shape == self.expected_values.shape
+      - bool(np.all(np.diff(self.months) > 0))
+      - bool(np.all(np.diff(self.expected_months) > 0))
+      - bool(np.all(self.actual_values >= 0)) and bool(np.all(self.expected_values >= 0))
+      - bool(np.all(np.isin(self.expected_months, self.months)))
+      - 0 <= self.window_length <= len(self.expected_months)
+      - len(self.expected_band) in {0, self.window_length}
+      - len(self.deviation_band) in {0, self.window_length}
+
+    >>> sector = Sector('Sector1', [((2020, 1), 4), ((2020, 2), 5)], [((2020, 1), 4)], 1)
+    >>> sector.months, sector.actual_values
+    (array([24240, 24241]), array([4, 5]))
+    >>> sector.actual[1], sector.expected == [((2020, 1), 4)]
+    (((2020, 2), 5), True)
+    >>> sector == Sector('Sector1', [((2020, 1), 4), ((2020, 2), 5)], [((2020, 1), 4)], 1)
+    True
+    >>> sector
+    Sector(name='Sector1', months=2, expected_months=1, window_length=1)
+    >>> Sector('Sector1', [((2020, 1), 4)], [((2020, 3), 4)], 1)
+    Traceback (most recent call last):
+    ...
+    ValueError: Sector1 has expected values for months without actual values
     """
+    __slots__ = ('name', 'months', 'actual_values', 'expected_months', 'expected_values',
+                 'window_length', 'expected_band', 'deviation_band')
     name: str
-    actual: list[tuple[tuple[int, int], int]]
-    expected: list[tuple[tuple[int, int], int]]
+    months: np.ndarray
+    actual_values: np.ndarray
+    expected_months: np.ndarray
+    expected_values: np.ndarray
+    window_length: int
+    expected_band: list[tuple[tuple[int, int], int, int]]
+    deviation_band: list[tuple[tuple[int, int], int, int]]
+
+    def __init__(self, name: str, actual: list[tuple[tuple[int, int], int]],
+                 expected: list[tuple[tuple[int, int], int]], window_length: int = 3,
+                 expected_band: list[tuple[tuple[int, int], int, int]] | None = None,
+                 deviation_band: list[tuple[tuple[int, int], int, int]] | None = None) -> None:
+        self.name = name
+        self.months, self.actual_values = points_to_arrays(actual)
+        self.expected_months, self.expected_values = points_to_arrays(expected)
+        self.window_length = window_length
+        self.expected_band = expected_band or []
+        self.deviation_band = deviation_band or []
+
+        # The invariants on the dates are checked once, here, in linear time
+        if np.any(np.diff(self.months) <= 0) or np.any(np.diff(self.expected_months) <= 0):
+            raise ValueError(f'the dates of {name} are not in increasing order')
+        positions = np.searchsorted(self.months, self.expected_months)
+        if np.any(positions >= len(self.months)) \
+                or np.any(self.months[np.minimum(positions, len(self.months) - 1)]
+                          != self.expected_months):
+            raise ValueError(f'{name} has expected values for months without actual values')
+
+    @property
+    def actual(self) -> PointsView:
+        """Return a read-only view of the actual values as (date, value) tuples."""
+        return PointsView(self.months, self.actual_values)
+
+    @property
+    def expected(self) -> PointsView:
+        """Return a read-only view of the expected values as (date, value) tuples."""
+        return PointsView(self.expected_months, self.expected_values)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sector):
+            return NotImplemented
+        return (self.name == other.name and self.window_length == other.window_length
+                and np.array_equal(self.months, other.months)
+                and np.array_equal(self.actual_values, other.actual_values)
+                and np.array_equal(self.expected_months, other.expected_months)
+                and np.array_equal(self.expected_values, other.expected_values)
+                and self.expected_band == other.expected_band
+                and self.deviation_band == other.deviation_band)
+
+    def __repr__(self) -> str:
+        # The values are summarized by their number of months, unlike the full lists of
+        # (date, value) tuples in the repr of the dataclass Sector once was
+        return (f'Sector(name={self.name!r}, months={len(self.months)}, '
+                f'expected_months={len(self.expected_months)}, '
+                f'window_length={self.window_length})')
+
+
+class PointsView(Sequence):
+    """A read-only list of (date, value) tuples, built on access from an array of month
+    ordinals and an array of values.
+
+    >>> view = PointsView(np.array([24240, 24241]), np.array([4, 5]))
+    >>> view[-1], view[:1], list(view) == [((2020, 1), 4), ((2020, 2), 5)]
+    (((2020, 2), 5), [((2020, 1), 4)], True)
+    """
+    __slots__ = ('months', 'values')
+    months: np.ndarray
+    values: np.ndarray
+
+    def __init__(self, months: np.ndarray, values: np.ndarray) -> None:
+        self.months = months
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.months)
+
+    def __getitem__(self, index: int | slice) \
+            -> tuple[tuple[int, int], int] | list[tuple[tuple[int, int], int]]:
+        if isinstance(index, slice):
+            months = self.months[index].tolist()
+            return [((month // 12, month % 12 + 1), value)
+                    for month, value in zip(months, self.values[index].tolist())]
+        month = int(self.months[index])
+        return (month // 12, month % 12 + 1), self.values[index].item()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PointsView):
+            return np.array_equal(self.months, other.months) \
+                and np.array_equal(self.values, other.values)
+        return isinstance(other, (list, tuple)) and self[:] == list(other)
+
+    def __repr__(self) -> str:
+        return repr(self[:])
+
+
+def points_to_arrays(points: list[tuple[tuple[int, int], int]]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the month ordinals and the values of the (date, value) tuples in points, as
+    arrays. A PointsView is converted without copying.
+
+    >>> points_to_arrays([((2020, 1), 4), ((2020, 2), 5)])
+    (array([24240, 24241]), array([4, 5]))
+    """
+    if isinstance(points, PointsView):
+        return points.months, points.values
+    months = np.fromiter((date[0] * 12 + date[1] - 1 for date, _ in points), dtype=np.int64,
+                         count=len(points))
+    values = np.array([value for _, value in points])
+    return months, values if len(values) != 0 else values.astype(np.int64)
+
+
+# Plot with WebGL (Scattergl traces) once a graph has more points than this
+WEBGL_THRESHOLD = 1000
+
+# Downsample each line of a graph to this many points (with LTTB) when it has more
+DOWNSAMPLE_THRESHOLD = 2000
 
 
 def graph_sectors(sectors: list[Sector]) -> None:
     """Displays a line graph of a list of sectors using Plotly.
     Each sector is shown as a different colour with the actual data being a solid line
-    and expected points being shown with a dashed line.
+    and expected points being shown with a dashed line. The confidence interval of the
+    expected points of a sector, if it has one, is shown as a shaded band.
     >>> s1 = Sector('Sector1', [((2020, 1), 4), ((2020, 2), 5), ((2020, 3), 3), ((2020, 4), 4), \
     ((2020, 5), 6)], [((2020, 1), 4), ((2020, 2), 5), ((2020, 3), 2), ((2020, 4), 3)])
     >>> s2 = Sector('Sector2', [((2020, 1), 8), ((2020, 2), 7), ((2020, 3), 8), ((2020, 4), 10), \
     ((2020, 5), 9)], [((2020, 1), 8), ((2020, 2), 7), ((2020, 3), 6), ((2020, 4), 5)])
     >>> graph_sectors([s1, s2])
     """
-    date = []
-    sector_name = []
-    gdp = []
-    style = []
-    difference = []
+    sectors_figure(sectors).show()
 
-    for sector in sectors:
-        for i in range(len(sector.actual)):
-            sector_name.append(sector.name)
-            date.append(str(sector.actual[i][0]))
-            gdp.append(sector.actual[i][1])
-            style.append('Actual')
-            if sector.actual[i][0] in [point[0] for point in sector.expected]:
-                difference.append(sector.expected[i][1] - sector.actual[i][1])
-            else:
-                difference.append('N/A')
-
-        for i in range(len(sector.expected)):
-            sector_name.append(sector.name)
-            date.append(str(sector.expected[i][0]))
-            gdp.append(sector.expected[i][1])
-            style.append('Expected')
-            difference.append(sector.expected[i][1] - sector.actual[i][1])
-
-    data = {'Date': date, 'Sector': sector_name, 'GDP (in $)(x 1,000,000)': gdp, 'Style': style,
-            'Difference in GDP (in $)(x 1,000,000)': difference}
-    df = pandas.DataFrame(data)
+
+def sectors_figure(sectors: list[Sector]) -> go.Figure:
+    """Return the figure displayed by graph_sectors."""
+    df = sectors_frame(sectors)
 
     graph = px.line(df, title='Monthly Canadian Expected GDP Values vs. Actual GDP Values '
                               '(Categorized by Economic Sector)', x='Date',
                     y='GDP (in $)(x 1,000,000)', color='Sector', line_dash='Style',
-                    hover_data=['Difference in GDP (in $)(x 1,000,000)'])
-    graph.show()
+                    hover_data=['Difference in GDP (in $)(x 1,000,000)'],
+                    render_mode=render_mode(len(df)))
+
+    for sector in sectors:
+        if sector.expected_band:
+            dates = months_to_datetimes(np.array([date[0] * 12 + date[1] - 1
+                                                  for date, _, _ in sector.expected_band]))
+            graph.add_scatter(x=np.concatenate([dates, dates[::-1]]),
+                              y=[upper for _, _, upper in sector.expected_band]
+                              + [lower for _, lower, _ in reversed(sector.expected_band)],
+                              fill='toself', fillcolor='rgba(128, 128, 128, 0.2)',
+                              line={'width': 0}, hoverinfo='skip',
+                              name=f'{sector.name} (confidence interval)')
+    return graph
+
+
+def sectors_frame(sectors: list[Sector]) -> pandas.DataFrame:
+    """Return the long-form data frame plotted by graph_sectors: one row per actual and per
+    expected point of each sector, with the difference between the expected and actual GDP
+    values of its month ('N/A' for actual points without an expected value). The columns are
+    built from arrays, and lines longer than DOWNSAMPLE_THRESHOLD points are downsampled.
+
+    >>> s1 = Sector('Sector1', [((2020, 1), 4), ((2020, 2), 5), ((2020, 3), 3)], \
+    [((2020, 1), 4), ((2020, 2), 2)])
+    >>> sectors_frame([s1])['Difference in GDP (in $)(x 1,000,000)'].tolist()
+    [0, -3, 'N/A', 0, -3]
+    """
+    # ACCUMULATOR columns: the columns of the rows of each sector and style so far
+    columns = {'Date': [], 'Sector': [], 'GDP (in $)(x 1,000,000)': [], 'Style': [],
+               'Difference in GDP (in $)(x 1,000,000)': []}
+
+    for sector in sectors:
+        # Position of the actual value of each expected point's month
+        to_actual = np.searchsorted(sector.months, sector.expected_months)
+        differences = sector.expected_values - sector.actual_values[to_actual]
+        actual_differences = np.full(len(sector.months), 'N/A', dtype=object)
+        actual_differences[to_actual] = differences.tolist()
+
+        for style, months, values, difference in \
+                [('Actual', sector.months, sector.actual_values, actual_differences),
+                 ('Expected', sector.expected_months, sector.expected_values,
+                  differences.astype(object))]:
+            kept = downsample_lttb(months, values, DOWNSAMPLE_THRESHOLD)
+            columns['Date'].append(months_to_datetimes(months[kept]))
+            columns['Sector'].append(np.full(len(kept), sector.name, dtype=object))
+            columns['GDP (in $)(x 1,000,000)'].append(values[kept])
+            columns['Style'].append(np.full(len(kept), style, dtype=object))
+            columns['Difference in GDP (in $)(x 1,000,000)'].append(difference[kept])
+
+    return pandas.DataFrame({name: np.concatenate(parts) if parts else []
+                             for name, parts in columns.items()})
+
+
+def months_to_datetimes(months: np.ndarray) -> np.ndarray:
+    """Return the month ordinals (year * 12 + month - 1) in months as datetime64 months.
+
+    >>> months_to_datetimes(np.array([2020 * 12 + 2]))
+    array(['2020-03'], dtype='datetime64[M]')
+    """
+    return (np.asarray(months) - 1970 * 12).astype('datetime64[M]')
+
+
+def render_mode(num_points: int) -> str:
+    """Return the Plotly Express render mode for a graph of num_points points: 'webgl'
+    (Scattergl traces) for large graphs, 'auto' otherwise.
+
+    >>> render_mode(10)
+    'auto'
+    """
+    return 'webgl' if num_points > WEBGL_THRESHOLD else 'auto'
+
+
+def downsample_lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Return the sorted indices of at most threshold points of the line through (x, y) that
+    keep its visual shape, chosen with the Largest-Triangle-Three-Buckets algorithm. Every
+    index is returned if the line has at most threshold points.
+
+    Preconditions:
+        - len(x) == len(y)
+        - threshold >= 3
+
+    >>> downsample_lttb(np.arange(5), np.array([0, 9, 0, 0, 0]), 3).tolist()
+    [0, 1, 4]
+    """
+    n = len(x)
+    if n <= threshold:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket boundaries for the points between the first and the last one
+    bounds = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    # ACCUMULATOR kept: the indices chosen so far, starting with the first point
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    for bucket in range(threshold - 2):
+        start, stop = bounds[bucket], bounds[bucket + 1]
+        next_stop = bounds[bucket + 2] if bucket + 2 < len(bounds) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+        previous = kept[bucket]
+
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        kept[bucket + 1] = start + int(np.argmax(areas))
+    kept[-1] = n - 1
+
+    return kept
 
 
 def graph_changes(sectors: list[Sector]) -> None:
     """Displays a graph showing the differences in expected and actual GDP values for each sector
-    in sectors using Plotly
+    in sectors using Plotly, with error bars showing the confidence intervals of the sectors
+    that have one
     >>> s1 = Sector('Sector1', [((2020, 2), 4), ((2020, 3), 5), ((2020, 4), 3), ((2020, 5), 4)], \
     [((2020, 2), 4), ((2020, 3), 4), ((2020, 4), 2), ((2020, 5), 3)])
     >>> s2 = Sector('Sector2', [((2020, 2), 8), ((2020, 3), 7), ((2020, 4), 8), ((2020, 5), 10)], \
     [((2020, 2), 8), ((2020, 3), 6), ((2020, 4), 5), ((2020, 5), 4)])
     >>> graph_changes([s1, s2])
     """
-    date = []
-    sector_name = []
-    difference = []
+    changes_figure(sectors).show()
 
-    for sector in sectors:
-        for i in range(3):
-            date.append(str((2020, 3 + i)))
-            sector_name.append(sector.name)
-            difference.append(sector.expected[-(3 - i)][1] - sector.actual[-(3 - i)][1])
 
-    data = {'Date': date, 'Sector': sector_name,
-            'Difference in GDP (in $)(x 1,000,000)': difference}
-    df = pandas.DataFrame(data)
+def changes_figure(sectors: list[Sector]) -> go.Figure:
+    """Return the figure displayed by graph_changes."""
+    df = window_frame(sectors)
+    difference = df['Expected'] - df['Actual']
+    df['Difference in GDP (in $)(x 1,000,000)'] = difference
+    error_bars = {}
+    if 'Deviation lower' in df:
+        # The difference is minus the deviation, so its interval is the deviation's, negated
+        error_bars = {'error_y': -df['Deviation lower'] - difference,
+                      'error_y_minus': difference + df['Deviation upper']}
 
     graph = px.line(df, title='The Difference Between Expected and Actual GDP Values '
                               '(Categorized by Economic Sector)', x='Date',
-                    y='Difference in GDP (in $)(x 1,000,000)', color='Sector')
-    graph.show()
-    
-    
-def graph_percentage(sectors: list[Sector]) -> None:
+                    y='Difference in GDP (in $)(x 1,000,000)', color='Sector',
+                    render_mode=render_mode(len(df)), **error_bars)
+    return graph
+
+
+def graph_percentage(metrics: RecoveryMetrics) -> None:
     """Displays a graph showing the percentage lost in expected and actual GDP values
-    for each sector in sectors using Plotly
+    for each series in metrics using Plotly, over the whole period after the start of the event
+    window (see metrics.compute_metrics)
+    """
+    percentage_figure(metrics).show()
+
+
+def percentage_figure(metrics: RecoveryMetrics) -> go.Figure:
+    """Return the figure displayed by graph_percentage."""
+    df = metrics_frame(metrics)
+    return px.line(df, title='The Percentage Lost Between Expected and Actual GDP Values '
+                             '(Categorized by Economic Sector)', x='Date',
+                   y='Percentage lost in GDP', color='Sector', render_mode=render_mode(len(df)))
+
+
+def metrics_frame(metrics: RecoveryMetrics) -> pandas.DataFrame:
+    """Return a data frame with the date, series name and percentage gap (see
+    metrics.RecoveryMetrics) of every month of every series in metrics.
+
+    >>> from computation import EventWindow
+    >>> from metrics import metrics_of
+    >>> metrics = metrics_of(['A'], np.array([24240, 24241]), EventWindow((2020, 1), 1), \
+np.array([[9, 11]]), np.array([[10.0, 10.0]]))
+    >>> metrics_frame(metrics).values.tolist()
+    [[Timestamp('2020-01-01 00:00:00'), 'A', 10.0], [Timestamp('2020-02-01 00:00:00'), 'A', -10.0]]
     """
-    date = []
-    sector_name = []
-    percents = []
+    num_months = len(metrics.months)
+    return pandas.DataFrame({'Date': months_to_datetimes(np.tile(metrics.months,
+                                                                 len(metrics.series))),
+                             'Sector': np.repeat(metrics.series, num_months),
+                             'Percentage lost in GDP': metrics.percentage_gap.ravel()})
+
+
+# The functions building each figure from a list of sectors, by name
+FIGURE_BUILDERS = {'sectors': sectors_figure, 'changes': changes_figure}
+
+# The functions building each figure from the recovery metrics of the sectors, by name
+METRICS_FIGURE_BUILDERS = {'percentage': percentage_figure}
 
+
+def window_frame(sectors: list[Sector]) -> pandas.DataFrame:
+    """Return a data frame with the date, sector name, actual and expected GDP values of the
+    predicted months (the last window_length points) of each sector. If any sector has a
+    deviation_band, the frame also has its bounds ('Deviation lower' and 'Deviation upper',
+    NaN for the sectors without one).
+
+    >>> s1 = Sector('Sector1', [((2019, 12), 4), ((2020, 1), 5)], \
+    [((2019, 12), 4), ((2020, 1), 3)], window_length=1)
+    >>> window_frame([s1]).values.tolist()
+    [[Timestamp('2020-01-01 00:00:00'), 'Sector1', 5, 3]]
+    """
+    columns = {'Date': [], 'Sector': [], 'Actual': [], 'Expected': []}
     for sector in sectors:
-        for i in range(3):
-            date.append(str((2020, 3 + i)))
-            sector_name.append(sector.name)
-            percents.append(100 - (sector.actual[-(3 - i)][1] / 
-                                     sector.expected[-(3 - i)][1] * 100))
+        length = sector.window_length
+        columns['Date'].extend(sector.expected_months[len(sector.expected_months) - length:])
+        columns['Sector'].extend([sector.name] * length)
+        columns['Actual'].extend(sector.actual_values[len(sector.months) - length:].tolist())
+        columns['Expected'].extend(
+            sector.expected_values[len(sector.expected_months) - length:].tolist())
 
-    data = {'Date': date, 'Sector': sector_name, 'Percentage lost in GDP': percents}
-    df = pandas.DataFrame(data)
+    if any(sector.deviation_band for sector in sectors):
+        bands = [sector.deviation_band or [(None, np.nan, np.nan)] * sector.window_length
+                 for sector in sectors]
+        columns['Deviation lower'] = [lower for band in bands for _, lower, _ in band]
+        columns['Deviation upper'] = [upper for band in bands for _, _, upper in band]
 
-    graph = px.line(df, title='The Percentage Lost Between Expected and Actual GDP Values '
-                              '(Categorized by Economic Sector)', x='Date',
-                    y='Percentage lost in GDP', color='Sector')
-    graph.show()
+    columns['Date'] = months_to_datetimes(np.array(columns['Date'], dtype=np.int64))
+    return pandas.DataFrame(columns)
 
 
 if __name__ == '__main__':
     import python_ta
 
     # python_ta.check_all(config={
-    #     'extra-imports': ['python_ta.contracts', 'math', 'pandas', 'plotly.express', 'dataclass'],
+    #     'extra-imports': ['python_ta.contracts', 'math', 'numpy', 'pandas', 'plotly.express',
+    #                       'plotly.graph_objects', 'collections.abc', 'metrics', 'computation',
+    #                       'main'],
     #     'max-line-length': 100,
     #     'disable': ['R1705', 'C0200']
     # })
@@ -145,7 +438,8 @@ if __name__ == '__main__':
     doctest.testmod()
 
     import python_ta.contracts
+    from main import check_function_contracts
 
     python_ta.contracts.DEBUG_CONTRACTS = False
-    python_ta.contracts.check_all_contracts()
+    check_function_contracts('__main__')  # the slotted classes are left out (see Sector)
     
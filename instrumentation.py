@@ -0,0 +1,197 @@
+"""
+Instrumentation Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Opt-in measurements of each stage of the program (parsing, classifying, fitting, plotting):
+# wall time, CPU time, peak memory allocated (with tracemalloc) and how many rows and series it
+# handled. Every function that can be measured takes an optional Instrumentation; when it is
+# None, measure_stage returns a shared do-nothing context manager, so the cost is negligible.
+
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, ContextManager, Iterator
+
+
+@dataclass
+class StageRecord:
+    """Dataclass containing the measurements of one run of a stage of the program.
+    Instance Attributes:
+      - stage: the name of the stage
+      - wall_seconds: the time the stage took
+      - cpu_seconds: the CPU time used by the process during the stage
+      - peak_bytes: the most memory allocated during the stage, beyond what was allocated
+        when it started (0 if memory was not traced)
+      - rows: the number of input rows (e.g. industries) the stage handled
+      - series: the number of series the stage produced or fitted
+    Representation Invariants:
+      - self.stage != ''
+      - self.wall_seconds >= 0 and self.cpu_seconds >= 0 and self.peak_bytes >= 0
+    """
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_bytes: int = 0
+    rows: int = 0
+    series: int = 0
+
+
+@dataclass
+class LogSink:
+    """Sink writing every record to logger as one line.
+    Instance Attributes:
+      - logger: the logger the records are written to
+      - level: the logging level of the lines
+    """
+    logger: logging.Logger = field(default_factory=lambda: logging.getLogger('gdp.stages'))
+    level: int = logging.INFO
+
+    def __call__(self, record: StageRecord) -> None:
+        self.logger.log(self.level, 'stage=%s wall=%.6fs cpu=%.6fs peak=%dB rows=%d series=%d',
+                        record.stage, record.wall_seconds, record.cpu_seconds,
+                        record.peak_bytes, record.rows, record.series)
+
+
+@dataclass
+class JsonFileSink:
+    """Sink appending every record to a file as one JSON object per line.
+    Instance Attributes:
+      - filename: the file the records are appended to
+    """
+    filename: str
+
+    def __call__(self, record: StageRecord) -> None:
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(asdict(record)) + '\n')
+
+
+@dataclass
+class _Frame:
+    """The memory state of a stage that has not finished yet."""
+    record: StageRecord
+    start_bytes: int
+    peak_bytes: int
+
+
+class Instrumentation:
+    """Measures stages of the program and sends a StageRecord of each one to a sink, which
+    is any function taking a StageRecord (e.g. a LogSink, a JsonFileSink or a callback).
+    Stages may be nested; the peak memory of a stage includes that of the stages within it.
+
+    >>> records = []
+    >>> instrumentation = Instrumentation(records.append)
+    >>> with instrumentation.stage('outer') as outer:
+    ...     with instrumentation.stage('inner', rows=10) as inner:
+    ...         inner.series = len([0] * 100_000)
+    >>> [(record.stage, record.rows, record.series) for record in records]
+    [('inner', 10, 100000), ('outer', 0, 0)]
+    >>> records[1].peak_bytes >= records[0].peak_bytes > 0
+    True
+    """
+    sink: Callable[[StageRecord], None]
+    trace_memory: bool
+    _frames: list[_Frame]
+    _started_tracing: bool
+
+    def __init__(self, sink: Callable[[StageRecord], None], trace_memory: bool = True) -> None:
+        self.sink = sink
+        self.trace_memory = trace_memory
+        self._frames = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0, series: int = 0) -> Iterator[StageRecord]:
+        """Measure the code run inside the with block as the stage called name, then send its
+        record to the sink. The record is given to the block, which may set its counts."""
+        record = StageRecord(stage=name, rows=rows, series=series)
+        self._enter(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - wall_start
+            record.cpu_seconds = time.process_time() - cpu_start
+            self._exit()
+            self.sink(record)
+
+    def _enter(self, record: StageRecord) -> None:
+        """Start tracing memory for a new stage, if memory is traced."""
+        if not self.trace_memory:
+            self._frames.append(_Frame(record, 0, 0))
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1].peak_bytes = max(self._frames[-1].peak_bytes, peak)
+        tracemalloc.reset_peak()
+        self._frames.append(_Frame(record, current, current))
+
+    def _exit(self) -> None:
+        """Record the peak memory of the innermost stage, and pass it on to the stage around
+        it."""
+        frame = self._frames.pop()
+        if not self.trace_memory:
+            return
+
+        peak = max(frame.peak_bytes, tracemalloc.get_traced_memory()[1])
+        frame.record.peak_bytes = peak - frame.start_bytes
+        if self._frames:
+            self._frames[-1].peak_bytes = max(self._frames[-1].peak_bytes, peak)
+            tracemalloc.reset_peak()
+        elif self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+class _NullStage:
+    """A reusable context manager that measures nothing."""
+    record: StageRecord
+
+    def __init__(self) -> None:
+        self.record = StageRecord(stage='disabled')
+
+    def __enter__(self) -> StageRecord:
+        return self.record
+
+    def __exit__(self, *exc_info: object) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+def measure_stage(instrumentation: Instrumentation | None, name: str, rows: int = 0,
+                  series: int = 0) -> ContextManager[StageRecord]:
+    """Return a context manager measuring the stage called name with instrumentation, or one
+    that does nothing if instrumentation is None.
+
+    >>> with measure_stage(None, 'parse') as record:
+    ...     record.rows = 5
+    """
+    if instrumentation is None:
+        return _NULL_STAGE
+    return instrumentation.stage(name, rows, series)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['json', 'logging', 'time', 'tracemalloc', 'contextlib',
+    #                       'dataclasses', 'typing'],
+    #     'allowed-io': ['JsonFileSink.__call__'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
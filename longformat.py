@@ -0,0 +1,181 @@
+"""
+Long Format Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Reads the full StatCan download of table 36-10-0434-01, which is in "long" format: one row
+# per date, geography, industry, seasonal adjustment and price basis. The file is scanned once
+# in chunks of rows; rows that do not match the filters are dropped during the scan, and the
+# rows that do are kept as compact arrays until they are pivoted into one Panel per geography.
+
+import itertools
+from typing import Iterator
+
+import numpy as np
+
+from data import Panel, aggregate_panel, categorize_panel, decode_cells, iter_rows
+
+# Columns of the long-format table
+DATE_COLUMN = 'REF_DATE'
+GEOGRAPHY_COLUMN = 'GEO'
+INDUSTRY_COLUMN = 'North American Industry Classification System (NAICS)'
+VALUE_COLUMN = 'VALUE'
+
+# The rows that match the wide extracts (e.g. samp1.csv)
+DEFAULT_FILTERS = {'Seasonal adjustment': 'Seasonally adjusted at annual rates',
+                   'Prices': 'Chained (2012) dollars'}
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+def iter_long_chunks(filename: str, filters: dict[str, str] | None = None,
+                     geographies: set[str] | None = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) \
+        -> Iterator[tuple[list[str], list[str], np.ndarray, np.ndarray]]:
+    """Yield the rows of the long-format table in filename that match filters (a dictionary
+    mapping column names to required values; DEFAULT_FILTERS if None) and whose geography is
+    in geographies (any geography if None), chunk_size rows of the file at a time.
+
+    Each chunk is (geographies, industries, month ordinals, values) of its matching rows.
+    Missing values (empty, or StatCan markers such as '..') are NaN.
+
+    Preconditions:
+        - filename != ''
+        - chunk_size >= 1
+    """
+    if filters is None:
+        filters = DEFAULT_FILTERS
+
+    rows = iter_rows(filename)
+    header = next(rows)
+    column = {name: i for i, name in enumerate(header)}
+    conditions = [(column[name], value) for name, value in filters.items()]
+    date, geo, industry, value = (column[DATE_COLUMN], column[GEOGRAPHY_COLUMN],
+                                  column[INDUSTRY_COLUMN], column[VALUE_COLUMN])
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        kept = [row for row in chunk if len(row) == len(header)
+                and all(row[i] == required for i, required in conditions)
+                and (geographies is None or row[geo] in geographies)]
+        yield ([row[geo] for row in kept], [row[industry] for row in kept],
+               np.array([int(row[date][:4]) * 12 + int(row[date][5:7]) - 1 for row in kept],
+                        dtype=np.int64),
+               decode_cells([row[value] for row in kept])[0].astype(np.float64))
+
+
+def load_long_panels(filename: str, filters: dict[str, str] | None = None,
+                     geographies: set[str] | None = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict[str, Panel]:
+    """Return a Panel for each geography in the long-format table in filename, holding the
+    rows that match filters (see iter_long_chunks). A panel's values are int64 if none of
+    them are missing, and float64 with NaN for missing values otherwise.
+
+    Only the matching rows are kept while scanning, as integer codes and numbers.
+
+    Preconditions:
+        - filename != ''
+        - chunk_size >= 1
+
+    >>> import os, tempfile
+    >>> from synthetic import write_synthetic_long_csv
+    >>> path = os.path.join(tempfile.mkdtemp(), 'long.csv')
+    >>> write_synthetic_long_csv(path, ['Canada', 'Ontario'], 25, 90)
+    >>> panels = load_long_panels(path, chunk_size=1000)
+    >>> sorted(panels), panels['Ontario'].values.shape
+    (['Canada', 'Ontario'], (28, 90))
+    """
+    # Integer codes of the geographies and industries seen so far, in order of appearance
+    geo_codes = {}
+    industry_codes = {}
+    # ACCUMULATOR parts: the (geography, industry, month, value) arrays of each chunk
+    parts = []
+
+    for geos, industries, months, values in iter_long_chunks(filename, filters, geographies,
+                                                             chunk_size):
+        parts.append((np.array([geo_codes.setdefault(g, len(geo_codes)) for g in geos],
+                               dtype=np.int64),
+                      np.array([industry_codes.setdefault(i, len(industry_codes))
+                                for i in industries], dtype=np.int64),
+                      months, values))
+
+    if not parts:
+        return {}
+    geo_ids, industry_ids, months, values = (np.concatenate(column) for column in zip(*parts))
+    industry_names = list(industry_codes)
+
+    return {geo: pivot(industry_ids[geo_ids == code], months[geo_ids == code],
+                       values[geo_ids == code], industry_names)
+            for geo, code in geo_codes.items()}
+
+
+def pivot(industry_ids: np.ndarray, months: np.ndarray, values: np.ndarray,
+          industry_names: list[str]) -> Panel:
+    """Return the Panel of the observations (industry_ids[i], months[i], values[i]), with one
+    row per industry that has an observation (in order of first appearance in
+    industry_names) and one column per month between the first and the last observed month.
+    Months or industries without an observation are NaN.
+
+    Preconditions:
+        - len(industry_ids) == len(months) == len(values)
+        - len(months) != 0
+
+    >>> panel = pivot(np.array([1, 1, 0]), np.array([24240, 24241, 24241]), \
+np.array([5.0, 6.0, 7.0]), ['A', 'B'])
+    >>> panel.industries, panel.values.tolist()
+    (['A', 'B'], [[nan, 7.0], [5.0, 6.0]])
+    """
+    rows, row_of = np.unique(industry_ids, return_inverse=True)
+    all_months = np.arange(months.min(), months.max() + 1)
+
+    matrix = np.full((len(rows), len(all_months)), np.nan)
+    matrix[row_of, months - all_months[0]] = values
+
+    if not np.isnan(matrix).any():
+        matrix = np.round(matrix).astype(np.int64)
+    return Panel(industries=[industry_names[i] for i in rows.tolist()], months=all_months,
+                 values=matrix)
+
+
+def load_long_sector_panels(filename: str, filters: dict[str, str] | None = None,
+                            geographies: set[str] | None = None,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict[str, Panel]:
+    """Return, for each geography in the long-format table in filename, the Panel with one
+    row per economic sector that open_convert_and_aggregate produces for the wide extracts.
+
+    Preconditions:
+        - filename != ''
+        - chunk_size >= 1
+    """
+    return {geo: aggregate_panel(categorize_panel(panel)) for geo, panel in
+            load_long_panels(filename, filters, geographies, chunk_size).items()}
+
+
+def open_long_convert_and_aggregate(filename: str, geographies: set[str] | None = None) \
+        -> dict[str, dict[str, list[tuple[tuple[int, int], int]]]]:
+    """Return, for each geography in the long-format table in filename, the dictionary that
+    open_convert_and_aggregate returns for the wide extracts (mapping each economic sector to
+    year-month tuples and aggregated GDP values).
+
+    Preconditions:
+        - filename != ''
+    """
+    return {geo: panel.to_dict()
+            for geo, panel in load_long_sector_panels(filename, geographies=geographies).items()}
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['itertools', 'typing', 'numpy', 'data', 'synthetic'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
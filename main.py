@@ -4,47 +4,474 @@ Main Module for the final project (CSC110 at the University of Toronto)
 This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
 """
 
-from data import open_convert_and_aggregate
-from computation import run_computations
-from display import Sector, graph_sectors, graph_changes, graph_percentage
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
 
+import cache
+from data import CACHE_DIR, mark_validated, open_convert_and_aggregate, set_full_checks, \
+    validate_panel
+from computation import BASELINE_MODELS, COVID_WINDOW, EventWindow, bootstrap_intervals, \
+    run_computations, run_events
+from instrumentation import Instrumentation, JsonFileSink, LogSink, measure_stage
+from metrics import RecoveryMetrics, compute_metrics, format_metrics
 
-def run_program(file: str = 'samp1.csv') -> None:
-    """Runs the entire program by processing file (samp1.csv by default), predicting GDP values,
-    and displaying graphs.
+# NOTE: display (pandas and plotly) is only imported by run_program when graphs are shown,
+# so that headless runs start quickly. The allowed import times are kept in IMPORT_BUDGET_FILE.
+
+IMPORT_BUDGET_FILE = 'import_budget.json'
+
+# The directory of this file, where the modules and IMPORT_BUDGET_FILE are
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SECTOR_NAMES = ['Primary Sector', 'Secondary Sector', 'Tertiary Sector', 'Quaternary Sector']
+
+
+def run_program(file: str = 'samp1.csv', show_graphs: bool = True,
+                window: EventWindow = COVID_WINDOW,
+                instrumentation: Instrumentation | None = None, model: str = 'linear',
+                bootstrap: int = 0, seed: int = 0) -> dict:
+    """Runs the entire program by processing file (samp1.csv by default), predicting GDP values
+    in window (March to May 2020 by default), and displaying graphs (unless show_graphs is
+    False). Return the computed data points. The expected values come from the baseline model
+    called model (the line of best fit by default; see computation.BASELINE_MODELS). If
+    bootstrap is positive, the graphs show the confidence intervals of the line of best fit
+    computed from bootstrap replicates drawn with the random seed seed.
+
+    If instrumentation is given, it measures each stage of the program (loading, computing and
+    graphing, and the stages within them).
 
     samp1.csv has dates from Jan 2014 to Sep 2021.
 
     Preconditions:
         - file != ''
+        - bootstrap == 0 or model == 'linear'
+    """
+    with measure_stage(instrumentation, 'load') as record:
+        data = open_convert_and_aggregate(file, instrumentation=instrumentation,
+                                          required=window.dates())
+        record.series = len(data)
+
+    # The line of best fit is updated from the running sums of the last run on file
+    trends = cache.trends_file(CACHE_DIR, file, f'sectors-{window.start[0]}-{window.start[1]:02}')
+    with measure_stage(instrumentation, 'compute', series=len(data)):
+        data_points = run_computations(data, window, instrumentation=instrumentation,
+                                       model=model, trends=trends)
+
+    intervals = {}
+    if bootstrap > 0 and show_graphs:
+        with measure_stage(instrumentation, 'bootstrap', series=len(data)):
+            intervals = bootstrap_intervals(data, window, bootstrap, seed=seed)
+
+    if show_graphs:
+        with measure_stage(instrumentation, 'metrics', series=len(data)):
+            metrics = compute_metrics(data, window, model)
+
+        with measure_stage(instrumentation, 'graph', series=len(data_points)):
+            show_graphs_of(data_points, window, intervals, metrics)
+
+    return data_points
+
+
+def check_function_contracts(*module_names: str) -> None:
+    """Check the contracts of the functions defined in the modules called module_names on
+    every call to them from within those modules (e.g. run_computations calling
+    calculate_dev). Classes are left alone: python_ta cannot check frozen dataclasses.
+
+    Preconditions:
+        - all(name in sys.modules for name in module_names)
     """
-    data = open_convert_and_aggregate(file)
+    import inspect
+    import python_ta.contracts
 
-    data_points = run_computations(data)
+    for name in module_names:
+        module = sys.modules[name]
+        for attribute, value in inspect.getmembers(module, inspect.isfunction):
+            if value.__module__ == name:
+                setattr(module, attribute, python_ta.contracts.check_contracts(value))
+
+
+def show_graphs_of(data_points: dict, window: EventWindow, intervals: dict | None = None,
+                   metrics: RecoveryMetrics | None = None) -> None:
+    """Display the graphs of the data points computed by run_computations for window, with the
+    confidence intervals computed by bootstrap_intervals, if they are given, and the graph of
+    the recovery metrics computed by compute_metrics, if they are given."""
+    from display import Sector, graph_sectors, graph_changes, graph_percentage
 
     # ACCUMULATOR sectors: the running list of Sector objects
     sectors = []
-    sector_names = ['Primary Sector', 'Secondary Sector', 'Tertiary Sector', 'Quaternary Sector']
-    for sector_name in sector_names:
+    for sector_name in SECTOR_NAMES:
+        expected_band, deviation_band = (intervals or {}).get(sector_name, ([], []))
         sectors.append(Sector(name=sector_name, actual=data_points[sector_name][0],
-                              expected=data_points[sector_name][1]))
+                              expected=data_points[sector_name][1],
+                              window_length=window.length, expected_band=expected_band,
+                              deviation_band=deviation_band))
 
     graph_sectors(sectors)
     graph_changes(sectors)
-    graph_percentage(sectors)
+    if metrics is not None:
+        graph_percentage(metrics)
 
 
-if __name__ == '__main__':
-    import python_ta.contracts
-    python_ta.contracts.DEBUG_CONTRACTS = False
-    python_ta.contracts.check_all_contracts()
+def results_to_json(data_points: dict, intervals: dict | None = None) \
+        -> dict[str, dict[str, list[list[int]]]]:
+    """Return the output of run_computations as a JSON-serializable dictionary mapping each
+    sector to its actual values, expected values and deviations, each as [year, month, value].
+    If the output of bootstrap_intervals is given as intervals, each sector also has the
+    intervals of its expected values and deviations, as [year, month, lower, upper].
+
+    >>> results_to_json({'Primary Sector': ([((2020, 2), 5)], [((2020, 2), 4)], [])})
+    {'Primary Sector': {'actual': [[2020, 2, 5]], 'expected': [[2020, 2, 4]], 'deviations': []}}
+    """
+    results = {sector: {key: [[date[0], date[1], value] for date, value in points]
+                        for key, points in zip(['actual', 'expected', 'deviations'], values)}
+               for sector, values in data_points.items()}
+
+    for sector, bands in (intervals or {}).items():
+        for key, band in zip(['expected_interval', 'deviation_interval'], bands):
+            results[sector][key] = [[date[0], date[1], lower, upper]
+                                    for date, lower, upper in band]
+    return results
+
+
+def format_deviations(data_points: dict, intervals: dict | None = None) -> str:
+    """Return a plain text table of the deviation between the actual and expected GDP values
+    of each sector in data_points, one line per sector and month, followed by its confidence
+    interval if the output of bootstrap_intervals is given as intervals.
+
+    >>> print(format_deviations({'Primary Sector': ([], [], [((2020, 3), -5804)])}))
+    Primary Sector       2020-03      -5804
+    >>> print(format_deviations({'Primary Sector': ([], [], [((2020, 3), -5804)])}, \
+{'Primary Sector': ([], [((2020, 3), -15705, 9174)])}))
+    Primary Sector       2020-03      -5804  [    -15705,       9174]
+    """
+    # ACCUMULATOR lines: the lines of the table so far
+    lines = []
+    for sector, values in data_points.items():
+        bands = (intervals or {}).get(sector, ([], []))[1] or [None] * len(values[2])
+        for (date, deviation), band in zip(values[2], bands):
+            line = f'{sector:<20} {date[0]}-{date[1]:02} {deviation:>10}'
+            if band is not None:
+                line += f'  [{band[1]:>10}, {band[2]:>10}]'
+            lines.append(line)
+
+    return '\n'.join(lines)
+
+
+def open_series(filename: str, groupings: list[str] | None = None,
+                joined: list[str] | None = None) -> dict[str, list[tuple[tuple[int, int], int]]]:
+    """Return the GDP values of every group of groupings in filename (see
+    rollup.open_convert_and_rollup), or of the four economic sectors if groupings is None.
+    If joined is given, return instead the four economic sectors of filename and of every
+    table in joined, over the months they all have (see align.open_and_align).
+
+    Preconditions:
+        - filename != ''
+        - groupings is None or joined is None
+    """
+    if joined is not None:
+        from align import open_and_align
+        panel = open_and_align([filename] + joined, 'drop', sectors=True)
+        return mark_validated(validate_panel(panel).to_dict())
+    if groupings is None:
+        return open_convert_and_aggregate(filename)
+
+    from rollup import open_convert_and_rollup
+    return open_convert_and_rollup(filename, groupings)
+
+
+def split_groupings(data: dict[str, list[tuple[tuple[int, int], int]]]) \
+        -> dict[str, dict[str, list[tuple[tuple[int, int], int]]]]:
+    """Return the series of data by grouping, for the output of open_series: the series named
+    '<grouping>: <group>' by rollup.open_convert_and_rollup, or every series under 'sectors'
+    if they are not named so.
+
+    >>> split_groupings({'a: X': [], 'b: Y': [], 'a: Z': []})
+    {'a': {'a: X': [], 'a: Z': []}, 'b': {'b: Y': []}}
+    >>> split_groupings({'Primary Sector': []})
+    {'sectors': {'Primary Sector': []}}
+    """
+    # ACCUMULATOR groupings: the series of each grouping so far
+    groupings = {}
+    for name, points in data.items():
+        grouping, separator, _ = name.partition(': ')
+        groupings.setdefault(grouping if separator else 'sectors', {})[name] = points
+    return groupings
+
+
+def parse_event(text: str) -> EventWindow:
+    """Return the event window described by text, written as YEAR-MONTH or YEAR-MONTH:LENGTH
+    (the length is 3 months if omitted).
+
+    Raise ValueError if text is not written so, if the month is not between 1 and 12, or if
+    the length is less than 1.
+
+    >>> parse_event('2008-10:6')
+    EventWindow(start=(2008, 10), length=6, label='2008-10:6')
+    >>> parse_event('2020-13')
+    Traceback (most recent call last):
+    ...
+    ValueError: the month of 2020-13 is not between 1 and 12
+    >>> parse_event('2020-03:0')
+    Traceback (most recent call last):
+    ...
+    ValueError: the length of 2020-03:0 is less than 1 month
+    >>> parse_event('2020-03:-2')
+    Traceback (most recent call last):
+    ...
+    ValueError: the length of 2020-03:-2 is less than 1 month
+    """
+    start, _, length = text.partition(':')
+    try:
+        year, month = start.split('-')
+        window = EventWindow(start=(int(year), int(month)), length=int(length or 3), label=text)
+    except ValueError as error:
+        raise ValueError(f'{text} is not written as YEAR-MONTH[:LENGTH]') from error
+    if not 1 <= window.start[1] <= 12:
+        raise ValueError(f'the month of {text} is not between 1 and 12')
+    if window.length < 1:
+        raise ValueError(f'the length of {text} is less than 1 month')
+    return window
+
+
+def event_argument(text: str) -> EventWindow:
+    """Return the event window described by text (see parse_event), for argparse, which only
+    reports the message of an ArgumentTypeError.
+
+    Raise argparse.ArgumentTypeError if text is not a valid event window.
+    """
+    try:
+        return parse_event(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f'invalid event {text!r}: {error}') from error
+
+
+##########################################
+# Import-time budget
+##########################################
+
+
+def measure_import_time(module: str) -> float:
+    """Return the time, in milliseconds, that a fresh interpreter started in PROJECT_DIR takes
+    to import module (including everything it imports), as reported by python -X importtime.
+
+    Raise ValueError if python -X importtime does not report the import of module (e.g. it was
+    already imported by the interpreter at startup).
+
+    Preconditions:
+        - module != ''
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True, cwd=PROJECT_DIR)
+    for line in result.stderr.splitlines():
+        match = re.fullmatch(r'import time:\s+\d+ \|\s+(\d+) \| ' + re.escape(module), line)
+        if match is not None:
+            return int(match.group(1)) / 1000
+    raise ValueError(f'python -X importtime did not report the import of {module}')
+
+
+def check_import_budget(budget_file: str = os.path.join(PROJECT_DIR, IMPORT_BUDGET_FILE)) \
+        -> bool:
+    """Measure the import time of every module in budget_file, print it next to its budget and
+    return whether all of them are within budget. A module whose import time cannot be
+    measured is not within budget.
+
+    Preconditions:
+        - budget_file != ''
+    """
+    with open(budget_file) as f:
+        budgets = json.load(f)
+
+    # ACCUMULATOR within_budget: whether every module measured so far is within budget
+    within_budget = True
+    for module, budget in budgets.items():
+        try:
+            measured = measure_import_time(module)
+        except ValueError as error:
+            print(f'{module:<15} not measured: {error}')
+            within_budget = False
+            continue
+        status = 'ok' if measured <= budget else 'OVER BUDGET'
+        print(f'{module:<15} {measured:8.1f} ms (budget {budget} ms) {status}')
+        within_budget = within_budget and measured <= budget
+
+    return within_budget
+
+
+##########################################
+# Command-line entry point
+##########################################
 
-    import doctest
-    doctest.testmod(verbose=True)
 
+def main(argv: list[str] | None = None) -> int:
+    """Run the program from the command line with the arguments in argv (sys.argv by default)
+    and return its exit status.
+    """
+    parser = argparse.ArgumentParser(description='Compare actual and expected (pre-pandemic '
+                                                 'trend) Canadian GDP by economic sector.')
+    parser.add_argument('file', nargs='?', default='samp1.csv',
+                        help='StatCan table 36-10-0434-01 extract (default: samp1.csv)')
+    parser.add_argument('--headless', action='store_true',
+                        help='print the deviations instead of showing graphs')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write all computed values to PATH as JSON (implies --headless)')
+    parser.add_argument('--event', action='append', type=event_argument, metavar='YYYY-MM[:N]',
+                        help='compare the N months (3 by default) from YYYY-MM with the trend '
+                             'before them; may be given several times (default: 2020-03:3)')
+    parser.add_argument('--model', choices=list(BASELINE_MODELS), default='linear',
+                        help='baseline fitted to the months before each event '
+                             '(default: linear)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help='add confidence intervals of the expected values and deviations '
+                             'computed from N bootstrap replicates (linear model only)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the bootstrap replicates (default: 0)')
+    parser.add_argument('--metrics', action='store_true',
+                        help='print the trough, recovery and lost GDP of each sector over the '
+                             'whole period after each event, instead of the deviations')
+    parser.add_argument('--report', metavar='DIR',
+                        help='write the graphs of every event (and grouping) to DIR as static '
+                             'HTML pages, instead of showing them')
+    parser.add_argument('--rollup', action='append', metavar='GROUPING',
+                        help='report every group of GROUPING (sectors, naics2, naics3, or a JSON '
+                             'or YAML file mapping NAICS codes to groups) instead of the four '
+                             'sectors, without graphs; may be repeated')
+    parser.add_argument('--join', action='append', metavar='FILE',
+                        help='also report the sectors of the table in FILE (e.g. another '
+                             'release), over the months every table has; may be repeated')
+    parser.add_argument('--compare', nargs='+', metavar='FILE',
+                        help='compare the baseline and deviations of several releases of the '
+                             'table (loaded in parallel) around each event and print their '
+                             'revisions')
+    parser.add_argument('--breaks', type=int, metavar='TOP',
+                        help='print the TOP most likely break months over every industry')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='PATH',
+                        help='measure the time and memory of each stage and log it to stderr, '
+                             'or append it to PATH as JSON lines')
+    parser.add_argument('--check-import-budget', action='store_true',
+                        help=f'check module import times against {IMPORT_BUDGET_FILE}')
+    parser.add_argument('--debug', action='store_true',
+                        help='check all contracts and run the doctests first')
+    args = parser.parse_args(argv)
+
+    if args.check_import_budget:
+        return 0 if check_import_budget() else 1
+
+    if args.debug:
+        # Check the contracts of the computations too, on every call, without trusting the
+        # validation done when the data is loaded
+        import python_ta.contracts
+        python_ta.contracts.DEBUG_CONTRACTS = False
+        python_ta.contracts.check_all_contracts()
+        check_function_contracts('computation')
+        set_full_checks(True)
+
+        import doctest
+        doctest.testmod(verbose=True)
+
+    if args.rollup is not None and args.join is not None:
+        parser.error('--rollup and --join cannot be used together')
+    if args.bootstrap > 0 and args.model != 'linear':
+        parser.error('--bootstrap only computes the confidence intervals of the linear model')
+
+    try:
+        return run_command(args)
+    except ValueError as error:  # e.g. an event outside the data, or a ValidationError
+        parser.error(str(error))
+
+
+def run_command(args: argparse.Namespace) -> int:
+    """Run the program with the command-line arguments args, parsed by main, and return its
+    exit status.
+
+    Raise ValueError (or ValidationError) if the data cannot be loaded or if an event window
+    does not fit in it.
+    """
+    windows = args.event or [COVID_WINDOW]
+    if args.compare is not None:
+        from vintages import align_releases, format_comparison, load_releases
+        loaded = load_releases(args.compare)
+        print('\n'.join((f'{window.label}\n' if args.event is not None else '')
+                        + format_comparison(align_releases(loaded, window))
+                        for window in windows))
+        return 0
+
+    if args.breaks is not None:
+        from breaks import rank_breaks
+        from data import load_panel
+        for industry, date, score in rank_breaks(load_panel(args.file), top=args.breaks):
+            print(f'{industry:<60} {date[0]}-{date[1]:02} {score:>8.1f}')
+        return 0
+
+    instrumentation = None
+    if args.profile == '-':
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        instrumentation = Instrumentation(LogSink())
+    elif args.profile is not None:
+        instrumentation = Instrumentation(JsonFileSink(args.profile))
+
+    headless = args.headless or args.output is not None or args.rollup is not None \
+        or args.join is not None
+    if args.metrics:
+        data = open_series(args.file, args.rollup, args.join)
+        print('\n'.join(format_metrics(compute_metrics(data, window, args.model))
+                        for window in windows))
+        return 0
+
+    if args.report is not None:
+        from report import ReportRun, export_report
+        groupings = split_groupings(open_series(args.file, args.rollup, args.join))
+        paths = export_report([ReportRun(f'{grouping} {window.label}', data, window,
+                                         args.model, args.bootstrap, args.seed)
+                               for window in windows for grouping, data in groupings.items()],
+                              args.report)
+        print(f'Wrote {len(paths)} pages to {paths[0]}')
+        return 0
+
+    intervals = {}
+    if args.rollup is not None or args.join is not None \
+            or (headless and (len(windows) > 1 or args.bootstrap > 0)):
+        # The data is loaded once, for the computations and the bootstrap intervals
+        data = open_series(args.file, args.rollup, args.join)
+        results = run_events(data, windows, args.model)
+        if headless and args.bootstrap > 0:
+            intervals = {window: bootstrap_intervals(data, window, args.bootstrap,
+                                                     seed=args.seed)
+                         for window in windows}
+    else:
+        results = {window: run_program(args.file, show_graphs=not headless, window=window,
+                                       instrumentation=instrumentation, model=args.model,
+                                       bootstrap=args.bootstrap, seed=args.seed)
+                   for window in windows}
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            if args.event is None:
+                json.dump(results_to_json(results[COVID_WINDOW], intervals.get(COVID_WINDOW)),
+                          f, indent=2)
+            else:
+                json.dump({window.label: results_to_json(data_points, intervals.get(window))
+                           for window, data_points in results.items()}, f, indent=2)
+    elif headless:
+        print('\n'.join(format_deviations(data_points, intervals.get(window))
+                        for window, data_points in results.items()))
+
+    return 0
+
+
+if __name__ == '__main__':
     # import python_ta
     # python_ta.check_all(config={
-    #     'extra-imports': ['python_ta.contracts', 'data', 'computation', 'display'],
+    #     'extra-imports': ['python_ta.contracts', 'cache', 'data', 'computation', 'display',
+    #                       'argparse', 'json', 'logging', 'os', 're', 'subprocess', 'sys',
+    #                       'instrumentation', 'metrics'],
+    #     'allowed-io': ['check_import_budget', 'main', 'run_command'],
     #     'max-line-length': 100,
     #     'disable': ['R1705', 'C0200']
     # })
+
+    sys.exit(main())
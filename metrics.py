@@ -0,0 +1,186 @@
+"""
+Metrics Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Measures how far every series fell below its pre-shock baseline and how long it took to
+# recover, over the whole period after the start of an event window (through August 2021 in
+# samp1.csv), not just the months of the window. The baseline is projected over that period
+# and every metric is computed for all series at once, with one array operation per metric.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from data import DateIndex, ordinal_to_month
+from computation import BASELINE_MODELS, COVID_WINDOW, EventWindow, check_present, \
+    event_start_index, fit_baselines
+
+# The value of recovery_index for the series that did not recover by the end of the data
+NOT_RECOVERED = -1
+
+
+@dataclass
+class RecoveryMetrics:
+    """Dataclass containing the GDP values of several series over the period from the start of
+    an event window to the end of the data, the baseline projected over that period from the
+    values before the window, and the metrics of the gap between them.
+    A gap is the expected minus the actual value, so it is positive while a series is below
+    its baseline.
+    Instance Attributes:
+      - series: the name of each series (the rows of the arrays)
+      - months: the month ordinal of each month of the period (the columns of the arrays)
+      - window: the event window the period starts with
+      - actual: GDP values, with shape (series, months)
+      - expected: projected baseline values, with shape (series, months)
+      - gap: expected minus actual value, with shape (series, months)
+      - percentage_gap: the gap as a percentage of the expected value, with shape
+        (series, months)
+      - cumulative_loss: the sum of the gaps (leaving out missing months) from the start of the
+        period to each month, with shape (series, months)
+      - trough_index: the column of the largest percentage gap of each series
+      - trough_depth: the largest percentage gap of each series
+      - recovery_index: the column of the first month at or after the trough of each series in
+        which its actual value is at least its expected value, or NOT_RECOVERED
+    Representation Invariants:
+      - self.actual.shape == self.expected.shape == (len(self.series), len(self.months))
+      - self.gap.shape == self.percentage_gap.shape == self.cumulative_loss.shape
+      - self.trough_index.shape == self.trough_depth.shape == self.recovery_index.shape
+      - len(self.months) >= self.window.length
+    """
+    series: list[str]
+    months: np.ndarray
+    window: EventWindow
+    actual: np.ndarray
+    expected: np.ndarray
+    gap: np.ndarray
+    percentage_gap: np.ndarray
+    cumulative_loss: np.ndarray
+    trough_index: np.ndarray
+    trough_depth: np.ndarray
+    recovery_index: np.ndarray
+
+    def trough_month(self, row: int) -> tuple[int, int]:
+        """Return the year and month of the trough of the series in row."""
+        return ordinal_to_month(int(self.months[self.trough_index[row]]))
+
+    def recovery_month(self, row: int) -> tuple[int, int] | None:
+        """Return the year and month in which the series in row recovered, or None if it did
+        not recover by the end of the data."""
+        index = int(self.recovery_index[row])
+        return None if index == NOT_RECOVERED else ordinal_to_month(int(self.months[index]))
+
+    def months_to_recovery(self, row: int) -> int | None:
+        """Return the number of months from the start of the window until the series in row
+        recovered, or None if it did not recover by the end of the data."""
+        index = int(self.recovery_index[row])
+        return None if index == NOT_RECOVERED else index
+
+
+def compute_metrics(data: dict[str, list[tuple[tuple[int, int], int]]],
+                    window: EventWindow = COVID_WINDOW, model: str = 'linear',
+                    index: DateIndex | None = None) -> RecoveryMetrics:
+    """Return the recovery metrics of every series in data (in the format of
+    open_convert_and_aggregate) after the start of window, with the baseline called model
+    (see computation.BASELINE_MODELS) fitted to the values before window and projected to the
+    end of the data. index is the DateIndex of the dates in data; it is built if not given.
+
+    Unlike run_computations, the expected values are not rounded. Raise ValidationError if a
+    value before the end of window is missing (see computation.check_present); missing values
+    after it are left out of the metrics.
+
+    Preconditions:
+        - len(data) != 0
+        - the whole window is in data
+
+    >>> from data import open_convert_and_aggregate
+    >>> metrics = compute_metrics(open_convert_and_aggregate('samp1.csv', cache_dir=None))
+    >>> metrics.series[0], metrics.trough_month(0), round(float(metrics.trough_depth[0]), 1)
+    ('Primary Sector', (2020, 8), 12.7)
+    >>> len(metrics.months), metrics.recovery_month(3), round(float(metrics.cumulative_loss[3, -1]))
+    (18, None, 46678)
+    """
+    series = list(data)
+    values = np.array([[value for _, value in data[name]] for name in series])
+    if index is None:
+        index = DateIndex.from_dates([date for date, _ in data[series[0]]])
+    start = event_start_index(window, index, BASELINE_MODELS[model].min_months)
+    check_present(series, index.months, values[:, :start + window.length])
+
+    expected = fit_baselines(values[:, :start], index.months[:start], len(index) - start, model)
+    return metrics_of(series, index.months[start:], window, values[:, start:], expected)
+
+
+def metrics_of(series: list[str], months: np.ndarray, window: EventWindow, actual: np.ndarray,
+               expected: np.ndarray) -> RecoveryMetrics:
+    """Return the recovery metrics of the series whose actual and expected values (one row per
+    series, one column per month in months) are given.
+
+    Preconditions:
+        - actual.shape == expected.shape == (len(series), len(months))
+        - len(months) != 0
+
+    >>> metrics = metrics_of(['A'], np.arange(4), EventWindow((2020, 1), 1), \
+np.array([[9, 6, 9, 11]]), np.array([[10.0, 10.0, 10.0, 10.0]]))
+    >>> metrics.percentage_gap.tolist(), metrics.cumulative_loss.tolist()
+    ([[10.0, 40.0, 10.0, -10.0]], [[1.0, 5.0, 6.0, 5.0]])
+    >>> metrics.trough_index.tolist(), metrics.recovery_index.tolist()
+    ([1], [3])
+    """
+    actual = np.asarray(actual, dtype=np.float64)
+    gap = expected - actual
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage_gap = 100 * gap / expected
+    # Missing (NaN) months are never the trough
+    trough_index = np.argmax(np.where(np.isnan(percentage_gap), -np.inf, percentage_gap), axis=1)
+
+    # A series recovers in the first month at or after its trough with no gap left
+    columns = np.arange(len(months))
+    recovered = (gap <= 0) & (columns >= trough_index[:, np.newaxis])
+    recovery_index = np.where(recovered.any(axis=1), np.argmax(recovered, axis=1),
+                              NOT_RECOVERED)
+
+    return RecoveryMetrics(series=series, months=np.asarray(months), window=window,
+                           actual=actual, expected=expected, gap=gap,
+                           percentage_gap=percentage_gap,
+                           cumulative_loss=np.nancumsum(gap, axis=1),
+                           trough_index=trough_index,
+                           trough_depth=percentage_gap[np.arange(len(series)), trough_index],
+                           recovery_index=recovery_index)
+
+
+def format_metrics(metrics: RecoveryMetrics) -> str:
+    """Return a plain text table of the trough, the recovery and the output lost by the end of
+    the data of each series in metrics, one line per series.
+
+    >>> metrics = metrics_of(['A'], np.arange(24240, 24244), EventWindow((2020, 1), 1), \
+np.array([[9, 6, 9, 11]]), np.array([[10.0, 10.0, 10.0, 10.0]]))
+    >>> print(format_metrics(metrics))
+    A                    trough 2020-02  -40.0%  recovered 2020-04 (3 months)  lost          5
+    """
+    # ACCUMULATOR lines: the lines of the table so far
+    lines = []
+    for row, name in enumerate(metrics.series):
+        trough = metrics.trough_month(row)
+        recovery = metrics.recovery_month(row)
+        recovered = 'not recovered' + ' ' * 17 if recovery is None else \
+            f'recovered {recovery[0]}-{recovery[1]:02} ({metrics.months_to_recovery(row)} months)'
+        lines.append(f'{name:<20} trough {trough[0]}-{trough[1]:02} '
+                     f'{-metrics.trough_depth[row]:>+6.1f}%  {recovered:<30}'
+                     f'lost {round(float(metrics.cumulative_loss[row, -1])):>10}')
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['dataclasses', 'numpy', 'data', 'computation'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
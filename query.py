@@ -0,0 +1,169 @@
+"""
+Query Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Answers questions such as "the GDP of manufacturing from 2016 to 2019" without scanning
+# lists of (date, value) tuples. The rows of a Panel are indexed by name, NAICS code and
+# sector, date ranges are found by binary search on its sorted month ordinals, and prefix sums
+# along the months give the sum or mean of any range of any series in constant time.
+
+from __future__ import annotations
+
+import bisect
+
+import numpy as np
+
+from data import CACHE_DIR, Panel, cached_panel, classify_industry, expand_code, load_panel, \
+    month_ordinal, parse_naics_code
+
+
+class PanelQuery:
+    """Index of the series of a panel, answering range queries over them.
+
+    Selections (select) return row numbers, and ranges are inclusive (year, month) bounds,
+    where None stands for the first or last month of the panel.
+
+    >>> query = PanelQuery(load_panel('samp1.csv'))
+    >>> rows = query.select(code='31-33')
+    >>> [query.panel.industries[row] for row in rows]
+    ['Manufacturing  [31-33]']
+    >>> query.sum(rows, (2016, 1), (2016, 3)).tolist()
+    [569282]
+    >>> round(float(query.growth(rows, (2016, 1), (2019, 12))[0]), 4)
+    0.0206
+    """
+    panel: Panel
+    _prefix_sums: np.ndarray
+    _prefix_counts: np.ndarray
+    _codes: list[tuple[str, int]]
+    _sectors: dict[str, list[int]]
+
+    def __init__(self, panel: Panel) -> None:
+        self.panel = panel
+        values = np.asarray(panel.values, dtype=np.float64)
+        present = ~np.isnan(values)
+        zeros = np.zeros((len(values), 1))
+        self._prefix_sums = np.hstack([zeros, np.cumsum(np.where(present, values, 0), axis=1)])
+        self._prefix_counts = np.hstack([zeros, np.cumsum(present, axis=1)])
+
+        # (code, row) pairs sorted by code, with ranges of codes expanded; e.g. '31-33' is
+        # stored as '31', '32' and '33'
+        self._codes = sorted((number, row) for row, industry in enumerate(panel.industries)
+                             if (code := parse_naics_code(industry)) is not None
+                             for number in expand_code(code))
+
+        self._sectors = {}
+        for row, industry in enumerate(panel.industries):
+            sector = classify_industry(industry)
+            if sector is not None:
+                self._sectors.setdefault(sector, []).append(row)
+
+    @staticmethod
+    def from_file(filename: str, cache_dir: str | None = CACHE_DIR) -> PanelQuery:
+        """Return the query index of the industries of the dataset in filename, loaded from
+        cache_dir if it was parsed before (see data.cached_panel).
+
+        Preconditions:
+            - filename != ''
+        """
+        return PanelQuery(cached_panel(filename, 'industries', lambda: load_panel(filename),
+                                       cache_dir))
+
+    def select(self, industry: str | None = None, code: str | None = None,
+               sector: str | None = None) -> list[int]:
+        """Return the rows of the industry called industry, of the industries with the NAICS
+        code code or a more detailed code under it (e.g. '336' for code '33'), or of the
+        industries in sector, in the order of the panel. A code is found by binary search.
+
+        Preconditions:
+            - exactly one of industry, code and sector is not None
+
+        >>> query = PanelQuery(load_panel('samp1.csv'))
+        >>> len(query.select(sector='Primary')), query.select(code='32')
+        (2, [20])
+        """
+        if industry is not None:
+            row = self.panel.industry_index.get(industry)
+            return [] if row is None else [row]
+        if sector is not None:
+            return list(self._sectors.get(sector, []))
+
+        # ACCUMULATOR rows: the rows whose codes start with one of the codes covered by code
+        rows = set()
+        for number in expand_code(code):
+            start = bisect.bisect_left(self._codes, (number, -1))
+            stop = bisect.bisect_left(self._codes, (number + '\x7f', -1))
+            rows.update(row for _, row in self._codes[start:stop])
+        return sorted(rows)
+
+    def columns(self, start: tuple[int, int] | None = None,
+                end: tuple[int, int] | None = None) -> slice:
+        """Return the slice of the columns of the panel from start to end (both included),
+        found by binary search on its months.
+
+        >>> query = PanelQuery(load_panel('samp1.csv'))
+        >>> query.columns((2016, 1), (2019, 12))
+        slice(24, 72, None)
+        """
+        months = self.panel.months
+        first = 0 if start is None else int(np.searchsorted(months, month_ordinal(start)))
+        last = len(months) if end is None else \
+            int(np.searchsorted(months, month_ordinal(end), side='right'))
+        return slice(first, max(first, last))
+
+    def values(self, rows: list[int], start: tuple[int, int] | None = None,
+               end: tuple[int, int] | None = None) -> np.ndarray:
+        """Return the values of rows from start to end, one row per row in rows."""
+        return self.panel.values[rows, self.columns(start, end)]
+
+    def sum(self, rows: list[int], start: tuple[int, int] | None = None,
+            end: tuple[int, int] | None = None) -> np.ndarray:
+        """Return the sum of the values of each row in rows from start to end, leaving out
+        missing values."""
+        span = self.columns(start, end)
+        sums = self._prefix_sums[rows, span.stop] - self._prefix_sums[rows, span.start]
+        return sums.astype(self.panel.values.dtype) if self.panel.values.dtype.kind == 'i' \
+            else sums
+
+    def mean(self, rows: list[int], start: tuple[int, int] | None = None,
+             end: tuple[int, int] | None = None) -> np.ndarray:
+        """Return the mean of the values of each row in rows from start to end, leaving out
+        missing values (NaN if there are none)."""
+        span = self.columns(start, end)
+        sums = self._prefix_sums[rows, span.stop] - self._prefix_sums[rows, span.start]
+        counts = self._prefix_counts[rows, span.stop] - self._prefix_counts[rows, span.start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sums / counts
+
+    def growth(self, rows: list[int], start: tuple[int, int] | None = None,
+               end: tuple[int, int] | None = None) -> np.ndarray:
+        """Return the growth rate of each row in rows from its value at start to its value at
+        end (e.g. 0.05 for 5%), or NaN if either value is missing or the range is empty."""
+        span = self.columns(start, end)
+        if span.stop - span.start == 0:
+            return np.full(len(rows), np.nan)
+
+        first = self.panel.values[rows, span.start].astype(np.float64)
+        last = self.panel.values[rows, span.stop - 1].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return last / first - 1
+
+    def total(self, rows: list[int], start: tuple[int, int] | None = None,
+              end: tuple[int, int] | None = None) -> float:
+        """Return the sum of the values of all of rows from start to end."""
+        return float(self.sum(rows, start, end).sum())
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['bisect', 'numpy', 'data'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
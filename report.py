@@ -0,0 +1,211 @@
+"""
+Report Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Writes the graphs of one or many runs of the program to a directory of static HTML pages,
+# without opening a browser, so that reports can be generated on servers without a display.
+# plotly.js (several megabytes) is written once, next to the pages, and every page refers to
+# it, so each page only holds the JSON of its figure. The figures of the runs are built and
+# serialized in a pool of worker processes.
+#
+# Layout of a report directory:
+#   plotly-<version>.min.js
+#   index.html                    links to every page
+#   <run>/<figure>.html           one page per figure of each run (see FIGURES)
+
+from __future__ import annotations
+
+import html
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable
+
+from computation import COVID_WINDOW, EventWindow, bootstrap_intervals, run_computations
+from metrics import compute_metrics
+
+# The figures of each run, in the order they are listed
+FIGURES = ['sectors', 'changes', 'percentage']
+
+# The fewest runs that are rendered in worker processes rather than in this process
+PARALLEL_MIN_RUNS = 4
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{script}"></script>
+</head>
+<body>
+<div id="figure" style="height: 95vh"></div>
+<script>
+var figure = {figure};
+Plotly.newPlot('figure', figure.data, figure.layout, {{responsive: true}});
+</script>
+</body>
+</html>
+"""
+
+
+@dataclass
+class ReportRun:
+    """Dataclass describing one run of the program whose graphs are written to a report.
+    Instance Attributes:
+      - name: the name of the run, also used (made safe) as the name of its directory
+      - data: the GDP values of each series (in the format of open_convert_and_aggregate)
+      - window: the event window of the run
+      - model: the name of the baseline model of the run (see computation.BASELINE_MODELS)
+      - bootstrap: the number of bootstrap replicates of the confidence intervals, or 0 for
+        no intervals
+      - seed: the random seed of the bootstrap replicates
+    Representation Invariants:
+      - self.name != ''
+      - len(self.data) != 0
+      - self.bootstrap >= 0
+      - self.bootstrap == 0 or self.model == 'linear'  # the intervals are of the linear trend
+
+    >>> ReportRun('Oil', {'Goods': []}, model='seasonal', bootstrap=100)
+    Traceback (most recent call last):
+    ...
+    ValueError: the bootstrap intervals of Oil are of the linear trend, not the seasonal model
+    """
+    name: str
+    data: dict[str, list[tuple[tuple[int, int], int]]]
+    window: EventWindow = COVID_WINDOW
+    model: str = 'linear'
+    bootstrap: int = 0
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        if self.bootstrap > 0 and self.model != 'linear':
+            raise ValueError(f'the bootstrap intervals of {self.name} are of the linear trend, '
+                             f'not the {self.model} model')
+
+
+def render_run(run: ReportRun) -> dict[str, str]:
+    """Return the JSON of every figure in FIGURES for run, by name. Runs in a worker process
+    of export_report."""
+    from display import FIGURE_BUILDERS, METRICS_FIGURE_BUILDERS, Sector
+
+    data_points = run_computations(run.data, run.window, model=run.model)
+    intervals = {}
+    if run.bootstrap > 0:
+        intervals = bootstrap_intervals(run.data, run.window, run.bootstrap, seed=run.seed)
+
+    sectors = []
+    for name, (actual, expected, _) in data_points.items():
+        expected_band, deviation_band = intervals.get(name, ([], []))
+        sectors.append(Sector(name=name, actual=actual, expected=expected,
+                              window_length=run.window.length, expected_band=expected_band,
+                              deviation_band=deviation_band))
+    metrics = compute_metrics(run.data, run.window, run.model)
+
+    return {kind: (FIGURE_BUILDERS[kind](sectors) if kind in FIGURE_BUILDERS
+                   else METRICS_FIGURE_BUILDERS[kind](metrics)).to_json()
+            for kind in FIGURES}
+
+
+def export_report(runs: list[ReportRun], output_dir: str,
+                  max_workers: int | None = None) -> list[str]:
+    """Write the graphs of every run in runs to output_dir (see the layout at the top of this
+    module) and return the paths of the pages written, index.html first.
+
+    The runs are rendered in a pool of max_workers processes (one per CPU by default) if there
+    are at least PARALLEL_MIN_RUNS of them and more than one process. plotly.js is only written
+    if output_dir does not already have this version of it.
+
+    Preconditions:
+        - len(runs) != 0
+        - len({safe_name(run.name) for run in runs}) == len(runs)
+
+    >>> import tempfile
+    >>> from data import open_convert_and_aggregate
+    >>> data = open_convert_and_aggregate('samp1.csv', cache_dir=None)
+    >>> paths = export_report([ReportRun('COVID-19', data)], tempfile.mkdtemp(), max_workers=1)
+    >>> [os.path.basename(path) for path in paths]
+    ['index.html', 'sectors.html', 'changes.html', 'percentage.html']
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    script = write_plotly_js(output_dir)
+
+    if len(runs) < PARALLEL_MIN_RUNS or (max_workers or os.cpu_count() or 1) == 1:
+        figures = map(render_run, runs)
+        return write_pages(runs, figures, output_dir, script)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        figures = executor.map(render_run, runs, chunksize=4)
+        return write_pages(runs, figures, output_dir, script)
+
+
+def write_plotly_js(output_dir: str) -> str:
+    """Write the plotly.js bundle of the installed version of Plotly to output_dir, unless it
+    is already there, and return its file name."""
+    import plotly
+    from plotly.offline import get_plotlyjs
+
+    script = f'plotly-{plotly.__version__}.min.js'
+    path = os.path.join(output_dir, script)
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(get_plotlyjs())
+    return script
+
+
+def write_pages(runs: list[ReportRun], figures: Iterable[dict[str, str]], output_dir: str,
+                script: str) -> list[str]:
+    """Write the page of every figure in figures (the output of render_run for each run in
+    runs, in the same order) to output_dir, followed by index.html, and return the paths of the
+    pages written, index.html first."""
+    # ACCUMULATORS: the pages written so far, and the links of index.html to them
+    paths = []
+    links = []
+    for run, run_figures in zip(runs, figures):
+        directory = safe_name(run.name)
+        os.makedirs(os.path.join(output_dir, directory), exist_ok=True)
+        links.append(f'<h2>{html.escape(run.name)}</h2>')
+        for kind, figure in run_figures.items():
+            path = os.path.join(output_dir, directory, f'{kind}.html')
+            # '</' is escaped so that no text in the figure can end the script element
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(PAGE_TEMPLATE.format(title=html.escape(f'{run.name}: {kind}'),
+                                             script=f'../{script}',
+                                             figure=figure.replace('</', '<\\/')))
+            paths.append(path)
+            links.append(f'<p><a href="{directory}/{kind}.html">{kind}</a></p>')
+
+    index = os.path.join(output_dir, 'index.html')
+    with open(index, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                '<title>GDP report</title>\n</head>\n<body>\n'
+                + '\n'.join(links) + '\n</body>\n</html>\n')
+    return [index] + paths
+
+
+def safe_name(name: str) -> str:
+    """Return name with every run of characters other than letters, digits, '.', '_' and '-'
+    replaced by '_', to be used as the name of a directory.
+
+    >>> safe_name('goods: Goods 2020-03:3')
+    'goods_Goods_2020-03_3'
+    """
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['html', 'os', 're', 'concurrent.futures', 'dataclasses', 'typing',
+    #                       'computation', 'metrics', 'display', 'plotly', 'plotly.offline',
+    #                       'data'],
+    #     'allowed-io': ['write_plotly_js', 'write_pages'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
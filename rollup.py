@@ -0,0 +1,328 @@
+"""
+Rollup Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Adds up the industries of a Panel into the groups of any number of groupings: the four
+# economic sectors, the NAICS 2-digit or 3-digit level, or a map from NAICS codes to groups
+# read from a JSON or YAML file. Every grouping is compiled into the rows of one sparse
+# indicator matrix (one row per group, one column per industry), so the monthly totals of every
+# group of every grouping are computed with a single matrix multiply.
+#
+# A grouping is a dictionary mapping NAICS codes (ranges such as '31-33' included) to group
+# names, e.g. {'11': 'Goods', '21': 'Goods', '41': 'Trade'}. Like data.classify_industry, an
+# industry belongs to the group of the most specific code that prefixes its own code.
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Iterable
+
+import numpy as np
+
+from data import CACHE_DIR, SECTOR_CODES, Panel, ValidatedData, cached_panel, expand_code, \
+    load_panel, mark_validated, parse_naics_code, validate_panel
+
+# The number of digits of the codes of each built-in NAICS level
+NAICS_LEVELS = {'naics2': 2, 'naics3': 3}
+
+BUILTIN_GROUPINGS = ['sectors'] + list(NAICS_LEVELS)
+
+
+@dataclass
+class Membership:
+    """Dataclass holding a sparse indicator matrix of industries in groups, in coordinate
+    form: entry (rows[i], columns[i]) is 1 and every other entry is 0.
+    Instance Attributes:
+      - groups: the name of the group in each row of the matrix
+      - rows: the row (group) of each nonzero entry
+      - columns: the column (industry) of each nonzero entry
+      - num_industries: the number of columns of the matrix
+      - levels: maps the name of each grouping to the slice of rows of its groups
+    Representation Invariants:
+      - len(self.rows) == len(self.columns)
+      - all(0 <= row < len(self.groups) for row in self.rows)
+      - all(0 <= column < self.num_industries for column in self.columns)
+    """
+    groups: list[str]
+    rows: np.ndarray
+    columns: np.ndarray
+    num_industries: int
+    levels: dict[str, slice]
+
+    def apply(self, values: np.ndarray) -> np.ndarray:
+        """Return the product of the matrix with values, which has one row per industry: the
+        sum of the rows of the industries of each group.
+
+        scipy.sparse is used if it is installed; otherwise the entries are added up directly.
+
+        Preconditions:
+            - len(values) == self.num_industries
+
+        >>> membership = Membership(['A', 'B'], np.array([0, 0, 1]), np.array([0, 2, 1]), 3, {})
+        >>> membership.apply(np.array([[1, 2], [3, 4], [5, 6]])).tolist()
+        [[6, 8], [3, 4]]
+        """
+        try:
+            from scipy import sparse
+        except ImportError:
+            totals = np.zeros((len(self.groups),) + values.shape[1:], dtype=values.dtype)
+            np.add.at(totals, self.rows, values[self.columns])
+            return totals
+
+        matrix = sparse.csr_matrix((np.ones(len(self.rows), dtype=values.dtype),
+                                    (self.rows, self.columns)),
+                                   shape=(len(self.groups), self.num_industries))
+        return np.asarray(matrix @ values)
+
+
+##########################################
+# Groupings
+##########################################
+
+
+def sector_grouping() -> dict[str, str]:
+    """Return the grouping of the four economic sectors (see data.SECTOR_CODES), whose groups
+    are named like the rows of open_convert_and_aggregate.
+
+    >>> sector_grouping()['31-33']
+    'Secondary Sector'
+    """
+    return {code: f'{sector} Sector' for sector, codes in SECTOR_CODES.items() for code in codes}
+
+
+def naics_level_grouping(industries: list[str], digits: int) -> dict[str, str]:
+    """Return the grouping of industries at the NAICS level with codes of the given number of
+    digits: one group per code of that level among industries (ranges such as '31-33' at
+    level 2 included), plus one group per code of that level that is only found as the prefix
+    of more detailed codes (e.g. '336' at level 3 for the industry '[3361]').
+
+    Preconditions:
+        - digits >= 1
+
+    >>> naics_level_grouping(['Manufacturing  [31-33]', 'Motor vehicles  [3361]', \
+'Crop production  [111]'], 2)
+    {'31-33': 'NAICS 31-33', '11': 'NAICS 11'}
+    """
+    codes = [code for code in map(parse_naics_code, industries) if code is not None]
+    grouping = {code: f'NAICS {code}' for code in codes
+                if len(code.partition('-')[0]) == digits}
+    covered = {number for code in grouping for number in expand_code(code)}
+
+    for code in codes:
+        prefix = code.partition('-')[0][:digits]
+        if len(code.partition('-')[0]) > digits and prefix not in covered:
+            grouping[prefix] = f'NAICS {prefix}'
+            covered.add(prefix)
+
+    return grouping
+
+
+def read_grouping(filename: str) -> dict[str, str]:
+    """Return the grouping in the JSON or YAML file filename (chosen by its extension), a
+    mapping from NAICS codes to group names. Codes written as numbers are read as text.
+
+    Raise ValueError if the file does not hold such a mapping.
+
+    Preconditions:
+        - filename.endswith(('.json', '.yaml', '.yml'))
+    """
+    with open(filename) as f:
+        if filename.endswith('.json'):
+            mapping = json.load(f)
+        else:
+            import yaml
+            mapping = yaml.safe_load(f)
+
+    if not isinstance(mapping, dict) or not all(isinstance(group, str)
+                                                for group in mapping.values()):
+        raise ValueError(f'{filename} does not map NAICS codes to group names')
+    return {str(code): group for code, group in mapping.items()}
+
+
+def load_grouping(spec: str, industries: list[str]) -> dict[str, str]:
+    """Return the grouping described by spec: one of BUILTIN_GROUPINGS, or the name of a JSON
+    or YAML file (see read_grouping). industries are the industries that are grouped.
+
+    Raise ValueError if spec is neither.
+
+    Preconditions:
+        - spec != ''
+    """
+    if spec == 'sectors':
+        return sector_grouping()
+    if spec in NAICS_LEVELS:
+        return naics_level_grouping(industries, NAICS_LEVELS[spec])
+    if spec.endswith(('.json', '.yaml', '.yml')):
+        return read_grouping(spec)
+    raise ValueError(f'{spec!r} is neither one of {BUILTIN_GROUPINGS} nor a JSON or YAML file')
+
+
+def grouping_name(spec: str) -> str:
+    """Return the name of the grouping described by spec (see load_grouping): the name of a
+    built-in grouping, or the name of the file without its directory and extension.
+
+    >>> grouping_name('maps/goods.yaml'), grouping_name('naics2')
+    ('goods', 'naics2')
+    """
+    return os.path.splitext(os.path.basename(spec))[0]
+
+
+##########################################
+# Compiling groupings into a membership matrix
+##########################################
+
+
+def group_members(industries: list[str], grouping: dict[str, str]) -> dict[str, list[int]]:
+    """Return a dictionary mapping each group of grouping to the indexes of its industries, in
+    order of first appearance. Industries whose code falls under the code of another industry
+    in the same group (e.g. '[3361]' under '[31-33]') are left out, so that no value is
+    counted twice. Groups without industries are left out.
+
+    >>> group_members(['Total  [T001]', 'Manufacturing  [31-33]', 'Motor vehicles  [3361]', \
+'Construction  [23]'], {'23': 'Goods', '31-33': 'Goods'})
+    {'Goods': [1, 3]}
+    """
+    index = {number: group for code, group in grouping.items() for number in expand_code(code)}
+
+    # ACCUMULATOR members: the (index, code) of the industries of each group so far
+    members = {}
+    for i, industry in enumerate(industries):
+        code = parse_naics_code(industry)
+        if code is None:
+            continue
+        first = code.partition('-')[0]
+        for length in range(len(first), 0, -1):
+            if first[:length] in index:
+                members.setdefault(index[first[:length]], []).append((i, code))
+                break
+
+    # ACCUMULATOR groups: the indexes of the industries of each group so far
+    groups = {}
+    for group, pairs in members.items():
+        owners = owners_of(pairs)
+        groups[group] = [i for i, code in pairs if not is_covered(code, owners)]
+    return groups
+
+
+def owners_of(pairs: list[tuple[int, str]]) -> dict[str, set[str]]:
+    """Return a dictionary mapping every NAICS code covered by the codes of pairs (ranges
+    expanded, see expand_code) to the codes of pairs covering it.
+
+    >>> owners_of([(0, '31-33'), (1, '3361')])
+    {'31': {'31-33'}, '32': {'31-33'}, '33': {'31-33'}, '3361': {'3361'}}
+    """
+    # ACCUMULATOR owners: the codes covering each number so far
+    owners = {}
+    for _, code in pairs:
+        for number in expand_code(code):
+            owners.setdefault(number, set()).add(code)
+    return owners
+
+
+def is_covered(code: str, owners: dict[str, set[str]]) -> bool:
+    """Return whether the NAICS code is a more detailed code under another code in owners (the
+    output of owners_of), i.e. whether covers(other, code) for any other code, by looking up
+    the prefixes of code rather than comparing it with every other code.
+
+    >>> owners = owners_of([(0, '31-33'), (1, '3361'), (2, '41')])
+    >>> is_covered('3361', owners), is_covered('31-33', owners), is_covered('41', owners)
+    (True, False, False)
+    """
+    first = code.partition('-')[0]
+    return any(owners.get(first[:length], set()) - {code} for length in range(1, len(first) + 1))
+
+
+def covers(code: str, other: str) -> bool:
+    """Return whether the NAICS code other is a more detailed code under code.
+
+    >>> covers('31-33', '3361'), covers('31-33', '32'), covers('33', '33'), covers('3', '41')
+    (True, True, False, False)
+    """
+    first = other.partition('-')[0]
+    return code != other and any(first.startswith(number) for number in expand_code(code))
+
+
+def compile_membership(industries: list[str], groupings: dict[str, dict[str, str]]) \
+        -> Membership:
+    """Return the sparse indicator matrix of industries in the groups of every grouping in
+    groupings (a dictionary mapping the name of each grouping to the grouping). The rows of
+    each grouping are next to each other, in the order of groupings, and are named
+    '<grouping>: <group>'.
+
+    >>> membership = compile_membership(['Utilities  [22]', 'Construction  [23]'], \
+{'sectors': sector_grouping(), 'naics2': {'22': 'NAICS 22', '23': 'NAICS 23'}})
+    >>> membership.groups
+    ['sectors: Secondary Sector', 'naics2: NAICS 22', 'naics2: NAICS 23']
+    >>> membership.rows.tolist(), membership.columns.tolist(), membership.levels['naics2']
+    ([0, 0, 1, 2], [0, 1, 0, 1], slice(1, 3, None))
+    """
+    # ACCUMULATORS: the names of the rows, the nonzero entries and the rows of each grouping
+    groups = []
+    rows = []
+    columns = []
+    levels = {}
+    for name, grouping in groupings.items():
+        start = len(groups)
+        for group, members in group_members(industries, grouping).items():
+            rows.extend([len(groups)] * len(members))
+            columns.extend(members)
+            groups.append(f'{name}: {group}')
+        levels[name] = slice(start, len(groups))
+
+    return Membership(groups=groups, rows=np.array(rows, dtype=np.int64),
+                      columns=np.array(columns, dtype=np.int64),
+                      num_industries=len(industries), levels=levels)
+
+
+def rollup_panel(panel: Panel, groupings: dict[str, dict[str, str]]) -> Panel:
+    """Return a panel with one row per group of every grouping in groupings (see
+    compile_membership), holding the sum of the GDP values of the group's industries in
+    every month. The groups of the returned panel are the groupings.
+
+    >>> panel = rollup_panel(load_panel('samp1.csv'), {'sectors': sector_grouping()})
+    >>> panel.industries[0], int(panel.row('sectors: Quaternary Sector')[0])
+    ('sectors: Primary Sector', 55255)
+    """
+    membership = compile_membership(panel.industries, groupings)
+    return Panel(industries=membership.groups, months=panel.months,
+                 values=membership.apply(panel.values), groups=membership.levels)
+
+
+def open_convert_and_rollup(filename: str, specs: Iterable[str],
+                            cache_dir: str | None = CACHE_DIR) -> ValidatedData:
+    """Return a dictionary mapping each group of every grouping described in specs (see
+    load_grouping) to year-month tuples and the GDP values of its industries in filename, in
+    the format of open_convert_and_aggregate. The file is parsed once (or loaded from
+    cache_dir, see data.cached_panel) for all of the groupings.
+
+    Raise ValidationError if no industry is in any group.
+
+    Preconditions:
+        - filename != ''
+
+    >>> data = open_convert_and_rollup('samp1.csv', ['sectors', 'naics2'], cache_dir=None)
+    >>> len(data), data['naics2: NAICS 31-33'][0]
+    (24, ((2014, 1), 182671))
+    """
+    panel = cached_panel(filename, 'industries', lambda: load_panel(filename), cache_dir)
+    groupings = {grouping_name(spec): load_grouping(spec, panel.industries) for spec in specs}
+    return mark_validated(validate_panel(rollup_panel(panel, groupings)).to_dict())
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['json', 'os', 'dataclasses', 'typing', 'numpy', 'data', 'scipy',
+    #                       'yaml'],
+    #     'allowed-io': ['read_grouping'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
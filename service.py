@@ -0,0 +1,415 @@
+"""
+Service Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# A local HTTP service answering queries about datasets that are loaded once, when it starts.
+# It only uses the standard library (asyncio) and only listens on localhost. Parsing, fitting
+# and building figures run in a pool of worker processes, so the event loop never blocks;
+# their results are kept in a bounded LRU cache, and identical queries arriving while a result
+# is being computed wait for that computation instead of starting another one.
+#
+# Usage: python service.py samp1.csv [samp2.csv ...] [--port 8110]
+#
+# Endpoints (every response is JSON):
+#   GET /datasets
+#   GET /computations?dataset=samp1[&event=2020-03:3][&model=linear]
+#   GET /series?dataset=samp1[&industry=Utilities  [22]]
+#   GET /figure?dataset=samp1&kind=sectors|changes|percentage[&event=...][&model=...]
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs, urlsplit
+
+import cache
+from computation import BASELINE_MODELS, COVID_WINDOW, EventWindow, run_computations
+from data import open_and_convert, open_convert_and_aggregate
+from main import SECTOR_NAMES, parse_event, results_to_json
+from metrics import compute_metrics
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8110
+
+# The most results kept in the cache
+CACHE_SIZE = 256
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+@dataclass
+class Dataset:
+    """Dataclass containing a dataset loaded by the service.
+    Instance Attributes:
+      - filename: the file the dataset was loaded from
+      - digest: the SHA-256 hex digest of the contents of the file
+      - sectors: the GDP values of each economic sector (see open_convert_and_aggregate)
+      - industries: the GDP values of each industry (see open_and_convert)
+    Representation Invariants:
+      - self.filename != ''
+    """
+    filename: str
+    digest: str
+    sectors: dict[str, list[tuple[tuple[int, int], int]]]
+    industries: dict[str, list[tuple[tuple[int, int], int]]]
+
+
+class ResultCache:
+    """A bounded cache of results, evicting the least recently used result first.
+
+    get computes a missing result only once: the calls asking for it while it is being
+    computed wait for the same computation. They get its error if it fails, and compute the
+    result themselves if the call computing it is cancelled.
+
+    >>> results = ResultCache(max_entries=1)
+    >>> calls = []
+    >>> async def compute() -> bytes:
+    ...     calls.append(1)
+    ...     await asyncio.sleep(0)
+    ...     return b'42'
+    >>> async def ask_three_times() -> list[bytes]:
+    ...     return await asyncio.gather(*[results.get(('key',), compute) for _ in range(3)])
+    >>> asyncio.run(ask_three_times()), len(calls)
+    ([b'42', b'42', b'42'], 1)
+    >>> async def cancel_while_waited_for() -> bytes:
+    ...     started = asyncio.Event()
+    ...     async def slow() -> bytes:
+    ...         started.set()
+    ...         await asyncio.sleep(10)
+    ...         return b'slow'
+    ...     first = asyncio.ensure_future(results.get(('other',), slow))
+    ...     await started.wait()
+    ...     waiting = asyncio.ensure_future(results.get(('other',), compute))
+    ...     await asyncio.sleep(0)
+    ...     first.cancel()
+    ...     return await waiting
+    >>> asyncio.run(cancel_while_waited_for())
+    b'42'
+    """
+    max_entries: int
+    _results: collections.OrderedDict
+    _pending: dict[tuple, asyncio.Future]
+
+    def __init__(self, max_entries: int = CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._results = collections.OrderedDict()
+        self._pending = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    async def get(self, key: tuple, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Return the result stored under key, computing it with compute if it is missing."""
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+        if key in self._pending:
+            pending = self._pending[key]
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this caller was cancelled
+                # The caller computing the result was cancelled: compute it again
+                return await self.get(key, compute)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # the error is raised to every caller, not logged as unhandled
+            raise
+        finally:
+            del self._pending[key]
+
+        future.set_result(result)
+        self._results[key] = result
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return result
+
+
+##########################################
+# Work done in the worker processes
+##########################################
+
+
+def load_dataset(filename: str) -> Dataset:
+    """Return the dataset in filename, with its values per sector and per industry.
+
+    Preconditions:
+        - filename != ''
+    """
+    return Dataset(filename=filename, digest=cache.file_digest(filename),
+                   sectors=open_convert_and_aggregate(filename),
+                   industries=open_and_convert(filename))
+
+
+def computations_json(sectors: dict, window: EventWindow, model: str) -> bytes:
+    """Return the output of run_computations on sectors, as JSON (see results_to_json)."""
+    return json.dumps(results_to_json(run_computations(sectors, window, model=model))).encode()
+
+
+def figure_json(sectors: dict, window: EventWindow, model: str, kind: str) -> bytes:
+    """Return the Plotly figure called kind (see display.FIGURE_BUILDERS and
+    display.METRICS_FIGURE_BUILDERS) of the output of run_computations or compute_metrics on
+    sectors, as JSON.
+
+    Preconditions:
+        - kind in display.FIGURE_BUILDERS or kind in display.METRICS_FIGURE_BUILDERS
+    """
+    from display import FIGURE_BUILDERS, METRICS_FIGURE_BUILDERS, Sector
+
+    if kind in METRICS_FIGURE_BUILDERS:
+        figure = METRICS_FIGURE_BUILDERS[kind](compute_metrics(sectors, window, model))
+    else:
+        data_points = run_computations(sectors, window, model=model)
+        figure = FIGURE_BUILDERS[kind]([Sector(name=name, actual=data_points[name][0],
+                                               expected=data_points[name][1],
+                                               window_length=window.length)
+                                        for name in SECTOR_NAMES])
+    return figure.to_json().encode()
+
+
+##########################################
+# The service
+##########################################
+
+
+class QueryError(Exception):
+    """Raised when a query cannot be answered, with the HTTP status of the response."""
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class QueryService:
+    """Answers the queries of the HTTP clients of the service about its datasets.
+    Instance Attributes:
+      - datasets: the loaded datasets, by name (the file name without its extension)
+      - results: the cache of the responses to queries
+      - executor: the pool of worker processes doing the work
+    """
+    datasets: dict[str, Dataset]
+    results: ResultCache
+    executor: Executor
+
+    def __init__(self, executor: Executor, cache_size: int = CACHE_SIZE) -> None:
+        self.datasets = {}
+        self.results = ResultCache(cache_size)
+        self.executor = executor
+
+    async def load(self, filenames: list[str]) -> None:
+        """Load every file in filenames in the worker processes, all at once."""
+        loop = asyncio.get_running_loop()
+        loaded = await asyncio.gather(*[loop.run_in_executor(self.executor, load_dataset, name)
+                                        for name in filenames])
+        for dataset in loaded:
+            self.datasets[os.path.splitext(os.path.basename(dataset.filename))[0]] = dataset
+
+    async def answer(self, path: str, params: dict[str, str]) -> bytes:
+        """Return the JSON response to the query for path with the parameters params.
+
+        Raise QueryError if the query is not valid.
+        """
+        if path == '/datasets':
+            return json.dumps({name: {'filename': dataset.filename, 'digest': dataset.digest}
+                               for name, dataset in self.datasets.items()}).encode()
+        if path not in {'/computations', '/series', '/figure'}:
+            raise QueryError(404, f'no endpoint {path}')
+
+        dataset = self.dataset(params)
+        key = (dataset.digest, path) + tuple(sorted(params.items()))
+        return await self.results.get(key, lambda: self.compute(path, dataset, params))
+
+    def dataset(self, params: dict[str, str]) -> Dataset:
+        """Return the dataset named by the dataset parameter in params.
+
+        Raise QueryError if there is no such dataset.
+        """
+        name = params.get('dataset', '')
+        if name not in self.datasets:
+            raise QueryError(404, f'no dataset {name!r}')
+        return self.datasets[name]
+
+    async def compute(self, path: str, dataset: Dataset, params: dict[str, str]) -> bytes:
+        """Compute the response to the query for path on dataset, with the parameters params.
+
+        Raise QueryError if the parameters are not valid.
+        """
+        if path == '/series':
+            return self.series(dataset, params.get('industry'))
+
+        window = parse_window(params.get('event'))
+        model = params.get('model', 'linear')
+        if model not in BASELINE_MODELS:
+            raise QueryError(400, f'no baseline model {model!r}')
+
+        loop = asyncio.get_running_loop()
+        try:
+            if path == '/computations':
+                return await loop.run_in_executor(self.executor, computations_json,
+                                                  dataset.sectors, window, model)
+
+            kind = params.get('kind', 'sectors')
+            if kind not in {'sectors', 'changes', 'percentage'}:
+                raise QueryError(400, f'no figure {kind!r}')
+            return await loop.run_in_executor(self.executor, figure_json, dataset.sectors,
+                                              window, model, kind)
+        except ValueError as error:
+            # e.g. the event window is not in the dataset
+            raise QueryError(400, str(error)) from error
+
+    @staticmethod
+    def series(dataset: Dataset, industry: str | None) -> bytes:
+        """Return the values of industry (or sector) in dataset as [year, month, value] lists,
+        or the names of every industry and sector if industry is None.
+
+        Raise QueryError if there is no such industry.
+        """
+        if industry is None:
+            return json.dumps({'sectors': list(dataset.sectors),
+                               'industries': list(dataset.industries)}).encode()
+
+        points = dataset.industries.get(industry, dataset.sectors.get(industry))
+        if points is None:
+            raise QueryError(404, f'no industry {industry!r}')
+        return json.dumps([[date[0], date[1], value] for date, value in points]).encode()
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """Read one HTTP request from reader and write the response to writer, which is closed
+        afterwards. Unexpected errors (e.g. a worker process that died) are answered with
+        status 500.
+
+        >>> class Writer:
+        ...     def write(self, data: bytes) -> None:
+        ...         print(data.split(b'\\r\\n')[0].decode())
+        ...     async def drain(self) -> None:
+        ...         pass
+        ...     def close(self) -> None:
+        ...         print('closed')
+        >>> async def broken(path: str, params: dict[str, str]) -> bytes:
+        ...     raise KeyError(path)
+        >>> service = QueryService(executor=None)
+        >>> service.answer = broken
+        >>> async def request() -> None:
+        ...     reader = asyncio.StreamReader()
+        ...     reader.feed_data(b'GET /datasets HTTP/1.1\\r\\n\\r\\n')
+        ...     reader.feed_eof()
+        ...     await service.handle_client(reader, Writer())
+        >>> logging.disable(logging.ERROR)
+        >>> asyncio.run(request())
+        HTTP/1.1 500 Internal Server Error
+        closed
+        >>> logging.disable(logging.NOTSET)
+        """
+        try:
+            try:
+                request = await reader.readuntil(b'\r\n\r\n')
+                method, target, _ = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+                status, body = 200, b''
+                if method != 'GET':
+                    raise QueryError(405, f'{method} is not supported')
+
+                url = urlsplit(target)
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                body = await self.answer(url.path, params)
+            except QueryError as error:
+                status, body = error.status, json.dumps({'error': str(error)}).encode()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                status, body = 400, json.dumps({'error': 'malformed request'}).encode()
+            except Exception:
+                logging.exception('error while answering a request')
+                status, body = 500, json.dumps({'error': 'internal error'}).encode()
+
+            writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def parse_window(text: str | None) -> EventWindow:
+    """Return the event window written as YEAR-MONTH[:LENGTH] in text (see main.parse_event),
+    or COVID_WINDOW if text is None.
+
+    Raise QueryError if text is not a valid event window.
+
+    >>> parse_window('2008-10:6').start
+    (2008, 10)
+    >>> for text in ['2020-13', '2020-03:0', '2020-03:-2', 'March']:
+    ...     try:
+    ...         parse_window(text)
+    ...     except QueryError as error:
+    ...         print(error.status, error)
+    400 invalid event '2020-13'
+    400 invalid event '2020-03:0'
+    400 invalid event '2020-03:-2'
+    400 invalid event 'March'
+    """
+    if text is None:
+        return COVID_WINDOW
+    try:
+        return parse_event(text)
+    except ValueError as error:
+        raise QueryError(400, f'invalid event {text!r}') from error
+
+
+async def serve(filenames: list[str], host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                max_workers: int | None = None, cache_size: int = CACHE_SIZE) -> None:
+    """Load every file in filenames and answer queries about them on host and port until the
+    process is stopped, with max_workers worker processes (one per CPU by default).
+
+    Preconditions:
+        - len(filenames) != 0
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        service = QueryService(executor, cache_size)
+        await service.load(filenames)
+
+        server = await asyncio.start_server(service.handle_client, host, port)
+        print(f'Serving {", ".join(service.datasets)} on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['argparse', 'asyncio', 'collections', 'json', 'logging', 'os',
+    #                       'concurrent.futures', 'dataclasses', 'typing', 'urllib.parse',
+    #                       'cache', 'computation', 'data', 'main', 'metrics', 'display'],
+    #     'allowed-io': ['serve'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    parser = argparse.ArgumentParser(description='Serve GDP computations on localhost.')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.files, DEFAULT_HOST, args.port, args.workers, args.cache_size))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,183 @@
+"""
+Synthetic Data Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Writes made-up datasets in exactly the layout of the StatCan extracts (samp1.csv), with any
+# number of industries and months, to measure how each stage of the program scales.
+
+import numpy as np
+
+from data import MONTHS, SECTOR_CODES, month_ordinal, ordinal_to_month
+
+MONTH_NAMES = list(MONTHS)
+
+# The aggregate rows at the top of the table, which belong to no sector
+AGGREGATES = ['All industries  [T001] 4', 'Goods-producing industries  [T002] 4',
+              'Service-producing industries  [T003] 4']
+
+FOOTNOTES = ['Aggregates are not always equal to the sum of their components.',
+             'Effective November 30, 2018 the data is presented on a 2012 reference year basis.']
+
+
+def industry_names(num_industries: int) -> list[str]:
+    """Return num_industries industry names, each ending with a NAICS code in square brackets.
+    The first names use the 2-digit sector codes, the others more detailed codes under them.
+
+    Preconditions:
+        - num_industries >= 0
+
+    >>> industry_names(3)
+    ['Synthetic industry 0  [11]', 'Synthetic industry 1  [21]', 'Synthetic industry 2  [22]']
+    >>> industry_names(22)[-1]
+    'Synthetic industry 21  [211]'
+    """
+    codes = [code for sector_codes in SECTOR_CODES.values() for code in sector_codes]
+
+    # ACCUMULATOR names: the industry names so far
+    names = []
+    for i in range(num_industries):
+        code = codes[i % len(codes)]
+        if i >= len(codes):
+            code = code.partition('-')[0] + str(i // len(codes))
+        names.append(f'Synthetic industry {i}  [{code}]')
+
+    return names
+
+
+def synthetic_values(num_industries: int, months: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Return made-up monthly GDP values (in millions) for num_industries industries over the
+    month ordinals in months: a linear trend with seasonality and noise, with a drop from
+    March 2020 that recovers over the following year.
+
+    Preconditions:
+        - num_industries >= 0
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(len(months))
+
+    levels = rng.uniform(1_000, 200_000, size=(num_industries, 1))
+    growth = rng.normal(0.002, 0.001, size=(num_industries, 1))
+    seasonality = rng.uniform(0, 0.02, size=(num_industries, 1)) * np.sin(2 * np.pi * months / 12)
+    noise = rng.normal(0, 0.004, size=(num_industries, len(months)))
+
+    since_shock = months - month_ordinal((2020, 3))
+    shock = np.where(since_shock >= 0, np.exp(-np.maximum(since_shock, 0) / 4), 0)
+    depth = rng.uniform(0, 0.5, size=(num_industries, 1))
+
+    values = levels * (1 + growth * t + seasonality + noise) * (1 - depth * shock)
+    return np.round(np.maximum(values, 0)).astype(np.int64)
+
+
+def write_synthetic_csv(filename: str, num_industries: int, num_months: int,
+                        end: tuple[int, int] = (2021, 8), seed: int = 0) -> None:
+    """Write a made-up dataset with num_industries industries (plus a few aggregates) and
+    num_months months ending with end to filename, laid out like the StatCan extracts:
+    the preamble, the date header, quoted values with thousands separators and the footnotes.
+
+    Preconditions:
+        - filename != ''
+        - num_industries >= 0
+        - num_months >= 1
+
+    >>> import os, tempfile
+    >>> from data import open_and_convert
+    >>> path = os.path.join(tempfile.mkdtemp(), 'synthetic.csv')
+    >>> write_synthetic_csv(path, 30, 90)
+    >>> data = open_and_convert(path, cache_dir=None)
+    >>> len(data), len(data['Synthetic industry 0  [11]']), data['All industries  [T001] 4'][-1][0]
+    (33, 90, (2021, 8))
+    """
+    months = np.arange(month_ordinal(end) - num_months + 1, month_ordinal(end) + 1)
+    dates = [ordinal_to_month(ordinal) for ordinal in months]
+    names = industry_names(num_industries)
+    values = synthetic_values(num_industries, months, seed)
+    totals = np.tile(values.sum(axis=0), (len(AGGREGATES), 1))
+    padding = [''] * (num_months - 1)
+
+    # ACCUMULATOR lines: the lines of the file so far
+    lines = [quote_row([line]) for line in
+             ['Gross domestic product (GDP) at basic prices, by industry, monthly '
+              '(x 1,000,000) 1 2', 'Frequency: Monthly',
+              'Table: 36-10-0434-01 (formerly CANSIM 379-0031)', 'Release date: 2021-10-29',
+              'Geography: Canada']]
+    lines.extend(['""', '""', ''])
+    for heading in ['Seasonally adjusted at annual rates', 'Chained (2012) dollars 3', 'Canada']:
+        lines.append(quote_row(['', heading] + padding))
+    lines.append(quote_row(['North American Industry Classification System (NAICS)']
+                           + [f'{MONTH_NAMES[date[1] - 1]} {date[0]}' for date in dates]))
+    lines.append(quote_row(['', 'Dollars'] + padding))
+
+    for name, row in zip(AGGREGATES + names, np.concatenate([totals, values]).tolist()):
+        lines.append(quote_row([name] + [f'{value:,}' for value in row]))
+
+    lines.extend(['', 'Footnotes:'])
+    lines.extend(f'{number},{quote_row([footnote])}'
+                 for number, footnote in enumerate(FOOTNOTES, start=1))
+    lines.extend(['', '', '', quote_row(['How to cite: Statistics Canada. Table 36-10-0434-01  '
+                                         'Gross domestic product (GDP) at basic prices, by '
+                                         'industry, monthly (x 1,000,000)'])])
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_synthetic_long_csv(filename: str, geographies: list[str], num_industries: int,
+                             num_months: int, end: tuple[int, int] = (2021, 8),
+                             seed: int = 0) -> None:
+    """Write a made-up dataset in the long format of the full StatCan download to filename:
+    one row per month, geography, industry, seasonal adjustment and price basis, for
+    num_industries industries (plus a few aggregates) in every geography in geographies.
+    Only the seasonally adjusted, chained (2012) dollars rows hold the synthetic values.
+
+    Preconditions:
+        - filename != ''
+        - num_industries >= 0
+        - num_months >= 1
+    """
+    months = np.arange(month_ordinal(end) - num_months + 1, month_ordinal(end) + 1)
+    dates = [ordinal_to_month(ordinal) for ordinal in months]
+    names = AGGREGATES + industry_names(num_industries)
+    header = ['REF_DATE', 'GEO', 'DGUID', 'Seasonal adjustment', 'Prices',
+              'North American Industry Classification System (NAICS)', 'UOM', 'UOM_ID',
+              'SCALAR_FACTOR', 'SCALAR_ID', 'VECTOR', 'COORDINATE', 'VALUE', 'STATUS',
+              'SYMBOL', 'TERMINATED', 'DECIMALS']
+    bases = [('Seasonally adjusted at annual rates', 'Chained (2012) dollars'),
+             ('Seasonally adjusted at annual rates', '2012 constant prices'),
+             ('Trading-day adjusted', 'Chained (2012) dollars')]
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(quote_row(header) + '\n')
+        for g, geography in enumerate(geographies):
+            values = synthetic_values(num_industries, months, seed + g)
+            table = np.concatenate([np.tile(values.sum(axis=0), (len(AGGREGATES), 1)), values])
+            for b, (adjustment, prices) in enumerate(bases):
+                for name, row in zip(names, (table * (b + 1)).tolist()):
+                    for date, value in zip(dates, row):
+                        f.write(quote_row([f'{date[0]}-{date[1]:02}', geography, '', adjustment,
+                                           prices, name, 'Dollars', '81', 'millions', '6', '',
+                                           '', f'{value}.0', '', '', '', '1']) + '\n')
+
+
+def quote_row(cells: list[str]) -> str:
+    """Return cells as a line of the StatCan csv files, where every non-empty cell is quoted.
+
+    >>> quote_row(['', 'Dollars', ''])
+    ',"Dollars",'
+    """
+    return ','.join('"' + cell.replace('"', '""') + '"' if cell != '' else '' for cell in cells)
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['numpy', 'data'],
+    #     'allowed-io': ['write_synthetic_csv'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()
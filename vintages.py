@@ -0,0 +1,201 @@
+"""
+Vintages Module for the final project (CSC110 at the University of Toronto)
+This file is Copyright (c) 2021 Xi Chen, Taymoor Farooq, Se-Eum Kim and Henry Klinck.
+"""
+
+# Compares several releases ("vintages") of the same StatCan table: how the GDP values, the
+# pre-pandemic baseline and the deviations from it were revised from one release to the next.
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from data import CACHE_DIR, DateIndex, Panel, cached_panel, load_panel, load_sector_panel, \
+    read_metadata
+from computation import COVID_WINDOW, EventWindow, deviation_matrix, event_start_index, \
+    fit_trends
+
+
+@dataclass
+class ReleaseComparison:
+    """Dataclass containing several releases of the same table, aligned on the months and
+    industries they all share, along with the baseline and deviations computed from each.
+    Instance Attributes:
+      - releases: the release date of each release, oldest first
+      - months: the month ordinals shared by every release
+      - industries: the industries shared by every release
+      - sectors: the names of the economic sectors
+      - industry_values: GDP values, with shape (releases, industries, months)
+      - sector_values: aggregated GDP values, with shape (releases, sectors, months)
+      - slopes: slope of each sector's pre-pandemic line of best fit, shape (releases, sectors)
+      - intercepts: intercept of each of these lines, with shape (releases, sectors)
+      - window: the event window the baselines and deviations are computed for
+      - deviations: actual minus expected GDP value of each sector in window, with shape
+        (releases, sectors, window.length)
+    Representation Invariants:
+      - self.industry_values.shape == (len(self.releases), len(self.industries), len(self.months))
+      - self.sector_values.shape == (len(self.releases), len(self.sectors), len(self.months))
+      - self.slopes.shape == self.intercepts.shape == (len(self.releases), len(self.sectors))
+    """
+    releases: list[str]
+    months: np.ndarray
+    industries: list[str]
+    sectors: list[str]
+    industry_values: np.ndarray
+    sector_values: np.ndarray
+    slopes: np.ndarray
+    intercepts: np.ndarray
+    window: EventWindow
+    deviations: np.ndarray
+
+    def industry_revisions(self) -> np.ndarray:
+        """Return the change in every industry's GDP values from each release to the next,
+        with shape (releases - 1, industries, months)."""
+        return np.diff(self.industry_values, axis=0)
+
+    def sector_revisions(self) -> np.ndarray:
+        """Return the change in every sector's GDP values from each release to the next,
+        with shape (releases - 1, sectors, months)."""
+        return np.diff(self.sector_values, axis=0)
+
+    def baseline_revisions(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the change in the slope and intercept of every sector's baseline from each
+        release to the next, each with shape (releases - 1, sectors)."""
+        return np.diff(self.slopes, axis=0), np.diff(self.intercepts, axis=0)
+
+    def deviation_revisions(self) -> np.ndarray:
+        """Return the change in every sector's deviations from each release to the next,
+        with shape (releases - 1, sectors, window.length)."""
+        return np.diff(self.deviations, axis=0)
+
+
+def load_release(filename: str, cache_dir: str | None = CACHE_DIR) -> tuple[str, Panel, Panel]:
+    """Return the release date of filename, its industry panel and its sector panel.
+    Runs in a worker process of compare_releases.
+
+    Preconditions:
+        - filename != ''
+    """
+    release = read_metadata(filename).get('Release date', filename)
+    industries = cached_panel(filename, 'industries', lambda: load_panel(filename), cache_dir)
+    sectors = cached_panel(filename, 'sectors', lambda: load_sector_panel(filename), cache_dir)
+
+    # Memory-mapped values cannot be sent back to the parent process
+    return release, _in_memory(industries), _in_memory(sectors)
+
+
+def compare_releases(filenames: list[str], max_workers: int | None = None,
+                     cache_dir: str | None = CACHE_DIR,
+                     window: EventWindow = COVID_WINDOW) -> ReleaseComparison:
+    """Load every file in filenames concurrently in a pool of max_workers processes (one per
+    CPU by default), align them and return their comparison around window.
+
+    Preconditions:
+        - len(filenames) != 0
+
+    >>> comparison = compare_releases(['samp2.csv', 'samp1.csv'], cache_dir=None)
+    >>> comparison.releases
+    ['2021-10-29', '2021-11-30']
+    >>> comparison.deviation_revisions()[0, 3].tolist()  # Quaternary Sector
+    [-113, 0, 198]
+    """
+    return align_releases(load_releases(filenames, max_workers, cache_dir), window)
+
+
+def load_releases(filenames: list[str], max_workers: int | None = None,
+                  cache_dir: str | None = CACHE_DIR) -> list[tuple[str, Panel, Panel]]:
+    """Load every file in filenames concurrently in a pool of max_workers processes (one per
+    CPU by default) and return their (release date, industry panel, sector panel) tuples
+    (see load_release), oldest release first, to be compared by align_releases.
+
+    Preconditions:
+        - len(filenames) != 0
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        loaded = list(executor.map(load_release, filenames, [cache_dir] * len(filenames)))
+
+    loaded.sort(key=lambda release: release[0])
+    return loaded
+
+
+def align_releases(loaded: list[tuple[str, Panel, Panel]],
+                   window: EventWindow = COVID_WINDOW) -> ReleaseComparison:
+    """Return the comparison of the (release date, industry panel, sector panel) tuples in
+    loaded around window, restricted to the months and industries that every release has.
+
+    Preconditions:
+        - len(loaded) != 0
+        - the whole window is in the months shared by every release
+    """
+    months = loaded[0][1].months
+    for _, industries, _ in loaded[1:]:
+        months = np.intersect1d(months, industries.months)
+
+    shared = set.intersection(*[set(release[1].industries) for release in loaded])
+    industry_names = [name for name in loaded[0][1].industries if name in shared]
+    sector_names = loaded[0][2].industries
+
+    industry_values = np.stack([_select(release[1], industry_names, months) for release in loaded])
+    sector_values = np.stack([_select(release[2], sector_names, months) for release in loaded])
+
+    window_start = event_start_index(window, DateIndex(months))
+    slopes, intercepts = fit_trends(sector_values[:, :, :window_start])
+    deviations = deviation_matrix(sector_values, slopes, intercepts, window_start, window.length)
+
+    return ReleaseComparison(releases=[release[0] for release in loaded], months=months,
+                             industries=industry_names, sectors=sector_names,
+                             industry_values=industry_values, sector_values=sector_values,
+                             slopes=slopes, intercepts=intercepts, window=window,
+                             deviations=deviations)
+
+
+def format_comparison(comparison: ReleaseComparison) -> str:
+    """Return a plain text summary of how each sector's baseline slope and deviations were
+    revised from each release to the next."""
+    slope_revisions, _ = comparison.baseline_revisions()
+    deviation_revisions = comparison.deviation_revisions()
+
+    # ACCUMULATOR lines: the lines of the summary so far
+    lines = []
+    for r in range(len(comparison.releases) - 1):
+        lines.append(f'{comparison.releases[r]} -> {comparison.releases[r + 1]}')
+        for s, sector in enumerate(comparison.sectors):
+            deviations = ' '.join(f'{d:>8}' for d in deviation_revisions[r, s].tolist())
+            lines.append(f'  {sector:<20} slope {slope_revisions[r, s]:>+10.1f}'
+                         f'  deviations {deviations}')
+
+    return '\n'.join(lines)
+
+
+def _select(panel: Panel, names: list[str], months: np.ndarray) -> np.ndarray:
+    """Return the rows of panel for names, restricted to the columns for months."""
+    rows = [panel.industry_index[name] for name in names]
+    columns = np.searchsorted(panel.months, months)
+    return panel.values[np.ix_(rows, columns)]
+
+
+def _in_memory(panel: Panel) -> Panel:
+    """Return panel with its values and status flags copied into memory.
+
+    >>> panel = Panel(['A'], np.array([24240]), np.array([[np.nan]]), flags=np.array([[2]]))
+    >>> _in_memory(panel).flags.tolist(), _in_memory(panel).flags is panel.flags
+    ([[2]], False)
+    """
+    return Panel(industries=list(panel.industries), months=np.array(panel.months),
+                 values=np.array(panel.values), groups=dict(panel.groups),
+                 flags=None if panel.flags is None else np.array(panel.flags))
+
+
+if __name__ == '__main__':
+    # import python_ta
+    #
+    # python_ta.check_all(config={
+    #     'extra-imports': ['concurrent.futures', 'dataclasses', 'numpy', 'data', 'computation'],
+    #     'max-line-length': 100,
+    #     'disable': ['R1705', 'C0200']
+    # })
+
+    import doctest
+
+    doctest.testmod()